@@ -1,16 +1,57 @@
 import os
+import json
 import datetime
-import hashlib
-from flask import Flask, session, url_for, redirect, render_template, request, abort, flash
-from database import list_users, verify, delete_user_from_db, add_user
+import logging
+from flask import Flask, Response, session, url_for, redirect, render_template, request, abort, flash, jsonify
+from database import list_users, verify, delete_user_from_db, add_user, list_jobs, count_user_data, shard_for
 from database import read_note_from_db, write_note_into_db, delete_note_from_db, match_user_id_with_note_id
-from database import image_upload_record, list_images_for_user, match_user_id_with_image_uid, delete_image_from_db
+from database import image_upload_record, list_images_for_user, match_user_id_with_image_id, delete_image_from_db, finish_image_migration, image_file_names
 from werkzeug.utils import secure_filename
+from logging_setup import setup_logging, bind_request_id, request_id
+from assets import load_manifest, asset_url, send_asset
+from jobs import JobWorkerPool, delete_user_later, remove_images_later
+from reconcile import start_reconciler
+from export import UserExport
+from sync import changes_since, start_compactor, InvalidCursor, ExpiredCursor, SYNC_PAGE_SIZE, SYNC_MAX_PAGE_SIZE
+from maintenance import start_maintenance, last_report
 
 
+setup_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config.from_object('config')
+# Hashed names of the built static files (see build_assets.py), used by asset_url() in templates
+asset_manifest = load_manifest(os.path.join(app.root_path, app.config['DIST_FOLDER']))
+app.jinja_env.globals['asset_url'] = lambda filename: asset_url(asset_manifest, filename)
+finish_image_migration(app.config['UPLOAD_FOLDER'])
+job_pool = JobWorkerPool(app.config['UPLOAD_FOLDER'])
+start_reconciler()
+start_compactor()
+start_maintenance()
+
+
+# Timestamps are stored as epoch microseconds and only turned into text when a page is rendered
+@app.template_filter("format_timestamp")
+def format_timestamp(micros):
+    return datetime.datetime.fromtimestamp(micros / 1000000).strftime("%Y-%m-%d %H:%M:%S")
+
+
+
+# Tag everything logged while serving a request with its correlation id, and hand the id back to the caller
+@app.before_request
+def FUN_assign_request_id():
+    bind_request_id(request.headers.get("X-Request-ID"))
+
+@app.after_request
+def FUN_return_request_id(response):
+    response.headers["X-Request-ID"] = request_id.get()
+    return response
+
+# Start the job workers lazily, so each gunicorn worker gets its own threads after forking
+@app.before_request
+def FUN_start_job_workers():
+    job_pool.start()
 
 
 
@@ -38,6 +79,10 @@ def FUN_413(error):
 
 
 
+@app.route("/assets/<path:filename>")
+def FUN_asset(filename):
+    return send_asset(os.path.join(app.root_path, app.config['DIST_FOLDER']), filename, request.headers.get("Accept-Encoding"))
+
 @app.route("/")
 def FUN_root():
     return render_template("index.html")
@@ -53,13 +98,13 @@ def FUN_private():
         notes_table = zip([x[0] for x in notes_list],\
                           [x[1] for x in notes_list],\
                           [x[2] for x in notes_list],\
-                          ["/delete_note/" + x[0] for x in notes_list])
+                          ["/delete_note/%d" % x[0] for x in notes_list])
 
         images_list = list_images_for_user(session['current_user'])
         images_table = zip([x[0] for x in images_list],\
                           [x[1] for x in images_list],\
                           [x[2] for x in images_list],\
-                          ["/delete_image/" + x[0] for x in images_list])
+                          ["/delete_image/%d" % x[0] for x in images_list])
 
         return render_template("private_page.html", notes = notes_table, images = images_table)
     else:
@@ -68,14 +113,22 @@ def FUN_private():
 @app.route("/admin/")
 def FUN_admin():
     if session.get("current_user", None) == "ADMIN":
-        user_list = list_users()
-        user_table = zip(range(1, len(user_list)+1),\
-                        user_list,\
-                        [x + y for x,y in zip(["/delete_user/"] * len(user_list), user_list)])
-        return render_template("admin.html", users = user_table)
+        return render_template("admin.html", users = user_table(), jobs = job_table(), maintenance = last_report())
     else:
         return abort(401)
 
+def user_table():
+    # Accounts for the admin page, with their data counted across every shard: (number, id, delete link, notes, images, shard)
+    counts = count_user_data()
+    return [(number, id, "/delete_user/" + id, counts.get(id, [0, 0])[0], counts.get(id, [0, 0])[1], shard_for(id))
+            for number, id in enumerate(list_users(), start=1)]
+
+def job_table():
+    # Recent background jobs for the admin page: (id, kind, payload, status, attempts, progress, error, updated)
+    return [(job_id, kind, json.loads(payload), status, attempts,
+             "%d / %d" % (done, total) if total is not None else str(done), error, updated)
+            for job_id, kind, payload, status, attempts, done, total, error, updated in list_jobs(20)]
+
 
 
 
@@ -85,14 +138,17 @@ def FUN_admin():
 def FUN_write_note():
     text_to_write = request.form.get("text_note_to_take")
     write_note_into_db(session['current_user'], text_to_write)
+    logger.info("User %s wrote a note", session['current_user'])
 
     return(redirect(url_for("FUN_private")))
 
-@app.route("/delete_note/<note_id>", methods = ["GET"])
+@app.route("/delete_note/<int:note_id>", methods = ["GET"])
 def FUN_delete_note(note_id):
-    if session.get("current_user", None) == match_user_id_with_note_id(note_id): # Ensure the current user is NOT operating on other users' note.
-        delete_note_from_db(note_id)
+    if "current_user" in session and session["current_user"] == match_user_id_with_note_id(note_id, session["current_user"]): # Ensure the current user is NOT operating on other users' note.
+        delete_note_from_db(note_id, session["current_user"])
+        logger.info("User %s deleted note %d", session['current_user'], note_id)
     else:
+        logger.warning("User %s may not delete note %d", session.get("current_user"), note_id)
         return abort(401)
     return(redirect(url_for("FUN_private")))
 
@@ -117,25 +173,30 @@ def FUN_upload_image():
             return(redirect(url_for("FUN_private")))
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            upload_time = str(datetime.datetime.now())
-            image_uid = hashlib.sha1((upload_time + filename).encode()).hexdigest()
+            # Record this uploading in database, which assigns the image id
+            image_id = image_upload_record(session['current_user'], filename)
             # Save the image into UPLOAD_FOLDER
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], image_uid + "-" + filename))
-            # Record this uploading in database
-            image_upload_record(image_uid, session['current_user'], filename, upload_time)
+            try:
+                file.save(os.path.join(app.config['UPLOAD_FOLDER'], "%d-%s" % (image_id, filename)))
+            except Exception:
+                delete_image_from_db(image_id, session['current_user'])
+                raise
+            logger.info("User %s uploaded image %d (%s)", session['current_user'], image_id, filename)
             return(redirect(url_for("FUN_private")))
 
     return(redirect(url_for("FUN_private")))
 
-@app.route("/delete_image/<image_uid>", methods = ["GET"])
-def FUN_delete_image(image_uid):
-    if session.get("current_user", None) == match_user_id_with_image_uid(image_uid): # Ensure the current user is NOT operating on other users' note.
+@app.route("/delete_image/<int:image_id>", methods = ["GET"])
+def FUN_delete_image(image_id):
+    if "current_user" in session and session["current_user"] == match_user_id_with_image_id(image_id, session["current_user"]): # Ensure the current user is NOT operating on other users' note.
+        filenames = image_file_names([image_id], [])
         # delete the corresponding record in database
-        delete_image_from_db(image_uid)
-        # delete the corresponding image file from image pool
-        image_to_delete_from_pool = [y for y in [x for x in os.listdir(app.config['UPLOAD_FOLDER'])] if y.split("-", 1)[0] == image_uid][0]
-        os.remove(os.path.join(app.config['UPLOAD_FOLDER'], image_to_delete_from_pool))
+        delete_image_from_db(image_id, session["current_user"])
+        # the corresponding image file is removed from image pool by a background job
+        remove_images_later(filenames)
+        logger.info("User %s deleted image %d", session['current_user'], image_id)
     else:
+        logger.warning("User %s may not delete image %d", session.get("current_user"), image_id)
         return abort(401)
     return(redirect(url_for("FUN_private")))
 
@@ -144,12 +205,63 @@ def FUN_delete_image(image_uid):
 
 
 
+@app.route("/export/<id>/", methods = ["GET"])
+def FUN_export(id):
+    # Users can export their own data; the admin can export anyone's
+    if session.get("current_user", None) not in (id, "ADMIN"):
+        return abort(401)
+    if id not in list_users():
+        return abort(404)
+
+    export = UserExport(id, app.config['UPLOAD_FOLDER'])
+    headers = {"ETag": '"%s"' % export.etag, "Accept-Ranges": "bytes",
+               "Content-Disposition": 'attachment; filename="%s-export.tar"' % id}
+    start, stop, status = 0, export.size, 200
+    # Resume an interrupted download, unless the data (and so the archive) has changed since it started.
+    # Only single ranges are served; for several, the whole archive is sent as if none had been asked for.
+    if request.range is not None and len(request.range.ranges) == 1 and request.headers.get("If-Range", headers["ETag"]) == headers["ETag"]:
+        requested = request.range.range_for_length(export.size)
+        if requested is None:
+            export.close()
+            headers["Content-Range"] = "bytes */%d" % export.size
+            return Response(status=416, headers=headers)
+        start, stop = requested
+        status = 206
+        headers["Content-Range"] = "bytes %d-%d/%d" % (start, stop - 1, export.size)
+    headers["Content-Length"] = str(stop - start)
+    logger.info("User %s exported data of %s (bytes %d-%d of %d)", session['current_user'], id, start, stop, export.size)
+    return Response(export.stream(start, stop), status=status, headers=headers, mimetype="application/x-tar")
+
+
+
+
+
+@app.route("/sync", methods = ["GET"])
+def FUN_sync():
+    if "current_user" not in session:
+        return abort(401)
+    limit = min(request.args.get("limit", SYNC_PAGE_SIZE, type=int), SYNC_MAX_PAGE_SIZE)
+    try:
+        return jsonify(changes_since(session['current_user'], request.args.get("cursor"), max(limit, 1)))
+    except InvalidCursor:
+        return jsonify(error="invalid cursor"), 400
+    except ExpiredCursor:
+        # Tombstones this client hasn't seen were compacted away: it must sync again from the start
+        return jsonify(error="cursor expired, sync again without a cursor"), 410
+
+
+
+
+
 @app.route("/login", methods = ["POST"])
 def FUN_login():
     id_submitted = request.form.get("id").upper()
     if (id_submitted in list_users()) and verify(id_submitted, request.form.get("pw")):
         session['current_user'] = id_submitted
-    
+        logger.info("User %s logged in", id_submitted)
+    else:
+        logger.warning("Failed login for %s", id_submitted)
+
     return(redirect(url_for("FUN_root")))
 
 @app.route("/logout/")
@@ -163,13 +275,11 @@ def FUN_delete_user(id):
         if id == "ADMIN": # ADMIN account can't be deleted.
             return abort(403)
 
-        # [1] Delete this user's images in image pool
-        images_to_remove = [x[0] for x in list_images_for_user(id)]
-        for f in images_to_remove:
-            image_to_delete_from_pool = [y for y in [x for x in os.listdir(app.config['UPLOAD_FOLDER'])] if y.split("-", 1)[0] == f][0]
-            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], image_to_delete_from_pool))
-        # [2] Delele the records in database files
+        # [1] Delete the account, so it can't be used any more
         delete_user_from_db(id)
+        # [2] Delete this user's notes, images and image files in the background; progress shows on the admin page
+        job_id = delete_user_later(id)
+        logger.info("Admin deleted user %s; job %d removes their data", id, job_id)
         return(redirect(url_for("FUN_admin")))
     else:
         return abort(401)
@@ -179,19 +289,12 @@ def FUN_add_user():
     if session.get("current_user", None) == "ADMIN": # only Admin should be able to add user.
         # before we add the user, we need to ensure this is doesn't exsit in database. We also need to ensure the id is valid.
         if request.form.get('id').upper() in list_users():
-            user_list = list_users()
-            user_table = zip(range(1, len(user_list)+1),\
-                            user_list,\
-                            [x + y for x,y in zip(["/delete_user/"] * len(user_list), user_list)])
-            return(render_template("admin.html", id_to_add_is_duplicated = True, users = user_table))
+            return(render_template("admin.html", id_to_add_is_duplicated = True, users = user_table(), jobs = job_table(), maintenance = last_report()))
         if " " in request.form.get('id') or "'" in request.form.get('id'):
-            user_list = list_users()
-            user_table = zip(range(1, len(user_list)+1),\
-                            user_list,\
-                            [x + y for x,y in zip(["/delete_user/"] * len(user_list), user_list)])
-            return(render_template("admin.html", id_to_add_is_invalid = True, users = user_table))
+            return(render_template("admin.html", id_to_add_is_invalid = True, users = user_table(), jobs = job_table(), maintenance = last_report()))
         else:
             add_user(request.form.get('id'), request.form.get('pw'))
+            logger.info("Admin added user %s", request.form.get('id').upper())
             return(redirect(url_for("FUN_admin")))
     else:
         return abort(401)
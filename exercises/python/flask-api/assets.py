@@ -0,0 +1,47 @@
+import json
+import mimetypes
+import os
+
+from flask import url_for, send_from_directory
+from werkzeug.http import parse_accept_header
+
+MANIFEST_NAME = "manifest.json"
+COMPRESSIBLE_EXTENSIONS = (".css", ".js", ".svg", ".json", ".txt")
+# Hashed file names change whenever their content does, so browsers never need to revalidate them
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Preferred first; each is only served when build_assets.py wrote a smaller copy with this suffix
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+def load_manifest(dist_folder):
+    """Map of static/ paths to their hashed names in dist_folder; empty until build_assets.py has run"""
+    try:
+        with open(os.path.join(dist_folder, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def asset_url(manifest, filename):
+    if filename in manifest:
+        return url_for("FUN_asset", filename=manifest[filename])
+    # Not built yet: fall back to Flask's own static route
+    return url_for("static", filename=filename)
+
+
+def send_asset(dist_folder, filename, accept_encoding):
+    accepted = parse_accept_header(accept_encoding)
+    encoding, suffix = None, ""
+    for candidate, candidate_suffix in ENCODINGS:
+        if accepted[candidate] > 0 and os.path.isfile(os.path.join(dist_folder, filename + candidate_suffix)):
+            encoding, suffix = candidate, candidate_suffix
+            break
+
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    response = send_from_directory(dist_folder, filename + suffix, mimetype=mimetype, conditional=True)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    if filename.endswith(COMPRESSIBLE_EXTENSIONS):
+        response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
@@ -0,0 +1,98 @@
+"""
+Build step for the files under static/: copies each one into dist/ under a name carrying a hash
+of its content (css/bootstrap.min.united.css -> css/bootstrap.min.united.3f9c1e02ab.css), writes
+gzip and, if the Brotli package is installed, brotli copies of the text files next to it, and
+records the mapping in dist/manifest.json. Templates link to the hashed names through asset_url(),
+so browsers can cache them for a year and still pick up a new version as soon as it is built.
+
+Run it after changing anything under static/:
+
+    python build_assets.py
+"""
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shutil
+
+from assets import MANIFEST_NAME, COMPRESSIBLE_EXTENSIONS
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(APP_DIR, "static")
+DIST_DIR = os.path.join(APP_DIR, "dist")
+
+# url(...) references in stylesheets, rewritten to the hashed names of the files they point at
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+def hashed_name(path, data):
+    root, ext = posixpath.splitext(path)
+    return "%s.%s%s" % (root, hashlib.sha256(data).hexdigest()[:10], ext)
+
+
+def rewrite_css_urls(path, data, manifest):
+    def replace(match):
+        quote, url = match.groups()
+        target, _, suffix = url.partition("?")
+        resolved = posixpath.normpath(posixpath.join(posixpath.dirname(path), target))
+        if resolved not in manifest:
+            return match.group(0)
+        relative = posixpath.relpath(manifest[resolved], posixpath.dirname(path))
+        return "url(%s%s%s)" % (quote, relative + ("?" + suffix if suffix else ""), quote)
+
+    return CSS_URL.sub(replace, data.decode("utf-8")).encode("utf-8")
+
+
+def write_compressed(path, data):
+    """Write .gz/.br copies that are smaller than the original; returns the encodings written"""
+    encodings = []
+    variants = [("gzip", ".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(("br", ".br", brotli.compress(data)))
+    for encoding, suffix, compressed in variants:
+        if len(compressed) < len(data):
+            with open(path + suffix, "wb") as f:
+                f.write(compressed)
+            encodings.append(encoding)
+    return encodings
+
+
+def build():
+    sources = []
+    for directory, _, files in os.walk(STATIC_DIR):
+        for name in files:
+            sources.append(posixpath.relpath(os.path.join(directory, name), STATIC_DIR).replace(os.sep, "/"))
+    # Stylesheets go last so the files they reference already have their hashed names
+    sources.sort(key=lambda path: (path.endswith(".css"), path))
+
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    manifest = {}
+    for path in sources:
+        with open(os.path.join(STATIC_DIR, path), "rb") as f:
+            data = f.read()
+        if path.endswith(".css"):
+            data = rewrite_css_urls(path, data, manifest)
+        manifest[path] = hashed_name(path, data)
+
+        target = os.path.join(DIST_DIR, manifest[path])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as f:
+            f.write(data)
+        encodings = write_compressed(target, data) if path.endswith(COMPRESSIBLE_EXTENSIONS) else []
+        print("%-40s -> %s %s" % (path, manifest[path], " ".join(encodings)))
+
+    with open(os.path.join(DIST_DIR, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    build()
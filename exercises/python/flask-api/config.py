@@ -1,3 +1,4 @@
 SECRET_KEY = "fdsafasd"
 UPLOAD_FOLDER = "image_pool"
-MAX_CONTENT_LENGTH = 16 * 1024 * 1024
\ No newline at end of file
+MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+DIST_FOLDER = "dist"
@@ -1,155 +1,552 @@
+import os
+import json
+import time
+import random
 import sqlite3
 import hashlib
+import logging
 import datetime
 
-user_db_file_location = "database_file/users.db"
-note_db_file_location = "database_file/notes.db"
-image_db_file_location = "database_file/images.db"
+logger = logging.getLogger(__name__)
 
-def list_users():
-    _conn = sqlite3.connect(user_db_file_location)
-    _c = _conn.cursor()
-
-    _c.execute("SELECT id FROM users;")
-    result = [x[0] for x in _c.fetchall()]
+DATABASE_DIR = os.getenv("DATABASE_DIR", "database_file")
+user_db_file_location = os.path.join(DATABASE_DIR, "users.db")
+note_db_file_location = os.path.join(DATABASE_DIR, "notes.db")
+image_db_file_location = os.path.join(DATABASE_DIR, "images.db")
+job_db_file_location = os.path.join(DATABASE_DIR, "jobs.db")
 
-    _conn.close()
-    
-    return result
+# How long one statement waits for another process's lock before SQLite gives up with "database is locked"
+BUSY_TIMEOUT_MS = int(os.getenv("DATABASE_BUSY_TIMEOUT_MS", "5000"))
+# A write that still finds the database locked is retried this many times, after a random (jittered) pause
+WRITE_RETRIES = int(os.getenv("DATABASE_WRITE_RETRIES", "5"))
+RETRY_BASE_DELAY = 0.05
+RETRY_MAX_DELAY = 1.0
+
+# With DATABASE_SHARDS=N (N > 1) each user's notes and image records live in shards/<k>/notes.db and images.db,
+# k chosen by a stable hash of the user id, so writes for different users take different write locks and run in
+# parallel. Users and jobs stay in one file each. Change N with rebalance.py, which moves the rows to match.
+DATABASE_SHARDS = int(os.getenv("DATABASE_SHARDS", "0"))
+# Sharded note and image ids end in the shard that assigned them (id % SHARD_ID_STRIDE), so they are unique across shards
+SHARD_ID_STRIDE = 1024
+if DATABASE_SHARDS > SHARD_ID_STRIDE:
+    raise ValueError("DATABASE_SHARDS can be at most %d" % SHARD_ID_STRIDE)
+
+
+
+def shard_for(user, shards=None):
+    """The shard holding a user's notes and images, or None when storage isn't sharded"""
+    shards = DATABASE_SHARDS if shards is None else shards
+    if shards <= 1:
+        return None
+    # Not hash(): that changes from one process to the next
+    return int.from_bytes(hashlib.sha1(user.upper().encode("utf-8")).digest()[:8], "big") % shards
+
+
+def shard_dir(shard):
+    return DATABASE_DIR if shard is None else os.path.join(DATABASE_DIR, "shards", str(shard))
+
+
+def note_db_location_for(user, shards=None):
+    return os.path.join(shard_dir(shard_for(user, shards)), "notes.db")
+
+
+def image_db_location_for(user, shards=None):
+    return os.path.join(shard_dir(shard_for(user, shards)), "images.db")
+
+
+def note_db_locations(shards=None):
+    # Every notes.db in use, for work that covers all users
+    shards = DATABASE_SHARDS if shards is None else shards
+    if shards <= 1:
+        return [note_db_file_location]
+    return [os.path.join(shard_dir(k), "notes.db") for k in range(shards)]
+
+
+def image_db_locations(shards=None):
+    shards = DATABASE_SHARDS if shards is None else shards
+    if shards <= 1:
+        return [image_db_file_location]
+    return [os.path.join(shard_dir(k), "images.db") for k in range(shards)]
+
+
+def database_locations():
+    # Every database file in use, for maintenance and backups
+    return [user_db_file_location, job_db_file_location] + note_db_locations() + image_db_locations()
+
+
+def _next_id(_c, table, location):
+    # The id for a new row in a sharded file: above every id this file has ever held, ending in its shard number.
+    # None when not sharded, so AUTOINCREMENT picks it.
+    if DATABASE_SHARDS <= 1:
+        return None
+    shard = int(os.path.basename(os.path.dirname(location)))
+    row = _c.execute("SELECT seq FROM sqlite_sequence WHERE name = ?;", (table,)).fetchone()
+    return ((row[0] if row else 0) // SHARD_ID_STRIDE + 1) * SHARD_ID_STRIDE + shard
+
+
+def epoch_micros(moment=None):
+    """Microseconds since the Unix epoch, the unit timestamps are stored in; now when no datetime is given"""
+    if moment is None:
+        return time.time_ns() // 1000
+    return round(moment.timestamp() * 1000000)
+
+
+def _retype_timestamps(table, columns):
+    # Copy `table` into a new table with an INTEGER timestamp, converting the old str(datetime.now()) text (local
+    # time). A text-affinity column would turn integers back into text, so the table has to be rebuilt.
+    def migrate(_c):
+        _c.execute("CREATE TABLE %s_v2 (%s);" % (table, columns))
+        names = [row[1] for row in _c.execute("PRAGMA table_info(%s);" % table)]
+        rows = [dict(zip(names, row)) for row in _c.execute("SELECT * FROM %s;" % table)]
+        for row in rows:
+            row["timestamp"] = epoch_micros(datetime.datetime.fromisoformat(row["timestamp"]))
+        if rows:
+            _c.executemany("INSERT INTO %s_v2 (%s) VALUES (%s);" % (table, ", ".join(names), ", ".join("?" * len(names))),
+                           [[row[name] for name in names] for row in rows])
+        # Carry the AUTOINCREMENT counter over, so ids of deleted rows are never handed out again
+        _c.execute("DELETE FROM sqlite_sequence WHERE name = ?;", (table + "_v2",))
+        _c.execute("INSERT INTO sqlite_sequence (name, seq) SELECT ?, seq FROM sqlite_sequence WHERE name = ?;", (table + "_v2", table))
+        _c.execute("DROP TABLE %s;" % table)
+        _c.execute("ALTER TABLE %s_v2 RENAME TO %s;" % (table, table))
+    return migrate
+
+
+def _change_log(table, owner, key):
+    # An append-only log of the rows put into and deleted from `table`, for /sync. Triggers write each entry in the
+    # same transaction as the change itself, whichever code path makes it; existing rows are logged as puts.
+    # sync_horizon is the newest log entry compaction has dropped: a cursor older than that may have missed deletes.
+    now = "CAST(strftime('%s', 'now') AS INTEGER)"
+    return ["CREATE TABLE {t}_changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, {o} text NOT NULL, {k} INTEGER NOT NULL, op text NOT NULL, changed_at INTEGER NOT NULL);".format(t=table, o=owner, k=key),
+            "CREATE INDEX {t}_changes_{o}_seq ON {t}_changes ({o}, seq);".format(t=table, o=owner),
+            "CREATE INDEX {t}_changes_{k} ON {t}_changes ({k}, seq);".format(t=table, k=key),
+            "CREATE TRIGGER {t}_log_put AFTER INSERT ON {t} BEGIN INSERT INTO {t}_changes ({o}, {k}, op, changed_at) VALUES (NEW.{o}, NEW.{k}, 'put', {now}); END;".format(t=table, o=owner, k=key, now=now),
+            "CREATE TRIGGER {t}_log_delete AFTER DELETE ON {t} BEGIN INSERT INTO {t}_changes ({o}, {k}, op, changed_at) VALUES (OLD.{o}, OLD.{k}, 'delete', {now}); END;".format(t=table, o=owner, k=key, now=now),
+            "INSERT INTO {t}_changes ({o}, {k}, op, changed_at) SELECT {o}, {k}, 'put', {now} FROM {t} ORDER BY {k};".format(t=table, o=owner, k=key, now=now),
+            "CREATE TABLE sync_horizon (seq INTEGER NOT NULL);",
+            "INSERT INTO sync_horizon VALUES (0);"]
+
+
+# Schema changes per database file, applied in order; PRAGMA user_version records how many have run.
+# A step is an SQL statement or a function called with the migration's cursor.
+MIGRATIONS = {
+    "users.db": [
+        ["CREATE TABLE IF NOT EXISTS users (id text primary key, pw text);"],
+    ],
+    "notes.db": [
+        # Integer primary keys: ids are assigned in insertion (time) order, never reused, and looking a note up is one B-tree probe
+        ["CREATE TABLE IF NOT EXISTS notes (user text, timestamp text, note text, note_id text);",
+         "CREATE TABLE notes_v1 (note_id INTEGER PRIMARY KEY AUTOINCREMENT, user text NOT NULL, timestamp text, note text);",
+         "INSERT INTO notes_v1 (user, timestamp, note) SELECT user, timestamp, note FROM notes ORDER BY timestamp;",
+         "DROP TABLE notes;",
+         "ALTER TABLE notes_v1 RENAME TO notes;"],
+        # Timestamps as integer epoch microseconds, indexed per user for ordered and time-range queries
+        [_retype_timestamps("notes", "note_id INTEGER PRIMARY KEY AUTOINCREMENT, user text NOT NULL, timestamp INTEGER NOT NULL, note text"),
+         "CREATE INDEX notes_user_timestamp ON notes (user, timestamp);"],
+        _change_log("notes", "user", "note_id"),
+    ],
+    "images.db": [
+        # legacy_uid remembers the old SHA-1 id until the file in the image pool is renamed (see finish_image_migration)
+        ["CREATE TABLE IF NOT EXISTS images (uid text unique, owner text, name text, timestamp text);",
+         "CREATE TABLE images_v1 (image_id INTEGER PRIMARY KEY AUTOINCREMENT, owner text NOT NULL, name text, timestamp text, legacy_uid text);",
+         "INSERT INTO images_v1 (owner, name, timestamp, legacy_uid) SELECT owner, name, timestamp, uid FROM images ORDER BY timestamp;",
+         "DROP TABLE images;",
+         "ALTER TABLE images_v1 RENAME TO images;"],
+        [_retype_timestamps("images", "image_id INTEGER PRIMARY KEY AUTOINCREMENT, owner text NOT NULL, name text, timestamp INTEGER NOT NULL, legacy_uid text"),
+         "CREATE INDEX images_owner_timestamp ON images (owner, timestamp);"],
+        _change_log("images", "owner", "image_id"),
+    ],
+    "jobs.db": [
+        # Background work for jobs.py; a running job whose lease has expired was abandoned by a dead worker and is claimed again
+        ["CREATE TABLE jobs (job_id INTEGER PRIMARY KEY AUTOINCREMENT, kind text NOT NULL, payload text NOT NULL, "
+         "status text NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0, run_at INTEGER NOT NULL, lease_until INTEGER, "
+         "progress_done INTEGER NOT NULL DEFAULT 0, progress_total INTEGER, error text, created INTEGER NOT NULL, updated INTEGER NOT NULL);",
+         "CREATE INDEX jobs_status_run_at ON jobs (status, run_at);"],
+    ],
+}
+
+_prepared = set()
+
+
+def _migrate(_c, location):
+    migrations = MIGRATIONS.get(os.path.basename(location), [])
+    version = _c.execute("PRAGMA user_version;").fetchone()[0]
+    for number, statements in enumerate(migrations[version:], start=version + 1):
+        for statement in statements:
+            if callable(statement):
+                statement(_c)
+            else:
+                _c.execute(statement)
+        _c.execute("PRAGMA user_version = %d;" % number)
+        logger.info("Migrated %s to schema version %d", location, number)
+
+
+def _prepare(location):
+    # Once per process and file: switch to WAL, which lets readers carry on while one writer commits (the
+    # setting is stored in the file), and bring the schema up to date. Workers starting together queue on the
+    # write lock, and each re-reads user_version inside the transaction, so every migration runs exactly once.
+    if location in _prepared:
+        return
+    os.makedirs(os.path.dirname(location) or ".", exist_ok=True)
+    _conn = sqlite3.connect(location, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    try:
+        # Lets maintenance.py hand free pages back to the file system; only takes effect on a new file, or after a VACUUM
+        _conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+        _conn.execute("PRAGMA journal_mode = WAL;")
+        _c = _conn.cursor()
+        _c.execute("BEGIN IMMEDIATE;")
+        try:
+            _migrate(_c, location)
+            _c.execute("COMMIT;")
+        except Exception:
+            _c.execute("ROLLBACK;")
+            raise
+    finally:
+        _conn.close()
+    _prepared.add(location)
+
+
+def _connect(location, readonly=False):
+    _prepare(location)
+    if readonly:
+        _conn = sqlite3.connect("file:%s?mode=ro" % location, uri=True, timeout=BUSY_TIMEOUT_MS / 1000)
+    else:
+        # Autocommit mode: transactions are opened explicitly by _write()
+        _conn = sqlite3.connect(location, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        # Safe with WAL: a crash can lose the last commits but never corrupt the file
+        _conn.execute("PRAGMA synchronous = NORMAL;")
+    _conn.execute("PRAGMA busy_timeout = %d;" % BUSY_TIMEOUT_MS)
+    return _conn
+
+
+def _read(location, command, parameters=()):
+    _conn = _connect(location, readonly=True)
+    try:
+        return _conn.execute(command, parameters).fetchall()
+    finally:
+        _conn.close()
+
+
+def _is_locked(error):
+    return "locked" in str(error) or "busy" in str(error)
+
+
+def _write(location, work):
+    """Run work(cursor) in its own short write transaction, retrying with jitter while the database is locked.
+
+    BEGIN IMMEDIATE takes the write lock before any statement runs, so a busy database fails fast at the
+    start of the transaction instead of half-way through it, and the whole transaction can be retried.
+    """
+    for attempt in range(WRITE_RETRIES + 1):
+        _conn = _connect(location)
+        try:
+            _c = _conn.cursor()
+            _c.execute("BEGIN IMMEDIATE;")
+            result = work(_c)
+            _c.execute("COMMIT;")
+            return result
+        except sqlite3.OperationalError as error:
+            if _conn.in_transaction:
+                _conn.rollback()
+            if not _is_locked(error) or attempt == WRITE_RETRIES:
+                raise
+            # Full jitter, so writers that collided don't retry in lockstep
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            logger.warning("%s is locked (attempt %d of %d), retrying in %.3fs", location, attempt + 1, WRITE_RETRIES + 1, delay)
+            time.sleep(delay)
+        finally:
+            _conn.close()
 
-def verify(id, pw):
-    _conn = sqlite3.connect(user_db_file_location)
-    _c = _conn.cursor()
 
-    _c.execute("SELECT pw FROM users WHERE id = '" + id + "';")
-    result = _c.fetchone()[0] == hashlib.sha256(pw.encode()).hexdigest()
-    
-    _conn.close()
+def list_users():
+    return [x[0] for x in _read(user_db_file_location, "SELECT id FROM users;")]
+
+def count_user_data():
+    # {user: [notes, images]} gathered from every shard, for the admin page
+    counts = {}
+    for location in note_db_locations():
+        for user, notes in _read(location, "SELECT user, count(*) FROM notes GROUP BY user;"):
+            counts.setdefault(user, [0, 0])[0] += notes
+    for location in image_db_locations():
+        for owner, images in _read(location, "SELECT owner, count(*) FROM images GROUP BY owner;"):
+            counts.setdefault(owner, [0, 0])[1] += images
+    return counts
 
-    return result
+def verify(id, pw):
+    result = _read(user_db_file_location, "SELECT pw FROM users WHERE id = ?;", (id,))
+    return len(result) > 0 and result[0][0] == hashlib.sha256(pw.encode()).hexdigest()
 
 def delete_user_from_db(id):
-    _conn = sqlite3.connect(user_db_file_location)
-    _c = _conn.cursor()
-    _c.execute("DELETE FROM users WHERE id = ?;", (id))
-    _conn.commit()
-    _conn.close()
-
-    # when we delete a user FROM database USERS, we also need to delete all his or her notes data FROM database NOTES
-    _conn = sqlite3.connect(note_db_file_location)
-    _c = _conn.cursor()
-    _c.execute("DELETE FROM notes WHERE user = ?;", (id))
-    _conn.commit()
-    _conn.close()
-
-    # when we delete a user FROM database USERS, we also need to 
-    # [1] delete all his or her images FROM image pool (done in app.py)
-    # [2] delete all his or her images records FROM database IMAGES
-    _conn = sqlite3.connect(image_db_file_location)
-    _c = _conn.cursor()
-    _c.execute("DELETE FROM images WHERE owner = ?;", (id))
-    _conn.commit()
-    _conn.close()
+    # when we delete a user FROM database USERS, we also need to delete all his or her notes and images;
+    # that is done in the background by the "delete_user_data" job (see jobs.py)
+    _write(user_db_file_location, lambda _c: _c.execute("DELETE FROM users WHERE id = ?;", (id,)))
 
-def add_user(id, pw):
-    _conn = sqlite3.connect(user_db_file_location)
-    _c = _conn.cursor()
+def delete_notes_for_user(id, before):
+    # Notes written before `before` (epoch microseconds), so a re-created account keeps its new notes
+    return _write(note_db_location_for(id), lambda _c: _c.execute("DELETE FROM notes WHERE user = ? AND timestamp < ?;", (id.upper(), before)).rowcount)
 
-    _c.execute("INSERT INTO users values(?, ?)", (id.upper(), hashlib.sha256(pw.encode()).hexdigest()))
-    
-    _conn.commit()
-    _conn.close()
+def add_user(id, pw):
+    _write(user_db_file_location,
+           lambda _c: _c.execute("INSERT INTO users values(?, ?)", (id.upper(), hashlib.sha256(pw.encode()).hexdigest())))
 
 def read_note_from_db(id):
-    _conn = sqlite3.connect(note_db_file_location)
-    _c = _conn.cursor()
-
-    command = "SELECT note_id, timestamp, note FROM notes WHERE user = '" + id.upper() + "';" 
-    _c.execute(command)
-    result = _c.fetchall()
-
-    _conn.commit()
-    _conn.close()
-
-    return result
-
-def match_user_id_with_note_id(note_id):
+    return _read(note_db_location_for(id), "SELECT note_id, timestamp, note FROM notes WHERE user = ? ORDER BY timestamp, note_id;", (id.upper(),))
+
+def read_notes_between(id, start, end):
+    # Notes written from `start` up to (not including) `end`, both in epoch microseconds, oldest first
+    return _read(note_db_location_for(id),
+                 "SELECT note_id, timestamp, note FROM notes WHERE user = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp, note_id;",
+                 (id.upper(), start, end))
+
+def read_latest_notes(id, limit):
+    # The `limit` most recent notes, newest first
+    return _read(note_db_location_for(id),
+                 "SELECT note_id, timestamp, note FROM notes WHERE user = ? ORDER BY timestamp DESC, note_id DESC LIMIT ?;",
+                 (id.upper(), limit))
+
+def _holding(locations, table, key, ids):
+    # {location: [ids it holds]} for the files among `locations` that hold any of these rows
+    if len(locations) == 1:
+        return {locations[0]: list(ids)}
+    holding = {}
+    for location in locations:
+        found = [x[0] for x in _read(location, "SELECT %s FROM %s WHERE %s IN (%s);" % (key, table, key, ", ".join("?" * len(ids))), list(ids))]
+        if found:
+            holding[location] = found
+    return holding
+
+def match_user_id_with_note_id(note_id, user=None):
     # Given the note id, confirm if the current user is the owner of the note which is being operated.
-    _conn = sqlite3.connect(note_db_file_location)
-    _c = _conn.cursor()
-
-    command = "SELECT user FROM notes WHERE note_id = '" + note_id + "';" 
-    _c.execute(command)
-    result = _c.fetchone()[0]
-
-    _conn.commit()
-    _conn.close()
-
-    return result
+    # Only the user's own shard is searched when the user is given, every shard otherwise.
+    for location in [note_db_location_for(user)] if user else note_db_locations():
+        result = _read(location, "SELECT user FROM notes WHERE note_id = ?;", (note_id,))
+        if result:
+            return result[0][0]
+    return None
 
 def write_note_into_db(id, note_to_write):
-    _conn = sqlite3.connect(note_db_file_location)
-    _c = _conn.cursor()
-
-    current_timestamp = str(datetime.datetime.now())
-    _c.execute("INSERT INTO notes values(?, ?, ?, ?)", (id.upper(), current_timestamp, note_to_write, hashlib.sha1((id.upper() + current_timestamp).encode()).hexdigest()))
-
-    _conn.commit()
-    _conn.close()
-
-def delete_note_from_db(note_id):
-    _conn = sqlite3.connect(note_db_file_location)
-    _c = _conn.cursor()
-
-    _c.execute("DELETE FROM notes WHERE note_id = ?;", (note_id))
-
-    _conn.commit()
-    _conn.close()
-
-def image_upload_record(uid, owner, image_name, timestamp):
-    _conn = sqlite3.connect(image_db_file_location)
-    _c = _conn.cursor()
-
-    _c.execute("INSERT INTO images VALUES (?, ?, ?, ?)", (uid, owner, image_name, timestamp))
-
-    _conn.commit()
-    _conn.close()
+    current_timestamp = epoch_micros()
+    location = note_db_location_for(id)
+    return _write(location,
+                  lambda _c: _c.execute("INSERT INTO notes (note_id, user, timestamp, note) values(?, ?, ?, ?)",
+                                        (_next_id(_c, "notes", location), id.upper(), current_timestamp, note_to_write)).lastrowid)
+
+def delete_note_from_db(note_id, user=None):
+    for location in _holding([note_db_location_for(user)] if user else note_db_locations(), "notes", "note_id", [note_id]):
+        _write(location, lambda _c: _c.execute("DELETE FROM notes WHERE note_id = ?;", (note_id,)))
+
+def image_upload_record(owner, image_name):
+    # Returns the new image's id; the file is stored in the image pool as "<id>-<name>"
+    current_timestamp = epoch_micros()
+    location = image_db_location_for(owner)
+    return _write(location,
+                  lambda _c: _c.execute("INSERT INTO images (image_id, owner, name, timestamp) VALUES (?, ?, ?, ?)",
+                                        (_next_id(_c, "images", location), owner, image_name, current_timestamp)).lastrowid)
 
 def list_images_for_user(owner):
-    _conn = sqlite3.connect(image_db_file_location)
-    _c = _conn.cursor()
-
-    command = "SELECT uid, timestamp, name FROM images WHERE owner = '{0}'".format(owner)
-    _c.execute(command)
-    result = _c.fetchall()
-
-    _conn.commit()
-    _conn.close()
-
-    return result
-
-def match_user_id_with_image_uid(image_uid):
-    # Given the note id, confirm if the current user is the owner of the note which is being operated.
-    _conn = sqlite3.connect(image_db_file_location)
-    _c = _conn.cursor()
-
-    command = "SELECT owner FROM images WHERE uid = '" + image_uid + "';" 
-    _c.execute(command)
-    result = _c.fetchone()[0]
-
-    _conn.commit()
-    _conn.close()
-
-    return result
-
-def delete_image_from_db(image_uid):
-    _conn = sqlite3.connect(image_db_file_location)
-    _c = _conn.cursor()
-
-    _c.execute("DELETE FROM images WHERE uid = ?;", (image_uid))
-
-    _conn.commit()
-    _conn.close()
+    return _read(image_db_location_for(owner), "SELECT image_id, timestamp, name FROM images WHERE owner = ? ORDER BY timestamp, image_id;", (owner,))
+
+def list_images_between(owner, start, end):
+    # Images uploaded from `start` up to (not including) `end`, both in epoch microseconds, oldest first
+    return _read(image_db_location_for(owner),
+                 "SELECT image_id, timestamp, name FROM images WHERE owner = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp, image_id;",
+                 (owner, start, end))
+
+def list_latest_images(owner, limit):
+    # The `limit` most recent images, newest first
+    return _read(image_db_location_for(owner),
+                 "SELECT image_id, timestamp, name FROM images WHERE owner = ? ORDER BY timestamp DESC, image_id DESC LIMIT ?;",
+                 (owner, limit))
+
+def open_snapshot(location):
+    """A read-only connection inside a read transaction: every query on it sees the database as it was when it was opened.
+
+    With WAL, writers carry on meanwhile; the caller must close it.
+    """
+    _conn = _connect(location, readonly=True)
+    _conn.isolation_level = None
+    _conn.execute("BEGIN;")
+    # A transaction only takes its snapshot at its first read
+    _conn.execute("SELECT count(*) FROM sqlite_master;").fetchone()
+    return _conn
+
+def iter_notes(snapshot, id, batch_size=500):
+    # A user's notes from a notes.db snapshot, oldest first, fetched `batch_size` at a time: (note_id, timestamp, note)
+    last = (-1, -1)
+    while True:
+        rows = snapshot.execute("SELECT note_id, timestamp, note FROM notes WHERE user = ? AND (timestamp, note_id) > (?, ?) "
+                                "ORDER BY timestamp, note_id LIMIT ?;", (id.upper(), last[1], last[0], batch_size)).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield row
+        last = rows[-1][:2]
+
+def iter_images(snapshot, owner, batch_size=500):
+    # A user's images from an images.db snapshot, oldest first, fetched `batch_size` at a time: (image_id, timestamp, name)
+    last = (-1, -1)
+    while True:
+        rows = snapshot.execute("SELECT image_id, timestamp, name FROM images WHERE owner = ? AND (timestamp, image_id) > (?, ?) "
+                                "ORDER BY timestamp, image_id LIMIT ?;", (owner, last[1], last[0], batch_size)).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield row
+        last = rows[-1][:2]
+
+def read_note_changes(id, after_seq, limit):
+    # Changes to a user's notes after `after_seq`, oldest first: (seq, op, note_id, timestamp, note); a put whose note
+    # has since been deleted comes back with timestamp and note None (its delete follows later in the log)
+    return _read(note_db_location_for(id),
+                 "SELECT c.seq, c.op, c.note_id, n.timestamp, n.note FROM notes_changes c LEFT JOIN notes n ON c.op = 'put' AND n.note_id = c.note_id "
+                 "WHERE c.user = ? AND c.seq > ? ORDER BY c.seq LIMIT ?;", (id.upper(), after_seq, limit))
+
+def read_image_changes(owner, after_seq, limit):
+    # Changes to a user's images after `after_seq`, oldest first: (seq, op, image_id, timestamp, name)
+    return _read(image_db_location_for(owner),
+                 "SELECT c.seq, c.op, c.image_id, i.timestamp, i.name FROM images_changes c LEFT JOIN images i ON c.op = 'put' AND i.image_id = c.image_id "
+                 "WHERE c.owner = ? AND c.seq > ? ORDER BY c.seq LIMIT ?;", (owner, after_seq, limit))
+
+def sync_horizon(location):
+    return _read(location, "SELECT seq FROM sync_horizon;")[0][0]
+
+def compact_change_log(location, table, key, tombstone_cutoff, batch_size=1000):
+    """Shrink a change log in short transactions of at most `batch_size` deletions.
+
+    Entries followed by a newer one for the same row tell a client nothing the newer one doesn't, and go first.
+    Then tombstones (deletes) logged before `tombstone_cutoff` (epoch seconds) are dropped and the sync horizon
+    moves past them. Returns the number of entries removed.
+    """
+    changes = table + "_changes"
+    superseded = ("DELETE FROM {c} WHERE seq IN (SELECT seq FROM {c} AS old WHERE EXISTS "
+                  "(SELECT 1 FROM {c} AS new WHERE new.{k} = old.{k} AND new.seq > old.seq) LIMIT ?);").format(c=changes, k=key)
+
+    def drop_tombstones(_c):
+        seqs = [x[0] for x in _c.execute("SELECT seq FROM {c} WHERE op = 'delete' AND changed_at < ? ORDER BY seq LIMIT ?;".format(c=changes),
+                                         (tombstone_cutoff, batch_size))]
+        if seqs:
+            _c.executemany("DELETE FROM {c} WHERE seq = ?;".format(c=changes), [(x,) for x in seqs])
+            _c.execute("UPDATE sync_horizon SET seq = max(seq, ?);", (seqs[-1],))
+        return len(seqs)
+
+    removed = 0
+    for work in (lambda _c: _c.execute(superseded, (batch_size,)).rowcount, drop_tombstones):
+        while True:
+            count = _write(location, work)
+            removed += count
+            if count < batch_size:
+                break
+    return removed
+
+def match_user_id_with_image_id(image_id, owner=None):
+    # Given the image id, confirm if the current user is the owner of the image which is being operated.
+    for location in [image_db_location_for(owner)] if owner else image_db_locations():
+        result = _read(location, "SELECT owner FROM images WHERE image_id = ?;", (image_id,))
+        if result:
+            return result[0][0]
+    return None
+
+def delete_image_from_db(image_id, owner=None):
+    delete_images_from_db([image_id], owner)
+
+def delete_images_from_db(image_ids, owner=None):
+    # With the owner only their shard is touched; otherwise each shard that holds some of the images
+    if not image_ids:
+        return
+    for location, ids in _holding([image_db_location_for(owner)] if owner else image_db_locations(), "images", "image_id", image_ids).items():
+        _write(location, lambda _c: _c.executemany("DELETE FROM images WHERE image_id = ?;", [(x,) for x in ids]))
+
+def enqueue_job(kind, payload, run_at=None, unique=False):
+    # With unique=True nothing is added while a job of this kind is queued or running; its id is returned instead
+    def enqueue(_c):
+        now = epoch_micros()
+        if unique:
+            existing = _c.execute("SELECT job_id FROM jobs WHERE kind = ? AND status IN ('queued', 'running') LIMIT 1;", (kind,)).fetchone()
+            if existing:
+                return existing[0]
+        return _c.execute("INSERT INTO jobs (kind, payload, run_at, created, updated) VALUES (?, ?, ?, ?, ?);",
+                          (kind, json.dumps(payload), run_at or now, now, now)).lastrowid
+    return _write(job_db_file_location, enqueue)
+
+def claim_job(lease_micros):
+    # Take the next due job, or one whose worker died, and lease it; returns (job_id, kind, payload, attempts) or None.
+    # The write lock taken by _write() makes this safe across threads and processes.
+    def claim(_c):
+        now = epoch_micros()
+        row = _c.execute("SELECT job_id, kind, payload, attempts FROM jobs WHERE (status = 'queued' AND run_at <= ?) "
+                         "OR (status = 'running' AND lease_until < ?) ORDER BY run_at LIMIT 1;", (now, now)).fetchone()
+        if row is None:
+            return None
+        _c.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated = ? WHERE job_id = ?;",
+                   (now + lease_micros, now, row[0]))
+        return row[0], row[1], json.loads(row[2]), row[3] + 1
+    return _write(job_db_file_location, claim)
+
+def update_job_progress(job_id, done, total, lease_micros):
+    # Also extends the lease, so a long job that keeps reporting progress is not taken over by another worker
+    now = epoch_micros()
+    _write(job_db_file_location,
+           lambda _c: _c.execute("UPDATE jobs SET progress_done = ?, progress_total = ?, lease_until = ?, updated = ? WHERE job_id = ?;",
+                                 (done, total, now + lease_micros, now, job_id)))
+
+def finish_job(job_id):
+    _write(job_db_file_location,
+           lambda _c: _c.execute("UPDATE jobs SET status = 'done', lease_until = NULL, error = NULL, updated = ? WHERE job_id = ?;",
+                                 (epoch_micros(), job_id)))
+
+def requeue_job(job_id, payload, run_at):
+    # A recurring job done with this run: queue it again with its new state, e.g. how far it has got
+    _write(job_db_file_location,
+           lambda _c: _c.execute("UPDATE jobs SET status = 'queued', payload = ?, run_at = ?, attempts = 0, lease_until = NULL, error = NULL, updated = ? WHERE job_id = ?;",
+                                 (json.dumps(payload), run_at, epoch_micros(), job_id)))
+
+def fail_job(job_id, error, retry_at=None):
+    # Back to the queue until retry_at, or failed for good when no retry is left
+    _write(job_db_file_location,
+           lambda _c: _c.execute("UPDATE jobs SET status = ?, run_at = COALESCE(?, run_at), lease_until = NULL, error = ?, updated = ? WHERE job_id = ?;",
+                                 ("queued" if retry_at else "failed", retry_at, error, epoch_micros(), job_id)))
+
+def list_jobs(limit):
+    # Most recent jobs first: (job_id, kind, payload, status, attempts, progress_done, progress_total, error, updated)
+    return _read(job_db_file_location,
+                 "SELECT job_id, kind, payload, status, attempts, progress_done, progress_total, error, updated FROM jobs ORDER BY job_id DESC LIMIT ?;",
+                 (limit,))
+
+def latest_job(kind):
+    # The most recent job of this kind: (job_id, payload, status, updated), or None
+    result = _read(job_db_file_location, "SELECT job_id, payload, status, updated FROM jobs WHERE kind = ? ORDER BY job_id DESC LIMIT 1;", (kind,))
+    return (result[0][0], json.loads(result[0][1]), result[0][2], result[0][3]) if result else None
+
+def list_images_after(image_id, limit):
+    # The next `limit` images by id across all shards, for walking every image in batches: (image_id, name, timestamp, legacy_uid)
+    rows = []
+    for location in image_db_locations():
+        rows += _read(location, "SELECT image_id, name, timestamp, legacy_uid FROM images WHERE image_id > ? ORDER BY image_id LIMIT ?;",
+                      (image_id, limit))
+    return sorted(rows)[:limit]
+
+def image_file_names(image_ids, legacy_uids):
+    # The image pool file names ("<id>-<name>", or "<sha1>-<name>" before migration) of the images that exist among these
+    ids, uids = list(image_ids), list(legacy_uids)
+    names = []
+    for location in image_db_locations():
+        if ids:
+            names += ["%d-%s" % x for x in _read(location,
+                      "SELECT image_id, name FROM images WHERE image_id IN (%s);" % ", ".join("?" * len(ids)), ids)]
+        if uids:
+            names += ["%s-%s" % x for x in _read(location,
+                      "SELECT legacy_uid, name FROM images WHERE legacy_uid IN (%s);" % ", ".join("?" * len(uids)), uids)]
+    return set(names)
+
+def finish_image_migration(image_pool):
+    # Images recorded before integer ids are stored as "<sha1>-<name>"; rename them to "<id>-<name>".
+    # Safe to run on every start and from several workers at once.
+    for location in image_db_locations():
+        for image_id, name, legacy_uid in _read(location, "SELECT image_id, name, legacy_uid FROM images WHERE legacy_uid IS NOT NULL;"):
+            try:
+                os.rename(os.path.join(image_pool, "%s-%s" % (legacy_uid, name)), os.path.join(image_pool, "%d-%s" % (image_id, name)))
+            except FileNotFoundError:
+                pass  # already renamed by another worker, or the file is gone
+            _write(location, lambda _c: _c.execute("UPDATE images SET legacy_uid = NULL WHERE image_id = ?;", (image_id,)))
 
 
 
@@ -0,0 +1,158 @@
+"""
+Export of one user's data as a tar archive, streamed straight to the response:
+
+    notes.jsonl                one JSON object per note, oldest first
+    images/<id>-<name>         every uploaded image, as stored in the image pool
+
+Notes and image records are read in batches from snapshots of the databases (read transactions),
+so neither the archive nor the list of notes is ever held in memory and the archive matches the
+data as of the moment the export started, however large the account. The archive is built the same
+way byte for byte every time the data is unchanged, which is what makes its size known up front and
+interrupted downloads resumable with Range requests (the ETag changes as soon as the data does).
+"""
+import os
+import json
+import hashlib
+import logging
+import tarfile
+import datetime
+
+from database import note_db_location_for, image_db_location_for, open_snapshot, iter_notes, iter_images
+
+logger = logging.getLogger(__name__)
+
+BLOCK = tarfile.BLOCKSIZE
+CHUNK_SIZE = 64 * 1024
+
+
+def note_line(note_id, timestamp, note):
+    created = datetime.datetime.fromtimestamp(timestamp / 1000000, datetime.timezone.utc).isoformat()
+    return (json.dumps({"note_id": note_id, "timestamp": timestamp, "created": created, "note": note},
+                       ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def tar_header(name, size, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = mtime
+    info.mode = 0o644
+    # PAX headers handle long and non-ASCII names; for short ASCII names this is a plain 512-byte ustar header
+    return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+
+def padding(size):
+    return (BLOCK - size % BLOCK) % BLOCK
+
+
+class UserExport:
+    """The archive of one user's data; open it, read `size` and `etag`, then stream() it (which closes it)"""
+
+    def __init__(self, user, image_pool):
+        self.user = user
+        self.image_pool = image_pool
+        self._notes = open_snapshot(note_db_location_for(user))
+        self._images = open_snapshot(image_db_location_for(user))
+        try:
+            self._plan()
+        except Exception:
+            self.close()
+            raise
+
+    def _plan(self):
+        # One pass over the snapshots to work out the archive's layout and a digest of everything in it
+        digest = hashlib.sha1()
+        self.notes_size, self.notes_mtime = 0, 0
+        for note_id, timestamp, note in iter_notes(self._notes, self.user):
+            line = note_line(note_id, timestamp, note)
+            self.notes_size += len(line)
+            self.notes_mtime = max(self.notes_mtime, timestamp // 1000000)
+            digest.update(line)
+
+        # (image id, name, size, mtime); a few dozen bytes per image, the files themselves are read while streaming
+        self.images = []
+        for image_id, timestamp, name in iter_images(self._images, self.user):
+            try:
+                size = os.path.getsize(os.path.join(self.image_pool, "%d-%s" % (image_id, name)))
+            except FileNotFoundError:
+                logger.warning("Image %d of user %s is missing from the image pool; exporting it empty", image_id, self.user)
+                size = 0
+            self.images.append((image_id, name, size, timestamp // 1000000))
+            digest.update(("%d %s %d %d\n" % self.images[-1]).encode("utf-8"))
+
+        self.etag = digest.hexdigest()
+        self.size = sum(length for length, _ in self._segments())
+
+    def _segments(self):
+        """The archive as a sequence of (length, produce), where produce(skip) yields the segment's bytes after the first `skip`"""
+        header = tar_header("notes.jsonl", self.notes_size, self.notes_mtime)
+        yield len(header), lambda skip, header=header: iter([header[skip:]])
+        yield self.notes_size, self._produce_notes
+        yield padding(self.notes_size), lambda skip, n=padding(self.notes_size): iter([bytes(n - skip)])
+        for image_id, name, size, mtime in self.images:
+            header = tar_header("images/%d-%s" % (image_id, name), size, mtime)
+            yield len(header), lambda skip, header=header: iter([header[skip:]])
+            path = os.path.join(self.image_pool, "%d-%s" % (image_id, name))
+            yield size, lambda skip, path=path, size=size: self._produce_file(path, size, skip)
+            yield padding(size), lambda skip, n=padding(size): iter([bytes(n - skip)])
+        # End of archive: two empty blocks
+        yield 2 * BLOCK, lambda skip: iter([bytes(2 * BLOCK - skip)])
+
+    def _produce_notes(self, skip):
+        buffer = bytearray()
+        for row in iter_notes(self._notes, self.user):
+            line = note_line(*row)
+            if skip >= len(line):
+                skip -= len(line)
+                continue
+            buffer += line[skip:]
+            skip = 0
+            if len(buffer) >= CHUNK_SIZE:
+                yield bytes(buffer)
+                buffer.clear()
+        if buffer:
+            yield bytes(buffer)
+
+    def _produce_file(self, path, size, skip):
+        # Exactly `size` bytes, whatever happened to the file since the export was planned, so the archive stays valid
+        remaining = size - skip
+        try:
+            with open(path, "rb") as f:
+                f.seek(skip)
+                while remaining > 0:
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+        except FileNotFoundError:
+            pass
+        if remaining > 0:
+            logger.warning("%s changed during the export of user %s; padding it with zeros", path, self.user)
+            yield bytes(remaining)
+
+    def stream(self, start=0, stop=None):
+        """Yield the archive's bytes from `start` up to (not including) `stop`, then close the snapshots"""
+        stop = self.size if stop is None else stop
+        try:
+            position = 0
+            for length, produce in self._segments():
+                if position >= stop:
+                    break
+                if position + length > start and length > 0:
+                    offset = max(0, start - position)
+                    for chunk in produce(offset):
+                        chunk_start = position + offset
+                        if chunk_start + len(chunk) > stop:
+                            chunk = chunk[:stop - chunk_start]
+                        if chunk:
+                            yield chunk
+                        offset += len(chunk)
+                        if position + offset >= stop:
+                            break
+                position += length
+        finally:
+            self.close()
+
+    def close(self):
+        self._notes.close()
+        self._images.close()
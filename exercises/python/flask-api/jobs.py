@@ -0,0 +1,207 @@
+"""
+Background jobs, queued in database_file/jobs.db and run by a small pool of worker threads in each
+app process, so slow work such as removing a large account doesn't hold up the admin's request.
+
+Every process that serves requests also runs workers; they share the queue through SQLite, and a
+job whose worker died is picked up again once its lease runs out. A failing job is retried with
+growing, jittered delays, then marked failed. Handlers must therefore be safe to run more than once.
+Workers can also run on their own, next to the app:
+
+    python jobs.py
+"""
+import os
+import time
+import random
+import logging
+import threading
+
+from database import epoch_micros, enqueue_job, claim_job, update_job_progress, finish_job, requeue_job, fail_job
+from database import list_images_for_user, delete_images_from_db, delete_notes_for_user
+from logging_setup import setup_logging, bind_request_id
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# How often an idle worker looks for new jobs
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# A running job that hasn't reported progress for this long is assumed abandoned and run again
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+RETRY_BASE_SECONDS = 2
+RETRY_MAX_SECONDS = 300
+# Images removed per database transaction and progress update when deleting an account
+DELETE_BATCH_SIZE = 100
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register a function(job, payload) that runs jobs of this kind"""
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+class Job:
+    """The job being run, as seen by its handler"""
+
+    def __init__(self, job_id, kind, attempts, image_pool):
+        self.job_id = job_id
+        self.kind = kind
+        self.attempts = attempts
+        self.image_pool = image_pool
+        self.next_run = None
+
+    def progress(self, done, total):
+        update_job_progress(self.job_id, done, total, JOB_LEASE_SECONDS * 1000000)
+
+    def run_again(self, payload, delay_seconds):
+        """Queue this job again after delay_seconds with a new payload instead of finishing it"""
+        self.next_run = (payload, epoch_micros() + int(delay_seconds * 1000000))
+
+
+def remove_image_files(image_pool, filenames):
+    # Image files are stored as "<id>-<name>", so each one is removed directly; one that is already gone is skipped
+    removed = 0
+    for filename in filenames:
+        try:
+            os.remove(os.path.join(image_pool, filename))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+@handler("remove_images")
+def run_remove_images(job, payload):
+    # Files of images whose records are already deleted
+    filenames = payload.get("files")
+    if filenames is None:
+        # Queued with image ids only, before file names were recorded: look for them once
+        image_ids = set(str(x) for x in payload["image_ids"])
+        filenames = [x for x in os.listdir(job.image_pool) if x.split("-", 1)[0] in image_ids]
+    removed = remove_image_files(job.image_pool, filenames)
+    job.progress(len(filenames), len(filenames))
+    logger.info("Removed %d image files", removed)
+
+
+@handler("delete_user_data")
+def run_delete_user_data(job, payload):
+    # Notes and images of a deleted account. Only data created before the account was deleted is removed,
+    # in case an account with the same name has been created since.
+    user, before = payload["user"], payload["before"]
+    images = [(image_id, name) for image_id, timestamp, name in list_images_for_user(user) if timestamp < before]
+    total = len(images) + 1
+    for start in range(0, len(images), DELETE_BATCH_SIZE):
+        batch = images[start:start + DELETE_BATCH_SIZE]
+        # Files first: if the job is interrupted, the records still point at what's left to remove on the retry
+        remove_image_files(job.image_pool, ["%d-%s" % x for x in batch])
+        delete_images_from_db([image_id for image_id, _ in batch], user)
+        job.progress(start + len(batch), total)
+    notes = delete_notes_for_user(user, before)
+    job.progress(total, total)
+    logger.info("Deleted %d images and %d notes of user %s", len(images), notes, user)
+
+
+def retry_delay(attempts):
+    # Exponential back-off with jitter, in seconds
+    return random.uniform(0.5, 1.0) * min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+
+
+class JobWorkerPool:
+    """Threads that claim jobs from the queue and run them until stopped"""
+
+    def __init__(self, image_pool, workers=JOB_WORKERS, poll_seconds=JOB_POLL_SECONDS):
+        self.image_pool = image_pool
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def run_once(self):
+        """Run the next due job, if any; returns whether there was one"""
+        claimed = claim_job(JOB_LEASE_SECONDS * 1000000)
+        if claimed is None:
+            return False
+        job_id, kind, payload, attempts = claimed
+        bind_request_id("job-%d" % job_id)
+        if kind not in HANDLERS:
+            logger.error("No handler for job %d of kind %s", job_id, kind)
+            fail_job(job_id, "Unknown job kind %s" % kind)
+            return True
+
+        started = time.perf_counter()
+        job = Job(job_id, kind, attempts, self.image_pool)
+        try:
+            HANDLERS[kind](job, payload)
+        except Exception as error:
+            if attempts < JOB_MAX_ATTEMPTS:
+                delay = retry_delay(attempts)
+                logger.warning("Job %d (%s) failed on attempt %d, retrying in %.0fs: %r", job_id, kind, attempts, delay, error)
+                fail_job(job_id, repr(error), epoch_micros() + int(delay * 1000000))
+            else:
+                logger.exception("Job %d (%s) failed on its last attempt", job_id, kind)
+                fail_job(job_id, repr(error))
+        else:
+            if job.next_run:
+                requeue_job(job_id, *job.next_run)
+                logger.debug("Job %d (%s) ran in %.2fs and is queued again", job_id, kind, time.perf_counter() - started)
+            else:
+                finish_job(job_id)
+                logger.info("Job %d (%s) done in %.2fs", job_id, kind, time.perf_counter() - started)
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception:
+                # e.g. the jobs database stayed locked through every retry; try again on the next poll
+                logger.exception("Job worker could not claim or record a job")
+            self._stop.wait(self.poll_seconds)
+
+    def start(self):
+        """Start the worker threads (once per process)"""
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            if self._threads or self.workers <= 0:
+                return
+            self._stop.clear()
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._run, name="job-worker-%d" % number, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+
+def delete_user_later(user):
+    return enqueue_job("delete_user_data", {"user": user, "before": epoch_micros()})
+
+def remove_images_later(filenames):
+    # Image pool file names, "<id>-<name>"
+    return enqueue_job("remove_images", {"files": list(filenames)})
+
+
+if __name__ == "__main__":
+    import config
+    # Run as a script this file is __main__; the modules with handlers register them in the importable `jobs`,
+    # so the workers must come from there too
+    import jobs
+    import reconcile, sync, maintenance  # register their handlers
+
+    setup_logging()
+    pool = jobs.JobWorkerPool(config.UPLOAD_FOLDER)
+    pool.start()
+    logger.info("Running %d job workers", pool.workers)
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pool.stop()
@@ -0,0 +1,116 @@
+# The same file is used by weather-app/ and flask-api/; keep the two copies identical.
+import atexit
+import copy
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import uuid
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" writes one JSON object per line for log collectors; "text" is easier to read in a terminal
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+
+# Correlation id of the request being served on this thread/task; "-" outside of requests
+request_id = contextvars.ContextVar("request_id", default="-")
+
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+_listener = None
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record, including any fields passed with `extra=`"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RequestIdFilter(logging.Filter):
+    # Runs on the calling thread, the only place the request's context is visible
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stdlib handler runs the full formatter before queueing a record; here only the message
+    and any traceback are rendered, so the listener never reads arguments the caller may change
+    after logging, or frames that are gone, and the JSON/text formatting happens off the request thread.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _output_handler():
+    handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+    return handler
+
+
+def _start_listener():
+    global _listener
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    _listener = logging.handlers.QueueListener(log_queue, _output_handler(), respect_handler_level=True)
+    _listener.start()
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def setup_logging():
+    """Route all logging through a queue drained by a background thread that formats and writes it.
+
+    Safe to call more than once. A forked worker (gunicorn --preload) gets a fresh queue and
+    listener thread, since the parent's thread doesn't survive the fork.
+    """
+    if _listener is not None:
+        return
+    logging.getLogger().setLevel(LOG_LEVEL)
+    _start_listener()
+    atexit.register(_stop_listener)
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_start_listener)
+
+
+def bind_request_id(incoming=None):
+    """Use the caller's X-Request-ID if it looks sane, otherwise make one up; returns the id"""
+    value = incoming if incoming and _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex[:16]
+    request_id.set(value)
+    return value
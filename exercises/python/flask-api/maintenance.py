@@ -0,0 +1,236 @@
+"""
+Backups and upkeep of the SQLite files, run by the recurring "maintain_databases" background job
+(see jobs.py) every MAINTENANCE_SECONDS. For each database file it:
+
+  - backs it up with SQLite's online backup API into BACKUP_DIR/<time>/, BACKUP_PAGES_PER_STEP
+    pages at a time, so writers only wait for one short step, never for the whole copy; a write
+    between two steps starts the copy over, and after BACKUP_MAX_RESTARTS of those it is done in
+    one step instead; the copy is checked with PRAGMA quick_check and the last BACKUP_KEEP backups
+    are kept
+  - hands free pages left by deleted rows back to the file system (incremental vacuum); a file
+    created before auto_vacuum was turned on needs one full VACUUM first, which holds the write
+    lock for the whole rewrite, so the job skips it and the offline run below does it
+  - refreshes the query planner's statistics (ANALYZE)
+  - checkpoints the WAL into the database file and truncates it, unless readers are active
+
+Copying the files by hand while the app runs can produce a corrupt copy; use the backups instead.
+The durations and sizes of the last run are on the admin page. A run can also be started by hand,
+with the app stopped if any file still needs converting:
+
+    python maintenance.py [--no-backup]
+"""
+import os
+import time
+import shutil
+import sqlite3
+import logging
+import datetime
+
+from database import DATABASE_DIR, _connect, _write, epoch_micros, database_locations, enqueue_job, latest_job
+from jobs import handler
+
+logger = logging.getLogger(__name__)
+
+MAINTENANCE_ENABLED = os.getenv("MAINTENANCE_ENABLED", "1") == "1"
+MAINTENANCE_SECONDS = float(os.getenv("MAINTENANCE_SECONDS", str(24 * 3600)))
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+# Pause between two backup steps, which is when writers get their turn
+BACKUP_STEP_SECONDS = float(os.getenv("BACKUP_STEP_SECONDS", "0.01"))
+# Times a stepped backup may start over because of writes before it is copied in a single step
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "3"))
+# Pages freed per incremental vacuum transaction
+VACUUM_PAGES_PER_STEP = 1000
+# How often a long step renews the job's lease (jobs.JOB_LEASE_SECONDS), so no other worker takes the job over
+HEARTBEAT_SECONDS = 10
+
+
+def file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def no_heartbeat():
+    pass
+
+
+class BackupRestarting(Exception):
+    """Raised from a stepped backup's progress callback to give up on stepping"""
+
+
+def backup(location, destination, heartbeat=no_heartbeat):
+    """Copy a live database to `destination` in steps; returns (the copy's size in bytes, times the copy started over)"""
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    partial = destination + ".partial"
+    restarts = [0]
+    last_remaining = [None]
+
+    def progress(status, remaining, total):
+        heartbeat()
+        # A write by another connection between two steps makes SQLite start the copy over, so it is consistent;
+        # the pages left then don't go down. Under steady writes (including the job's own heartbeats to jobs.db)
+        # that can go on for ever.
+        if last_remaining[0] is not None and remaining >= last_remaining[0]:
+            restarts[0] += 1
+            if restarts[0] > BACKUP_MAX_RESTARTS:
+                raise BackupRestarting()
+        last_remaining[0] = remaining
+
+    source = _connect(location, readonly=True)
+    try:
+        target = sqlite3.connect(partial, isolation_level=None)
+        try:
+            try:
+                source.backup(target, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SECONDS, progress=progress)
+            except BackupRestarting:
+                # One step reads a single WAL snapshot, so writers still aren't held up; only checkpoints wait for it
+                logger.warning("Backup of %s started over %d times; copying it in one step", location, restarts[0])
+                source.backup(target)
+            check = target.execute("PRAGMA quick_check;").fetchone()[0]
+            # A plain rollback-journal file, complete in itself
+            target.execute("PRAGMA journal_mode = DELETE;")
+        finally:
+            target.close()
+    finally:
+        source.close()
+    if check != "ok":
+        os.remove(partial)
+        raise RuntimeError("Backup of %s failed its check: %s" % (location, check))
+    os.replace(partial, destination)
+    return file_size(destination), restarts[0]
+
+
+def vacuum(location, convert=False, heartbeat=no_heartbeat):
+    """Give free pages back to the file system; returns how many were freed, or None if the file needs converting first"""
+    _conn = _connect(location)
+    try:
+        if _conn.execute("PRAGMA auto_vacuum;").fetchone()[0] != 2:
+            # Files from before auto_vacuum was set: one full VACUUM rewrites the file and makes the setting stick.
+            # It locks out writers until it is done, longer than they wait on a large file, so only offline.
+            if not convert:
+                logger.warning("%s needs a full VACUUM before it can be vacuumed incrementally; run python maintenance.py with the app stopped", location)
+                return None
+            freed = _conn.execute("PRAGMA freelist_count;").fetchone()[0]
+            _conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+            _conn.execute("VACUUM;")
+            logger.info("Converted %s to incremental vacuum", location)
+            return freed
+    finally:
+        _conn.close()
+
+    def step(_c):
+        before = _c.execute("PRAGMA freelist_count;").fetchone()[0]
+        _c.execute("PRAGMA incremental_vacuum(%d);" % VACUUM_PAGES_PER_STEP).fetchall()
+        return before, _c.execute("PRAGMA freelist_count;").fetchone()[0]
+
+    freed = 0
+    while True:
+        # Each step in its own short write transaction, so writers aren't held up for long
+        before, after = _write(location, step)
+        freed += before - after
+        heartbeat()
+        if after == 0 or after == before:
+            return freed
+
+
+def analyze(location):
+    _write(location, lambda _c: _c.execute("ANALYZE;"))
+
+
+def checkpoint(location):
+    """Copy the WAL into the database; returns (WAL pages, pages checkpointed, whether the WAL could be truncated)"""
+    _conn = _connect(location)
+    try:
+        # Don't wait for readers: if any are active, checkpoint what can be done without them and leave the WAL as it is
+        _conn.execute("PRAGMA busy_timeout = 0;")
+        busy, wal_pages, done = _conn.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchone()
+        if busy:
+            busy, wal_pages, done = _conn.execute("PRAGMA wal_checkpoint(PASSIVE);").fetchone()
+            return wal_pages, done, False
+        return wal_pages, done, True
+    finally:
+        _conn.close()
+
+
+def maintain(location, backup_to=None, convert=False, heartbeat=no_heartbeat):
+    """Back up (when backup_to is given), vacuum, analyze and checkpoint one database file; returns a report"""
+    report = {"file": os.path.relpath(location, DATABASE_DIR), "size_before": file_size(location) + file_size(location + "-wal")}
+    steps = [("vacuum", lambda: report.update(freed_pages=vacuum(location, convert, heartbeat))),
+             ("analyze", lambda: analyze(location)),
+             ("checkpoint", lambda: report.update(zip(("wal_pages", "checkpointed_pages", "wal_truncated"), checkpoint(location))))]
+    if backup_to:
+        # Before anything else touches the file, so the backup is of the data as the app left it
+        steps.insert(0, ("backup", lambda: report.update(zip(("backup_size", "backup_restarts"),
+                                                               backup(location, os.path.join(backup_to, report["file"]), heartbeat)))))
+    for name, step in steps:
+        started = time.perf_counter()
+        step()
+        report[name + "_seconds"] = round(time.perf_counter() - started, 3)
+    report["size_after"] = file_size(location) + file_size(location + "-wal")
+    return report
+
+
+def prune_backups(keep=BACKUP_KEEP):
+    # Backup directories are named by time, so the oldest sort first
+    backups = sorted(x for x in os.listdir(BACKUP_DIR) if os.path.isdir(os.path.join(BACKUP_DIR, x)))
+    for name in backups[:max(0, len(backups) - keep)]:
+        shutil.rmtree(os.path.join(BACKUP_DIR, name))
+        logger.info("Removed old backup %s", name)
+
+
+def run_maintenance(with_backup=True, progress=None, convert=False):
+    """Maintain every database file; returns a report of the whole run.
+
+    `convert` allows the full VACUUM some files need once, which blocks writers: only with the app stopped.
+    """
+    started = time.perf_counter()
+    backup_to = None
+    if with_backup:
+        backup_to = os.path.join(BACKUP_DIR, datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
+    locations = database_locations()
+    files = []
+    last_beat = [time.monotonic()]
+
+    def heartbeat():
+        # Called often during long steps; reports progress (which renews the lease) every HEARTBEAT_SECONDS
+        if progress and time.monotonic() - last_beat[0] >= HEARTBEAT_SECONDS:
+            progress(len(files), len(locations))
+            last_beat[0] = time.monotonic()
+
+    for location in locations:
+        files.append(maintain(location, backup_to, convert, heartbeat))
+        if progress:
+            progress(len(files), len(locations))
+            last_beat[0] = time.monotonic()
+    if with_backup:
+        prune_backups()
+    return {"finished": epoch_micros(), "seconds": round(time.perf_counter() - started, 3),
+            "backup": backup_to, "files": files}
+
+
+@handler("maintain_databases")
+def run_maintain_databases(job, payload):
+    report = run_maintenance(progress=job.progress)
+    logger.info("Database maintenance done in %.1fs, backup in %s", report["seconds"], report["backup"])
+    job.run_again({"last": report}, MAINTENANCE_SECONDS)
+
+
+def start_maintenance():
+    # The first run waits a full interval, so starting the app doesn't begin with a backup
+    if MAINTENANCE_ENABLED:
+        enqueue_job("maintain_databases", {"last": None}, run_at=epoch_micros() + int(MAINTENANCE_SECONDS * 1000000), unique=True)
+
+
+def last_report():
+    # The report of the last maintenance run, for the admin page, or None before the first one
+    job = latest_job("maintain_databases")
+    return job[1].get("last") if job else None
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+    from logging_setup import setup_logging
+
+    setup_logging()
+    print(json.dumps(run_maintenance(with_backup="--no-backup" not in sys.argv[1:], convert=True), indent=2))
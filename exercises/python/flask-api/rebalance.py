@@ -0,0 +1,101 @@
+"""
+Moves notes and image records to the shards they belong in under a new shard count, e.g. when
+turning sharding on for an existing database_file/ or growing from 4 shards to 8:
+
+    python rebalance.py --shards 8 [--dry-run]
+
+then restart the app with DATABASE_SHARDS=8. Rows are read from every notes.db and images.db found
+(the unsharded files and shards/*/), copied to their new shard and only then deleted from the old
+one, a batch at a time, so an interrupted run loses nothing and can simply be run again. Stop the
+app first, or it may write to the old layout meanwhile. Image files keep their names: ids don't
+change. Sync clients start over once, since their cursors refer to the old shards' change logs.
+"""
+import os
+import glob
+import argparse
+import logging
+
+from database import DATABASE_DIR, SHARD_ID_STRIDE, _read, _write
+from database import note_db_location_for, image_db_location_for, note_db_locations, image_db_locations
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+TABLES = [("notes", "user", "note_id", note_db_location_for, note_db_locations),
+          ("images", "owner", "image_id", image_db_location_for, image_db_locations)]
+
+
+def existing_locations(filename):
+    # The unsharded file and every shard's, whichever exist
+    locations = glob.glob(os.path.join(DATABASE_DIR, "shards", "*", filename))
+    if os.path.exists(os.path.join(DATABASE_DIR, filename)):
+        locations.append(os.path.join(DATABASE_DIR, filename))
+    return sorted(locations)
+
+
+def move_rows(source, target, table, owner_column, key, owner, dry_run):
+    """Move one user's rows of `table` from the source file to the target file; returns how many were moved"""
+    if dry_run:
+        return _read(source, "SELECT count(*) FROM %s WHERE %s = ?;" % (table, owner_column), (owner,))[0][0]
+    moved = 0
+    while True:
+        rows = _read(source, "SELECT * FROM %s WHERE %s = ? ORDER BY %s LIMIT ?;" % (table, owner_column, key), (owner, BATCH_SIZE))
+        if not rows:
+            return moved
+        ids = [(row[0],) for row in rows]
+        # The key is the first column. Copy first: after a crash between the two steps the rows are in both files,
+        # and the next run's INSERT OR IGNORE skips them before deleting them from the source.
+        _write(target, lambda _c: _c.executemany("INSERT OR IGNORE INTO %s VALUES (%s);" % (table, ", ".join("?" * len(rows[0]))), rows))
+        _write(source, lambda _c: _c.executemany("DELETE FROM %s WHERE %s = ?;" % (table, key), ids))
+        moved += len(rows)
+
+
+def raise_sequences(locations, table):
+    # Start every file's ids above the largest id anywhere, so rows created from now on can't collide with moved ones
+    top = 0
+    for location in locations:
+        row = _read(location, "SELECT seq FROM sqlite_sequence WHERE name = ?;", (table,))
+        top = max(top, row[0][0] if row else 0)
+    top = (top // SHARD_ID_STRIDE + 1) * SHARD_ID_STRIDE - 1
+
+    def raise_sequence(_c):
+        if _c.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = ?;", (top, table)).rowcount == 0:
+            _c.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?);", (table, top))
+    for location in locations:
+        _write(location, raise_sequence)
+
+
+def rebalance(shards, dry_run=False):
+    """Move every user's rows to their shard under `shards` shards (0 or 1: unsharded); returns {table: rows moved}"""
+    moved = {}
+    for table, owner_column, key, location_for, locations in TABLES:
+        sources = existing_locations(table + ".db")
+        moved[table] = 0
+        for source in sources:
+            for (owner,) in _read(source, "SELECT DISTINCT %s FROM %s;" % (owner_column, table)):
+                target = location_for(owner, shards)
+                if target == source:
+                    continue
+                count = move_rows(source, target, table, owner_column, key, owner, dry_run)
+                logger.info("%s %d %s of %s from %s to %s", "Would move" if dry_run else "Moved", count, table, owner, source, target)
+                moved[table] += count
+        if not dry_run:
+            raise_sequences(sorted(set(sources + locations(shards))), table)
+    return moved
+
+
+if __name__ == "__main__":
+    from logging_setup import setup_logging
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, required=True, help="the new DATABASE_SHARDS (0 or 1: unsharded)")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would move")
+    args = parser.parse_args()
+    if args.shards > SHARD_ID_STRIDE:
+        parser.error("--shards can be at most %d" % SHARD_ID_STRIDE)
+
+    setup_logging()
+    moved = rebalance(args.shards, args.dry_run)
+    print("%s %d notes and %d image records for %s" % ("Would move" if args.dry_run else "Moved", moved["notes"], moved["images"],
+          "%d shards" % args.shards if args.shards > 1 else "unsharded storage"))
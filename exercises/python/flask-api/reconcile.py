@@ -0,0 +1,155 @@
+"""
+Keeps image_pool/ and the images table in step. A crash between saving an upload and recording it,
+or between deleting a record and its file, leaves an orphan file (no record) or a dangling record
+(no file). The reconciler walks the table and then the pool in small batches, reports what it finds
+and, with RECONCILE_REMOVE=1, deletes it. Anything younger than RECONCILE_GRACE_SECONDS is left
+alone, since it may belong to an upload or deletion still in progress.
+
+It runs as a recurring background job (see jobs.py): each run checks one batch, saves where it got
+to in the job's payload and queues itself again, so it resumes after a restart and never keeps a
+job worker busy for long. The pool is listed once per pass, into RECONCILE_FILE_LIST, and each
+batch of files reads only its own lines of that list. A full pass can also be run by hand:
+
+    python reconcile.py            # report only
+    python reconcile.py --remove
+"""
+import os
+import time
+import logging
+
+from database import DATABASE_DIR, epoch_micros, enqueue_job, list_images_after, image_file_names, delete_images_from_db
+from jobs import handler
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_ENABLED = os.getenv("RECONCILE_ENABLED", "1") == "1"
+RECONCILE_REMOVE = os.getenv("RECONCILE_REMOVE", "0") == "1"
+RECONCILE_GRACE_SECONDS = int(os.getenv("RECONCILE_GRACE_SECONDS", "3600"))
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", "200"))
+# Pause between two batches, and between the end of one pass and the start of the next
+RECONCILE_BATCH_SECONDS = float(os.getenv("RECONCILE_BATCH_SECONDS", "5"))
+RECONCILE_PASS_SECONDS = float(os.getenv("RECONCILE_PASS_SECONDS", "3600"))
+# The pool's file names as listed at the start of the pass's file phase, one per line
+RECONCILE_FILE_LIST = os.path.join(DATABASE_DIR, "reconcile-files.txt")
+
+FIRST_BATCH = {"phase": "rows", "cursor": 0, "checked": 0,
+               "dangling_rows": 0, "orphan_files": 0, "removed_rows": 0, "removed_files": 0}
+
+
+def check_rows(image_pool, after_id, limit, grace_seconds, remove):
+    """Look for records without a file among the `limit` images after `after_id`.
+
+    Returns (last image id checked or None at the end of the table, images checked, dangling ids, removed ids).
+    """
+    rows = list_images_after(after_id, limit)
+    cutoff = epoch_micros() - grace_seconds * 1000000
+    dangling = []
+    for image_id, name, timestamp, legacy_uid in rows:
+        filename = "%s-%s" % (legacy_uid or image_id, name)
+        if timestamp < cutoff and not os.path.exists(os.path.join(image_pool, filename)):
+            logger.warning("Image %d (%s) has no file in %s", image_id, name, image_pool)
+            dangling.append(image_id)
+    if remove and dangling:
+        delete_images_from_db(dangling)
+    return (rows[-1][0] if len(rows) == limit else None), len(rows), dangling, (dangling if remove else [])
+
+
+def list_files(image_pool, file_list):
+    # One walk of the directory per pass; names that can't be decoded are kept as they are by surrogateescape
+    partial = file_list + ".partial"
+    with open(partial, "w", encoding="utf-8", errors="surrogateescape") as f, os.scandir(image_pool) as entries:
+        for entry in entries:
+            f.write(entry.name + "\n")
+    os.replace(partial, file_list)
+
+
+def check_files(image_pool, offset, limit, grace_seconds, remove, file_list=RECONCILE_FILE_LIST):
+    """Look for files without a record among the `limit` names at byte `offset` of the pass's file list.
+
+    Returns (offset of the next batch or None at the end of the list, files checked, orphan names, removed names).
+    """
+    batch = []
+    with open(file_list, encoding="utf-8", errors="surrogateescape", newline="\n") as f:
+        f.seek(offset)
+        for line in iter(f.readline, ""):
+            batch.append(line[:-1])
+            if len(batch) == limit:
+                break
+        offset = f.tell()
+    prefixes = [name.split("-", 1)[0] for name in batch]
+    known = image_file_names([int(x) for x in prefixes if x.isdigit()], [x for x in prefixes if not x.isdigit()])
+    cutoff = time.time() - grace_seconds
+    orphans, removed = [], []
+    for name in batch:
+        if name in known:
+            continue
+        try:
+            if os.path.getmtime(os.path.join(image_pool, name)) >= cutoff:
+                continue
+            logger.warning("File %s in %s has no image record", name, image_pool)
+            orphans.append(name)
+            if remove:
+                os.remove(os.path.join(image_pool, name))
+                removed.append(name)
+        except FileNotFoundError:
+            pass  # removed while we were looking
+    return (offset if len(batch) == limit else None), len(batch), orphans, removed
+
+
+def reconcile_batch(image_pool, state, limit=RECONCILE_BATCH_SIZE, grace_seconds=RECONCILE_GRACE_SECONDS, remove=RECONCILE_REMOVE,
+                    file_list=RECONCILE_FILE_LIST):
+    """Check one batch from where `state` left off; returns the new state and whether the pass is complete"""
+    state = dict(state)
+    if state["phase"] == "rows":
+        cursor, checked, dangling, removed = check_rows(image_pool, state["cursor"], limit, grace_seconds, remove)
+        state["dangling_rows"] += len(dangling)
+        state["removed_rows"] += len(removed)
+        state["phase"], state["cursor"] = ("rows", cursor) if cursor is not None else ("files", "")
+    else:
+        # A name ("" at the start of the phase, or a file name saved by an older version) means the pool
+        # hasn't been listed for this pass yet; a list that has gone missing is made again from the start
+        if isinstance(state["cursor"], str) or not os.path.exists(file_list):
+            list_files(image_pool, file_list)
+            state["cursor"] = 0
+        cursor, checked, orphans, removed = check_files(image_pool, state["cursor"], limit, grace_seconds, remove, file_list)
+        state["orphan_files"] += len(orphans)
+        state["removed_files"] += len(removed)
+        state["cursor"] = cursor
+    state["checked"] += checked
+    complete = state["phase"] == "files" and state["cursor"] is None
+    if complete:
+        os.remove(file_list)
+    return state, complete
+
+
+@handler("reconcile_images")
+def run_reconcile_images(job, payload):
+    state, complete = reconcile_batch(job.image_pool, payload)
+    job.progress(state["checked"], None)
+    if complete:
+        logger.info("Image reconciliation pass done: %d checked, %d dangling records (%d removed), %d orphan files (%d removed)",
+                    state["checked"], state["dangling_rows"], state["removed_rows"], state["orphan_files"], state["removed_files"])
+        job.run_again(FIRST_BATCH, RECONCILE_PASS_SECONDS)
+    else:
+        job.run_again(state, RECONCILE_BATCH_SECONDS)
+
+
+def start_reconciler():
+    # Queue the recurring job unless it is already queued or running (e.g. started by another worker)
+    if RECONCILE_ENABLED:
+        enqueue_job("reconcile_images", FIRST_BATCH, unique=True)
+
+
+if __name__ == "__main__":
+    import sys
+    import config
+    from logging_setup import setup_logging
+
+    setup_logging()
+    state, complete = FIRST_BATCH, False
+    # Its own file list, so a pass run by hand doesn't disturb the background job's
+    file_list = RECONCILE_FILE_LIST + ".%d" % os.getpid()
+    while not complete:
+        state, complete = reconcile_batch(config.UPLOAD_FOLDER, state, remove="--remove" in sys.argv[1:], file_list=file_list)
+    print("%(checked)d checked, %(dangling_rows)d dangling records (%(removed_rows)d removed), "
+          "%(orphan_files)d orphan files (%(removed_files)d removed)" % state)
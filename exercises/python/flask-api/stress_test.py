@@ -0,0 +1,118 @@
+"""
+Stress test for the database layer: many processes, each with several threads, write and delete
+notes at the same time, the way gunicorn workers do under load. Runs against a copy of
+database_file/ in a temporary directory, then checks that every note that was written and not
+deleted is still there and nothing else is, and reports sustained write throughput. Each thread
+writes as its own user, so with --shards the load spreads over the shards (DATABASE_SHARDS):
+
+    python stress_test.py --processes 8 --threads 4 --notes 200
+    python stress_test.py --processes 8 --threads 4 --notes 200 --shards 4
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+
+
+def worker(worker_id, threads, notes, delete_every, results):
+    # Imported here so the child picks up DATABASE_DIR and DATABASE_SHARDS from the environment set by main()
+    import threading
+    import database
+
+    lock = threading.Lock()
+    kept, deleted, failures, latencies = {}, [], [], []
+
+    def run(thread_id):
+        user = "STRESS%03d-%d" % (worker_id, thread_id)
+        kept[user] = []
+        for i in range(notes):
+            started = time.perf_counter()
+            try:
+                note_id = database.write_note_into_db(user, "note %d-%d-%d" % (worker_id, thread_id, i))
+                if delete_every and i % delete_every == delete_every - 1:
+                    database.delete_note_from_db(note_id, user)
+                    with lock:
+                        deleted.append(note_id)
+                else:
+                    kept[user].append(note_id)
+            except Exception as error:
+                with lock:
+                    failures.append(repr(error))
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    pool = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put((kept, deleted, failures, latencies))
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=4, help="threads per process")
+    parser.add_argument("--notes", type=int, default=100, help="notes written by each thread")
+    parser.add_argument("--delete-every", type=int, default=5, help="delete every n-th note right after writing it (0: never)")
+    parser.add_argument("--shards", type=int, default=0, help="DATABASE_SHARDS to run with (0: unsharded)")
+    args = parser.parse_args()
+
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "database_file")
+    workdir = tempfile.mkdtemp(prefix="flask-api-stress-")
+    for name in ("users.db", "notes.db", "images.db"):
+        shutil.copy(os.path.join(source, name), workdir)
+    os.environ["DATABASE_DIR"] = workdir
+    os.environ["DATABASE_SHARDS"] = str(args.shards)
+
+    try:
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=worker, args=(p, args.threads, args.notes, args.delete_every, results))
+                     for p in range(args.processes)]
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+        import database
+        kept, deleted, failures, latencies = set(), set(), [], []
+        lost, unexpected = 0, 0
+        for process_kept, process_deleted, process_failures, process_latencies in outcomes:
+            for user, user_kept in process_kept.items():
+                stored = set(x[0] for x in database.read_note_from_db(user))
+                lost += len(set(user_kept) - stored)
+                unexpected += len(stored - set(user_kept))
+                kept.update(user_kept)
+            deleted.update(process_deleted)
+            failures += process_failures
+            latencies += process_latencies
+    finally:
+        shutil.rmtree(workdir)
+
+    writes = len(kept) + 2 * len(deleted)
+    print("%d processes x %d threads, %s, %.1fs" % (args.processes, args.threads,
+                                                   "%d shards" % args.shards if args.shards > 1 else "unsharded", elapsed))
+    print("notes written: %d, deleted: %d, kept: %d" % (len(kept) + len(deleted), len(deleted), len(kept)))
+    print("write transactions per second: %.0f" % (writes / elapsed))
+    if latencies:
+        print("operation latency p50 %.1f ms, p99 %.1f ms, max %.1f ms" % (
+            percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, max(latencies) * 1000))
+    print("failed operations: %d, lost notes: %d, unexpected notes: %d" % (len(failures), lost, unexpected))
+    for failure in sorted(set(failures))[:5]:
+        print("  " + failure)
+    sys.exit(1 if failures or lost or unexpected else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Incremental sync feed for clients that mirror a user's notes and images.
+
+GET /sync returns the changes (puts and deletes) logged since the cursor the client got last time,
+plus a new cursor; without a cursor it starts from the beginning of the log, which holds a put for
+every row that still exists. Clients page with the returned cursor while `has_more` is true.
+Each response is proportional to what changed, not to the size of the account.
+
+The change logs are compacted by a recurring background job: entries superseded by a newer one for
+the same row are dropped, and tombstones are kept for SYNC_TOMBSTONE_DAYS. A cursor from before
+the oldest dropped tombstone could miss deletes, so it is refused (410) and the client starts over.
+So is a cursor from another shard layout: log positions only mean something in the shard that
+logged them, and rebalance.py may have moved the user since.
+"""
+import os
+import json
+import time
+import base64
+import logging
+
+from database import note_db_location_for, image_db_location_for, note_db_locations, image_db_locations, shard_for, DATABASE_SHARDS
+from database import read_note_changes, read_image_changes, sync_horizon, compact_change_log, enqueue_job
+from jobs import handler
+
+logger = logging.getLogger(__name__)
+
+SYNC_PAGE_SIZE = 500
+SYNC_MAX_PAGE_SIZE = 2000
+SYNC_TOMBSTONE_DAYS = int(os.getenv("SYNC_TOMBSTONE_DAYS", "30"))
+SYNC_COMPACT_SECONDS = int(os.getenv("SYNC_COMPACT_SECONDS", str(24 * 3600)))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class ExpiredCursor(Exception):
+    pass
+
+
+def shard_layout(user):
+    # Which change logs a cursor's positions refer to: "" when not sharded, else "<shard>/<shard count>"
+    shard = shard_for(user)
+    return "" if shard is None else "%d/%d" % (shard, DATABASE_SHARDS)
+
+
+def encode_cursor(note_seq, image_seq, layout=""):
+    position = [note_seq, image_seq, layout] if layout else [note_seq, image_seq]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(notes log position, images log position, shard layout) from a cursor; (0, 0, "") when there is none"""
+    if not cursor:
+        return 0, 0, ""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(position, list) or len(position) not in (2, 3):
+            raise ValueError(cursor)
+        note_seq, image_seq, layout = (position + [""])[:3]
+        if not isinstance(note_seq, int) or not isinstance(image_seq, int) or not isinstance(layout, str):
+            raise ValueError(cursor)
+        return note_seq, image_seq, layout
+    except ValueError:
+        raise InvalidCursor(cursor)
+
+
+def changes_since(user, cursor, limit=SYNC_PAGE_SIZE):
+    """The next page of changes to a user's notes and images after `cursor`, as a JSON-ready dict"""
+    note_seq, image_seq, layout = decode_cursor(cursor)
+    if cursor and (layout != shard_layout(user) or note_seq < sync_horizon(note_db_location_for(user))
+                   or image_seq < sync_horizon(image_db_location_for(user))):
+        raise ExpiredCursor(cursor)
+
+    notes, images = [], []
+    note_rows = read_note_changes(user, note_seq, limit)
+    for seq, op, note_id, timestamp, note in note_rows:
+        if op == "delete":
+            notes.append({"op": "delete", "note_id": note_id})
+        elif timestamp is not None:
+            notes.append({"op": "put", "note_id": note_id, "timestamp": timestamp, "note": note})
+        note_seq = seq
+    image_rows = read_image_changes(user, image_seq, limit)
+    for seq, op, image_id, timestamp, name in image_rows:
+        if op == "delete":
+            images.append({"op": "delete", "image_id": image_id})
+        elif timestamp is not None:
+            images.append({"op": "put", "image_id": image_id, "timestamp": timestamp, "name": name})
+        image_seq = seq
+
+    return {"notes": notes, "images": images, "cursor": encode_cursor(note_seq, image_seq, shard_layout(user)),
+            "has_more": len(note_rows) == limit or len(image_rows) == limit}
+
+
+@handler("compact_change_logs")
+def run_compact_change_logs(job, payload):
+    cutoff = int(time.time()) - SYNC_TOMBSTONE_DAYS * 86400
+    removed = 0
+    for location in note_db_locations():
+        removed += compact_change_log(location, "notes", "note_id", cutoff)
+    for location in image_db_locations():
+        removed += compact_change_log(location, "images", "image_id", cutoff)
+    job.progress(removed, removed)
+    logger.info("Compacted the sync change logs: %d entries removed", removed)
+    job.run_again(payload, SYNC_COMPACT_SECONDS)
+
+
+def start_compactor():
+    enqueue_job("compact_change_logs", {}, unique=True)
@@ -0,0 +1,31 @@
+import json
+import os
+import re
+
+# Written by tools/build_backgrounds.py along with the resized variants
+BACKGROUND_MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "assets", "backgrounds.json")
+# Generated files carry a hash of their content in their name (icons-4af4420918.png), so a URL never changes meaning
+FINGERPRINTED = re.compile(r"-[0-9a-f]{10}\.\w+$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+with open(BACKGROUND_MANIFEST) as f:
+    _backgrounds = json.load(f)
+
+
+# Let browsers keep fingerprinted static files for a year without revalidating
+def static_cache_control(path):
+    return IMMUTABLE if FINGERPRINTED.search(path) else None
+
+
+# The fallback URL, intrinsic size and a (type, srcset) pair per generated format for a background image
+def background_image(name, static_url_path="/static"):
+    entry = _backgrounds[name]
+    sources = [(mimetype, ", ".join(f"{static_url_path}/{path} {width}w" for path, width in srcset))
+               for mimetype, srcset in entry["sources"].items()]
+    return {"src": f"{static_url_path}/{entry['src']}", "width": entry["width"], "height": entry["height"],
+            "sources": sources}
+
+
+# Make the backgrounds available to templates as background_image()
+def register_backgrounds(app):
+    app.jinja_env.globals.update(background_image=lambda name: background_image(name, app.static_url_path))
@@ -0,0 +1,185 @@
+"""
+Throughput benchmark for the weather app against a simulated OpenWeather upstream.
+
+Starts tests/stub_server.py with the chosen latency distribution, starts the app (sync under
+gunicorn or async under uvicorn) with an empty cache pointed at it, then keeps a fixed number of
+requests in flight for a skewed (Zipf) mix of city pages: a few cities get most of the traffic,
+like real users. Prints one JSON document with throughput, latency percentiles, upstream calls
+and cache hit ratios, so runs before and after a change can be compared. Run from the
+weather-app directory:
+
+    python benchmarks/bench_weather.py --latency lognormal --latency-ms 150 --concurrency 64 --duration 20
+    python benchmarks/bench_weather.py --server uvicorn --zipf 1.2 --output results/async.json
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import urllib.request
+
+from compare_serving_modes import APP_DIR, free_port, percentile, start, stop
+
+STUB_SERVER = os.path.join(APP_DIR, "tests", "stub_server.py")
+CITIES_CSV = os.path.join(APP_DIR, "data", "cities.csv")
+
+SERVERS = {
+    "gunicorn": lambda port, workers: [sys.executable, "-m", "gunicorn", "--workers", str(workers),
+                                       "--bind", f"127.0.0.1:{port}", "main:app"],
+    "uvicorn": lambda port, workers: [sys.executable, "-m", "uvicorn", "--workers", str(workers),
+                                      "--port", str(port), "--log-level", "warning", "main_asgi:app"],
+}
+
+
+def city_paths(count):
+    """Page paths for the `count` most populous known cities, most populous first"""
+    with open(CITIES_CSV, encoding="utf-8") as f:
+        rows = sorted(csv.DictReader(f), key=lambda row: -int(row["population"]))
+    return [f"/{row['name']}, {row['region']}" for row in rows[:count]]
+
+
+def zipf_workload(paths, exponent, size, seed):
+    """`size` requests where the city of rank k is picked with probability proportional to 1/k^exponent"""
+    weights = [1 / rank ** exponent for rank in range(1, len(paths) + 1)]
+    return random.Random(seed).choices(paths, weights=weights, k=size)
+
+
+async def drive(base_url, workload, concurrency, duration):
+    """Keep `concurrency` requests in flight for `duration` seconds; returns (latencies, errors, elapsed)"""
+    import httpx
+
+    latencies, errors = [], 0
+    position = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal errors, position
+            while time.monotonic() < deadline:
+                path = workload[position % len(workload)]
+                position += 1
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    if response.status_code == 200:
+                        latencies.append(time.perf_counter() - started)
+                    else:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+    return latencies, errors, elapsed
+
+
+def fetch_json(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return json.load(response)
+
+
+def scrape_cache_counts(base_url):
+    """{cache: {result: count}} from the app's /metrics (one worker's view when there are several)"""
+    with urllib.request.urlopen(base_url + "/metrics", timeout=10) as response:
+        text = response.read().decode()
+    counts = {}
+    for cache, result, value in re.findall(
+            r'^weather_cache_requests_total\{cache="(\w+)",result="(\w+)",pid="\d+"\} (\S+)$', text, re.MULTILINE):
+        counts.setdefault(cache, {})[result] = float(value)
+    return counts
+
+
+def hit_ratio(hits, lookups):
+    return round(hits / lookups, 4) if lookups else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=SERVERS, default="gunicorn", help="serving mode to benchmark")
+    parser.add_argument("--workers", type=int, default=2, help="server worker processes")
+    parser.add_argument("--latency", default="lognormal", help="stub delay distribution")
+    parser.add_argument("--latency-ms", type=float, default=100, help="mean stub delay per upstream call")
+    parser.add_argument("--spread", type=float, default=0.5, help="relative half-width (uniform) or sigma (lognormal)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream calls answered with 503")
+    parser.add_argument("--cities", type=int, default=100, help="distinct cities in the workload")
+    parser.add_argument("--zipf", type=float, default=1.1, help="workload skew; 0 is uniform")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests kept in flight")
+    parser.add_argument("--duration", type=float, default=15, help="seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=0, help="seconds of unmeasured load first")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--prefetch", action="store_true",
+                        help="keep the background prefetcher on; its upstream calls then count against cache_hit_ratio")
+    parser.add_argument("--output", help="write the JSON result here as well as to stdout")
+    args = parser.parse_args()
+
+    stub_port, app_port = free_port(), free_port()
+    workdir = tempfile.mkdtemp(prefix="weather-bench-")
+    stub = start([sys.executable, STUB_SERVER, "--port", str(stub_port), "--latency", args.latency,
+                  "--latency-ms", str(args.latency_ms), "--spread", str(args.spread),
+                  "--error-rate", str(args.error_rate), "--seed", str(args.seed)], stub_port, dict(os.environ))
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    # The prefetcher's upstream calls aren't caused by requests, so by default it is off and every stub call is a miss
+    app_env = dict(os.environ, OWM_API_KEY="benchmark", LOG_LEVEL="WARNING",
+                   PREFETCH_ENABLED="1" if args.prefetch else "0",
+                   WEATHER_CACHE_PATH=os.path.join(workdir, "cache.sqlite3"),
+                   GEOCODING_API_ENDPOINT=f"{stub_url}/geo/1.0/direct",
+                   ONECALL_API_ENDPOINT=f"{stub_url}/data/3.0/onecall")
+    workload = zipf_workload(city_paths(args.cities), args.zipf, 100_000, args.seed)
+    base_url = f"http://127.0.0.1:{app_port}"
+
+    try:
+        server = start(SERVERS[args.server](app_port, args.workers), app_port, app_env)
+        try:
+            if args.warmup:
+                print(f"Warming up for {args.warmup:.0f}s...", file=sys.stderr)
+                asyncio.run(drive(base_url, workload, args.concurrency, args.warmup))
+            before = fetch_json(stub_url + "/_stub/stats")
+            print(f"Driving {args.server} for {args.duration:.0f}s at concurrency {args.concurrency}...",
+                  file=sys.stderr)
+            latencies, errors, elapsed = asyncio.run(drive(base_url, workload, args.concurrency, args.duration))
+            after = fetch_json(stub_url + "/_stub/stats")
+            cache_counts = scrape_cache_counts(base_url)
+        finally:
+            stop(server)
+    finally:
+        stop(stub)
+
+    requests_served = len(latencies)
+    upstream = {name: after[name] - before[name] for name in ("geocoding", "onecall", "errors")}
+    attempted = requests_served + errors
+    result = {
+        "config": vars(args),
+        "requests": requests_served,
+        "errors": errors,
+        "requests_per_sec": round(requests_served / elapsed, 1),
+        "latency_ms": {f"p{pct}": round(percentile(latencies, pct) * 1000, 1) if latencies else None
+                       for pct in (50, 95, 99)},
+        "upstream_calls": upstream,
+        "upstream_calls_per_request": round((upstream["geocoding"] + upstream["onecall"]) / attempted, 4)
+        if attempted else None,
+        # Every page needs coordinates and a forecast, so each request that didn't call upstream was a cache hit
+        "cache_hit_ratio": {
+            "geocode": hit_ratio(attempted - upstream["geocoding"], attempted),
+            "forecast": hit_ratio(attempted - upstream["onecall"], attempted),
+        },
+        "app_metrics_cache_hit_ratio": {
+            cache: hit_ratio(results.get("hit", 0), results.get("hit", 0) + results.get("miss", 0))
+            for cache, results in sorted(cache_counts.items())
+        },
+    }
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
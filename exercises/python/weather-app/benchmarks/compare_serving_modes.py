@@ -0,0 +1,208 @@
+"""
+Side-by-side throughput comparison of the sync (gunicorn) and async (uvicorn) serving modes.
+
+Starts a fake OpenWeather upstream that answers after a fixed delay, runs each mode of the app
+against it with the same number of worker processes, and drives the same concurrent /<city>
+load at both. Every request asks for a city no one asked for before, which the fake geocoder
+places at its own coordinates, and each mode starts with an empty cache and no prefetcher, so
+every request waits on two upstream calls: the comparison is of how each mode waits, not of
+cache hits. Run from the weather-app directory:
+
+    python benchmarks/compare_serving_modes.py --latency 0.2 --concurrency 200 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import zlib
+from urllib.parse import parse_qs
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ONECALL_BODY = json.dumps({
+    "current": {"temp": 12.3, "wind_speed": 3.6, "weather": [{"main": "Clouds"}]},
+    "daily": [{"temp": {"day": 12.0 + i, "min": 8.0 + i, "max": 15.0 + i}, "weather": [{"main": "Rain"}]}
+              for i in range(8)],
+}).encode()
+
+
+upstream_calls = 0
+
+
+# Coordinates for a city name, spread over the globe so different names get different forecast cache keys
+def geocoding_body(city_name):
+    spot = zlib.crc32(city_name.encode())
+    lat, lon = spot % 16000 / 100 - 80, spot // 16000 % 36000 / 100 - 180
+    return json.dumps([{"name": city_name, "lat": lat, "lon": lon, "country": "US"}]).encode()
+
+
+# Minimal ASGI app standing in for both OpenWeather endpoints; /_stats reports how many calls it answered
+async def upstream(scope, receive, send):
+    global upstream_calls
+    if scope["type"] != "http":
+        return
+    if scope["path"] == "/_stats":
+        body = json.dumps({"calls": upstream_calls}).encode()
+    else:
+        upstream_calls += 1
+        await asyncio.sleep(float(os.getenv("FAKE_UPSTREAM_LATENCY", "0.1")))
+        if scope["path"].startswith("/geo"):
+            body = geocoding_body(parse_qs(scope["query_string"].decode()).get("q", [""])[0])
+        else:
+            body = ONECALL_BODY
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited early with code {process.returncode}")
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start within {timeout}s")
+
+
+def start(command, port, env):
+    process = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port, process)
+    return process
+
+
+def stop(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def drive(base_url, concurrency, duration, run):
+    """Keep `concurrency` requests in flight for `duration` seconds, each for a new city, and collect latencies"""
+    import httpx
+
+    latencies, errors = [], 0
+    sent = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal errors, sent
+            while time.monotonic() < deadline:
+                sent += 1
+                started = time.perf_counter()
+                try:
+                    response = await client.get(f"/Bench {run} City {sent}")
+                    if response.status_code == 200:
+                        latencies.append(time.perf_counter() - started)
+                    else:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+    return latencies, errors, elapsed
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def fetch_upstream_calls(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stats", timeout=10) as response:
+        return json.load(response)["calls"]
+
+
+def summarize(mode, latencies, errors, elapsed, upstream_calls):
+    attempted = len(latencies) + errors
+    return {
+        "mode": mode,
+        "requests": len(latencies),
+        "errors": errors,
+        "upstream_calls_per_request": round(upstream_calls / attempted, 2) if attempted else None,
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds the fake upstream waits per call")
+    parser.add_argument("--concurrency", type=int, default=200, help="requests kept in flight")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to drive each mode")
+    parser.add_argument("--workers", type=int, default=2, help="server processes per mode")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    upstream_port = free_port()
+    env = dict(os.environ, FAKE_UPSTREAM_LATENCY=str(args.latency))
+    fake = start([sys.executable, "-m", "uvicorn", "--app-dir", BENCH_DIR, "compare_serving_modes:upstream",
+                  "--port", str(upstream_port), "--log-level", "warning"], upstream_port, env)
+
+    # No prefetcher, so every upstream call the fake sees is one a request waited on
+    app_env = dict(env, OWM_API_KEY="benchmark", LOG_LEVEL="WARNING", PREFETCH_ENABLED="0",
+                   GEOCODING_API_ENDPOINT=f"http://127.0.0.1:{upstream_port}/geo/1.0/direct",
+                   ONECALL_API_ENDPOINT=f"http://127.0.0.1:{upstream_port}/data/3.0/onecall")
+    modes = {
+        "sync (gunicorn)": lambda port: [sys.executable, "-m", "gunicorn", "--workers", str(args.workers),
+                                         "--bind", f"127.0.0.1:{port}", "main:app"],
+        "async (uvicorn)": lambda port: [sys.executable, "-m", "uvicorn", "--workers", str(args.workers),
+                                         "--port", str(port), "--log-level", "warning", "main_asgi:app"],
+    }
+    results = []
+    try:
+        for mode, command in modes.items():
+            port = free_port()
+            # Its own empty cache, so neither mode is served what the other fetched
+            cache_path = os.path.join(tempfile.mkdtemp(prefix="weather-compare-"), "cache.sqlite3")
+            server = start(command(port), port, dict(app_env, WEATHER_CACHE_PATH=cache_path))
+            try:
+                print(f"Driving {mode} for {args.duration:.0f}s at concurrency {args.concurrency}...")
+                before = fetch_upstream_calls(upstream_port)
+                latencies, errors, elapsed = asyncio.run(
+                    drive(f"http://127.0.0.1:{port}", args.concurrency, args.duration, len(results)))
+                calls = fetch_upstream_calls(upstream_port) - before
+                results.append(summarize(mode, latencies, errors, elapsed, calls))
+            finally:
+                stop(server)
+    finally:
+        stop(fake)
+
+    print()
+    print(f"{'mode':<18}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}{'calls/req':>11}")
+    for result in results:
+        print(f"{result['mode']:<18}{result['requests_per_sec']:>10}{result['p50_ms'] or '-':>10}"
+              f"{result['p95_ms'] or '-':>10}{result['p99_ms'] or '-':>10}{result['errors']:>8}"
+              f"{result['upstream_calls_per_request'] or '-':>11}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"latency": args.latency, "concurrency": args.concurrency, "workers": args.workers,
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
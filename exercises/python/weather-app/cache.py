@@ -0,0 +1,245 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# "sqlite" shares one cache file between all worker processes on the host; "memory" keeps a cache per process
+CACHE_BACKEND = os.getenv("WEATHER_CACHE_BACKEND", "sqlite")
+CACHE_PATH = os.getenv("WEATHER_CACHE_PATH",
+                       os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "weather-cache.sqlite3"))
+
+
+class CacheEntry(NamedTuple):
+    value: Any
+    stored_at: float
+    expires_at: float
+
+    def is_fresh(self, now=None):
+        return (now or time.time()) < self.expires_at
+
+
+class TTLCache:
+    """Thread-safe, size-bounded in-process cache with per-entry expiry.
+
+    Expired entries are kept for `stale_seconds` longer so callers that would rather show slightly
+    old data than an error can still reach them through get_entry(). The least recently used entry
+    is evicted once `max_entries` is reached.
+    """
+
+    def __init__(self, name, max_entries=1024, stale_seconds=3600):
+        self.name = name
+        self.max_entries = max_entries
+        self.stale_seconds = stale_seconds
+        self._entries = OrderedDict()
+        self._leases = {}
+        self._budgets = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_entry(self, key):
+        """Return the CacheEntry for `key`, fresh or stale, or None once it has aged out completely"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if now >= entry.expires_at + self.stale_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def get(self, key):
+        """Return the cached value for `key` if it hasn't expired, otherwise None"""
+        entry = self.get_entry(key)
+        if entry is None or not entry.is_fresh():
+            return None
+        return entry.value
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._entries[key] = CacheEntry(value, now, now + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def claim(self, key, seconds):
+        """Take a lease on `key` for `seconds`; False if someone else holds it"""
+        now = time.time()
+        with self._lock:
+            if self._leases.get(key, 0) > now:
+                return False
+            self._leases[key] = now + seconds
+            return True
+
+    def spend(self, budget, limit, window_seconds=60):
+        """Spend one unit of `budget`, allowing at most `limit` per window; False once it's used up"""
+        window = int(time.time() // window_seconds)
+        with self._lock:
+            spent = self._budgets.get((budget, window), 0)
+            if spent >= limit:
+                return False
+            self._budgets = {k: v for k, v in self._budgets.items() if k[0] != budget or k[1] == window}
+            self._budgets[(budget, window)] = spent + 1
+            return True
+
+    def spent(self, budget, window_seconds=60):
+        """Units of `budget` spent so far in the current window"""
+        window = int(time.time() // window_seconds)
+        with self._lock:
+            return self._budgets.get((budget, window), 0)
+
+
+class SQLiteCache:
+    """Cache shared by every process on the host through one SQLite file in WAL mode.
+
+    Same interface as TTLCache. Readers never block writers or each other under WAL, and a read is
+    one primary-key lookup through the memory-mapped file. Values are stored as JSON next to their
+    expiry; aged-out entries are purged and the oldest-expiring ones evicted past `max_entries`.
+    """
+
+    TRIM_EVERY = 64
+
+    def __init__(self, name, path=CACHE_PATH, max_entries=1024, stale_seconds=3600):
+        self.name = name
+        self.path = path
+        self.max_entries = max_entries
+        self.stale_seconds = stale_seconds
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._create_schema()
+
+    def _connection(self):
+        # One connection per thread, reopened after a fork so workers never share a handle
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA mmap_size=67108864")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _create_schema(self):
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                name TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,
+                stored_at REAL NOT NULL, expires_at REAL NOT NULL,
+                PRIMARY KEY (name, key)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS entries_by_expiry ON entries (name, expires_at);
+            CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, until REAL NOT NULL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS budgets (
+                name TEXT NOT NULL, window INTEGER NOT NULL, spent INTEGER NOT NULL,
+                PRIMARY KEY (name, window)) WITHOUT ROWID;
+        """)
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM entries WHERE name = ?", (self.name,)).fetchone()[0]
+
+    def get_entry(self, key):
+        """Return the CacheEntry for `key`, fresh or stale, or None once it has aged out completely"""
+        try:
+            row = self._connection().execute(
+                "SELECT value, stored_at, expires_at FROM entries WHERE name = ? AND key = ?",
+                (self.name, key)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Cache read from %s failed: %s", self.path, e)
+            return None
+        if row is None or time.time() >= row[2] + self.stale_seconds:
+            return None
+        return CacheEntry(json.loads(row[0]), row[1], row[2])
+
+    def get(self, key):
+        """Return the cached value for `key` if it hasn't expired, otherwise None"""
+        entry = self.get_entry(key)
+        if entry is None or not entry.is_fresh():
+            return None
+        return entry.value
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO entries (name, key, value, stored_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (self.name, key, json.dumps(value, separators=(",", ":")), now, now + ttl))
+            self._writes += 1
+            if self._writes % self.TRIM_EVERY == 0:
+                self.trim()
+        except sqlite3.Error as e:
+            logger.warning("Cache write to %s failed: %s", self.path, e)
+
+    def trim(self):
+        """Drop aged-out entries, then evict the soonest-expiring ones beyond max_entries"""
+        conn = self._connection()
+        conn.execute("DELETE FROM entries WHERE name = ? AND expires_at < ?",
+                     (self.name, time.time() - self.stale_seconds))
+        conn.execute("""
+            DELETE FROM entries WHERE name = ? AND key IN (
+                SELECT key FROM entries WHERE name = ? ORDER BY expires_at
+                LIMIT max(0, (SELECT COUNT(*) FROM entries WHERE name = ?) - ?))
+        """, (self.name, self.name, self.name, self.max_entries))
+
+    def clear(self):
+        self._connection().execute("DELETE FROM entries WHERE name = ?", (self.name,))
+
+    def claim(self, key, seconds):
+        """Take a lease on `key` for `seconds` across all processes; False if another one holds it"""
+        now = time.time()
+        try:
+            cursor = self._connection().execute(
+                "INSERT INTO leases (key, until) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET until = excluded.until WHERE leases.until <= ?",
+                (key, now + seconds, now))
+        except sqlite3.Error as e:
+            logger.warning("Cache lease on %s failed: %s", key, e)
+            return False
+        return cursor.rowcount == 1
+
+    def spend(self, budget, limit, window_seconds=60):
+        """Spend one unit of `budget` shared by all processes, at most `limit` per window"""
+        window = int(time.time() // window_seconds)
+        conn = self._connection()
+        try:
+            cursor = conn.execute(
+                "INSERT INTO budgets (name, window, spent) VALUES (?, ?, 1) "
+                "ON CONFLICT (name, window) DO UPDATE SET spent = spent + 1 WHERE spent < ?",
+                (budget, window, limit))
+            if cursor.rowcount == 1 and limit > 0:
+                conn.execute("DELETE FROM budgets WHERE name = ? AND window < ?", (budget, window))
+                return True
+        except sqlite3.Error as e:
+            logger.warning("Cache budget %s failed: %s", budget, e)
+        return False
+
+    def spent(self, budget, window_seconds=60):
+        """Units of `budget` spent so far in the current window, by all processes"""
+        window = int(time.time() // window_seconds)
+        try:
+            row = self._connection().execute("SELECT spent FROM budgets WHERE name = ? AND window = ?",
+                                             (budget, window)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Cache budget %s failed: %s", budget, e)
+            return 0
+        return 0 if row is None else row[0]
+
+
+def make_cache(name, max_entries=1024, stale_seconds=3600):
+    """Create a cache on the configured backend (WEATHER_CACHE_BACKEND)"""
+    if CACHE_BACKEND == "memory":
+        return TTLCache(name, max_entries=max_entries, stale_seconds=stale_seconds)
+    return SQLiteCache(name, max_entries=max_entries, stale_seconds=stale_seconds)
@@ -0,0 +1,256 @@
+import bisect
+import csv
+import heapq
+import math
+import os
+import threading
+import unicodedata
+from array import array
+from collections import defaultdict
+from typing import NamedTuple
+
+CITIES_DATASET = os.getenv("CITIES_DATASET",
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cities.csv"))
+
+# Prefix ranges wider than this are answered from a memoized population-ranked shortlist instead of a full scan
+SCAN_LIMIT = 256
+SHORTLIST_SIZE = 32
+
+# Side of a spatial grid cell in degrees; ~1 degree keeps cells small for dense datasets without many empty rings
+GRID_CELL_DEGREES = 1.0
+EARTH_RADIUS_KM = 6371.0
+
+
+class City(NamedTuple):
+    name: str
+    region: str
+    country: str
+    lat: float
+    lon: float
+    population: int
+
+    @property
+    def label(self):
+        """Search-box text for this city, e.g. 'Seattle, Washington'"""
+        return f"{self.name}, {self.region}" if self.region else self.name
+
+
+# Lowercase and strip accents so 'São Paulo', 'sao paulo' and 'SAO PAULO' share a key
+def normalize(text):
+    if text.isascii():
+        return " ".join(text.lower().split())
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(stripped.casefold().split())
+
+
+def load_cities(path=CITIES_DATASET):
+    """Read the bundled city dataset (name, region, country, lat, lon, population)"""
+    with open(path, newline="", encoding="utf-8") as f:
+        return [City(row["name"], row["region"], row["country"], float(row["lat"]), float(row["lon"]),
+                     int(row["population"] or 0))
+                for row in csv.DictReader(f)]
+
+
+class CityIndex:
+    """Prefix index over city names backed by a sorted array and bisect.
+
+    Suggestions are ranked by population plus how often each city has actually been looked up,
+    so the cities our users search for float to the top as they type.
+    """
+
+    def __init__(self, cities):
+        self.cities = cities
+        names = [normalize(city.name) for city in cities]
+        order = sorted(range(len(cities)), key=names.__getitem__)
+        self._keys = [names[i] for i in order]
+        self._ids = order
+        self._by_label = {normalize(city.label): i for i, city in enumerate(cities)}
+        self._hits = {}
+        self._popular_positions = []  # sorted positions (into _keys) of cities with at least one hit
+        self._position_of = {city_id: pos for pos, city_id in enumerate(order)}
+        self._shortlists = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.cities)
+
+    def _score(self, city_id):
+        # Every doubling of lookups is worth a tenfold bigger population
+        return math.log10(self.cities[city_id].population + 10) + math.log2(1 + self._hits.get(city_id, 0))
+
+    def _shortlist(self, key, lo, hi):
+        shortlist = self._shortlists.get(key)
+        if shortlist is None:
+            shortlist = heapq.nlargest(SHORTLIST_SIZE, self._ids[lo:hi], key=lambda i: self.cities[i].population)
+            self._shortlists[key] = shortlist
+        return shortlist
+
+    def suggest(self, query, limit=8):
+        """Return up to `limit` cities whose name starts with `query`, best match first.
+
+        A query such as 'portland, or' matches on the name and filters on the region prefix.
+        """
+        name_part, _, region_part = query.partition(",")
+        key = normalize(name_part)
+        region_key = normalize(region_part)
+        if not key:
+            return []
+
+        lo = bisect.bisect_left(self._keys, key)
+        hi = bisect.bisect_left(self._keys, key + "\uffff", lo)
+        if hi - lo <= SCAN_LIMIT:
+            candidates = set(self._ids[lo:hi])
+        else:
+            candidates = set(self._shortlist(key, lo, hi))
+            p_lo = bisect.bisect_left(self._popular_positions, lo)
+            p_hi = bisect.bisect_left(self._popular_positions, hi)
+            candidates.update(self._ids[pos] for pos in self._popular_positions[p_lo:p_hi])
+
+        if region_key:
+            candidates = [i for i in candidates
+                          if normalize(self.cities[i].region).startswith(region_key)
+                          or self.cities[i].country.casefold().startswith(region_key)]
+        return [self.cities[i] for i in heapq.nlargest(limit, candidates, key=self._score)]
+
+    def record_query(self, city_name):
+        """Count a successful lookup of `city_name` towards its suggestion ranking"""
+        key = normalize(city_name)
+        city_id = self._by_label.get(key)
+        if city_id is None:
+            # Fall back to the bare name, picking the most populous city that carries it
+            lo = bisect.bisect_left(self._keys, key)
+            hi = bisect.bisect_right(self._keys, key, lo)
+            if lo == hi:
+                return
+            city_id = max(self._ids[lo:hi], key=lambda i: self.cities[i].population)
+        with self._lock:
+            if city_id not in self._hits:
+                bisect.insort(self._popular_positions, self._position_of[city_id])
+            self._hits[city_id] = self._hits.get(city_id, 0) + 1
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class SpatialIndex:
+    """Uniform lat/lon grid for nearest-city lookups.
+
+    Building is a single bucketing pass (no sorting or tree balancing), so even hundreds of
+    thousands of cities index in well under a second. Coordinates live in flat float arrays.
+    """
+
+    def __init__(self, cities, cell_degrees=GRID_CELL_DEGREES):
+        self.cities = cities
+        self.cell = cell_degrees
+        self._rows = math.ceil(180 / cell_degrees)
+        self._cols = math.ceil(360 / cell_degrees)
+        self._lats = array("d", (city.lat for city in cities))
+        self._lons = array("d", (city.lon for city in cities))
+        self._cells = defaultdict(list)
+        for i, city in enumerate(cities):
+            self._cells[self._cell_of(city.lat, city.lon)].append(i)
+
+    def __len__(self):
+        return len(self.cities)
+
+    def _cell_of(self, lat, lon):
+        row = min(int((lat + 90) / self.cell), self._rows - 1)
+        col = int((lon + 180) / self.cell) % self._cols
+        return row, col
+
+    def _closest_in(self, cells, lat, lon, best):
+        best_id, best_km = best
+        for cell in cells:
+            for i in self._cells.get(cell, ()):
+                km = haversine_km(lat, lon, self._lats[i], self._lons[i])
+                if km < best_km:
+                    best_id, best_km = i, km
+        return best_id, best_km
+
+    def _ring(self, row, col, radius):
+        """Cells on the square ring `radius` cells away from (row, col)"""
+        for r in range(row - radius, row + radius + 1):
+            if not 0 <= r < self._rows:
+                continue
+            if abs(r - row) == radius:
+                cols = range(col - radius, col + radius + 1)
+            else:
+                cols = (col - radius, col + radius)
+            for c in cols:
+                yield r, c % self._cols
+
+    def nearest(self, lat, lon):
+        """Return (city, distance_km) for the city closest to lat/lon, or None if the index is empty"""
+        if not self.cities:
+            return None
+        row, col = self._cell_of(lat, lon)
+
+        # Grow rings around the starting cell until anything turns up
+        best = (None, math.inf)
+        radius = 0
+        while best[0] is None:
+            best = self._closest_in(self._ring(row, col, radius), lat, lon, best)
+            radius += 1
+
+        # A closer city can only sit inside the lat/lon box spanned by the current best distance
+        dlat = math.degrees(best[1] / EARTH_RADIUS_KM)
+        top = min(90.0, lat + dlat)
+        bottom = max(-90.0, lat - dlat)
+        widest = max(abs(top), abs(bottom))
+        if widest >= 89.9 or dlat / math.cos(math.radians(widest)) >= 180:
+            cols = range(self._cols)
+        else:
+            dlon = dlat / math.cos(math.radians(widest))
+            first = math.floor((lon - dlon + 180) / self.cell)
+            last = math.floor((lon + dlon + 180) / self.cell)
+            cols = {c % self._cols for c in range(first, last + 1)}
+        rows = range(self._cell_of(bottom, lon)[0], self._cell_of(top, lon)[0] + 1)
+        box = {(r, c) for r in rows for c in cols
+               if max(abs(r - row), min(abs(c - col), self._cols - abs(c - col))) >= radius}
+        best_id, best_km = self._closest_in(box, lat, lon, best)
+        return self.cities[best_id], best_km
+
+
+_cities = None
+_city_index = None
+_spatial_index = None
+_lock = threading.Lock()
+
+
+def get_cities():
+    """Load the city dataset once per process"""
+    global _cities
+    if _cities is None:
+        with _lock:
+            if _cities is None:
+                _cities = load_cities()
+    return _cities
+
+
+def get_city_index():
+    """Build the shared CityIndex on first use"""
+    global _city_index
+    if _city_index is None:
+        cities = get_cities()
+        with _lock:
+            if _city_index is None:
+                _city_index = CityIndex(cities)
+    return _city_index
+
+
+def get_spatial_index():
+    """Build the shared SpatialIndex on first use"""
+    global _spatial_index
+    if _spatial_index is None:
+        cities = get_cities()
+        with _lock:
+            if _spatial_index is None:
+                _spatial_index = SpatialIndex(cities)
+    return _spatial_index
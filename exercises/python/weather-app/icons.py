@@ -0,0 +1,20 @@
+import json
+import os
+
+# Written by tools/build_sprite.py along with the sprite and its stylesheet
+ICON_MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "assets", "icons.json")
+# Shown for any condition the sprite has no icon for
+DEFAULT_ICON = "clouds"
+
+with open(ICON_MANIFEST) as f:
+    _manifest = json.load(f)
+
+
+# CSS classes showing the sprite icon for an icon or OpenWeather condition name, e.g. "Rain" -> "icon icon-rain"
+def icon_class(name):
+    return "icon icon-" + _manifest["conditions"].get(name.casefold(), DEFAULT_ICON)
+
+
+# Make the sprite available to templates as icon_class() and icon_stylesheet
+def register_icons(app):
+    app.jinja_env.globals.update(icon_class=icon_class, icon_stylesheet=_manifest["stylesheet"])
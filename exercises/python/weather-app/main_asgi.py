@@ -0,0 +1,160 @@
+"""
+Async (ASGI) variant of the weather app.
+
+Serves the same routes, templates and responses as main.py, with the same request handling from
+views.py, but the handlers await non-blocking upstream calls instead of holding a worker while
+OpenWeather responds, so one process can keep thousands of upstream requests in flight. Run it
+with an ASGI server, e.g.
+
+    uvicorn main_asgi:app
+"""
+import os
+
+import httpx
+from quart import Quart, Response, render_template, request, redirect, url_for, jsonify
+
+from weather import async_geocode, async_fetch_onecall, async_weather_for_cities, WeatherDataError
+from weather import start_prefetcher, new_deadline, off_loop
+from icons import register_icons
+from assets import register_backgrounds
+from metrics import metrics
+from resilience import UpstreamUnavailable
+from logging_setup import setup_logging, bind_request_id
+import views
+
+# Connections the shared upstream client may hold open at once
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "1000"))
+UPSTREAM_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_TIMEOUT_SECONDS", "10"))
+
+setup_logging()
+
+app = Quart(__name__)
+register_icons(app)
+register_backgrounds(app)
+
+
+# One pooled HTTP client per process, opened when the server starts and closed when it stops
+@app.before_serving
+async def open_upstream_client():
+    app.upstream = httpx.AsyncClient(
+        timeout=UPSTREAM_TIMEOUT_SECONDS,
+        limits=httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS,
+                            max_keepalive_connections=UPSTREAM_MAX_CONNECTIONS),
+    )
+    start_prefetcher()
+
+
+@app.after_serving
+async def close_upstream_client():
+    await app.upstream.aclose()
+
+
+# Tag everything logged while serving a request with its correlation id
+@app.before_request
+async def assign_request_id():
+    bind_request_id(request.headers.get("X-Request-ID"))
+
+
+@app.after_request
+async def finish_response(response):
+    return views.finish_response(response, request.endpoint, request.path)
+
+
+# Display home page and get city name entered into search form
+@app.route("/", methods=["GET", "POST"])
+async def home():
+    if request.method == "POST":
+        return redirect(url_for("get_weather", city=views.searched_city(await request.form)))
+    return await render_template("index.html")
+
+
+# Suggest known cities for the home page search box as the user types
+@app.route("/suggest")
+async def suggest():
+    response = jsonify(views.suggestions(request.args))
+    response.headers["Cache-Control"] = views.SUGGEST_CACHE_CONTROL
+    return response
+
+
+# Display weather forecast for specific city using data from OpenWeather API
+@app.route("/<city>", methods=["GET", "POST"])
+async def get_weather(city):
+    city_name = views.city_name_from(city)
+
+    # Get latitude and longitude for city, redirecting to the error page if it has no coordinates
+    deadline = new_deadline()
+    coordinates = await async_geocode(app.upstream, city_name, deadline)
+    if coordinates is None:
+        return redirect(url_for("error"))
+    lat, lon = coordinates
+
+    return await render_forecast(city_name, lat, lon, deadline)
+
+
+# Display weather for the known city nearest to the browser's reported coordinates, skipping the geocoding API
+@app.route("/here")
+async def weather_here():
+    city = views.nearest_city(request.args)
+    if city is None:
+        return redirect(url_for("error"))
+    return await render_forecast(city.label, city.lat, city.lon)
+
+
+# Fetch the One Call forecast for coordinates and render the city page
+async def render_forecast(city_name, lat, lon, deadline=None):
+    try:
+        forecast, stale_since = await async_fetch_onecall(app.upstream, lat, lon, deadline)
+    except WeatherDataError as e:
+        views.log_unusable_forecast(city_name, e)
+        return redirect(url_for("error"))
+
+    page, key, context = views.cached_page(city_name, forecast, stale_since)
+    if page is None:
+        with metrics.timer("weather_render_seconds", template="city.html"):
+            html = await render_template("city.html", **context)
+        page = views.page_cache.put(key, html)
+
+    status, body, headers = views.page_response(city_name, page, request.headers)
+    return Response(body, status=status, headers=headers)
+
+
+# Display several cities side by side, fetching them concurrently
+@app.route("/compare")
+async def compare():
+    city_names = views.requested_cities(request.args)
+    results = await async_weather_for_cities(app.upstream, city_names) if city_names else []
+    with metrics.timer("weather_render_seconds", template="compare.html"):
+        return await render_template("compare.html", **views.compare_context(city_names, results))
+
+
+# JSON version of the comparison for API clients
+@app.route("/api/compare")
+async def compare_api():
+    city_names = views.requested_cities(request.args)
+    if not city_names:
+        return jsonify(views.COMPARE_USAGE), 400
+    return jsonify(views.compare_json(await async_weather_for_cities(app.upstream, city_names)))
+
+
+# Prometheus scrape endpoint: upstream latency, cache effectiveness and quota usage
+@app.route("/metrics")
+async def metrics_endpoint():
+    # The upstream-call gauges read the shared cache, which blocks
+    return Response(await off_loop(metrics.render), mimetype=views.METRICS_MIMETYPE)
+
+
+# Display error page for invalid input
+@app.route("/error")
+async def error():
+    return await render_template("error.html")
+
+
+# OpenWeather is down or too slow and nothing usable is cached: say so instead of a 500
+@app.errorhandler(UpstreamUnavailable)
+async def upstream_unavailable(e):
+    views.log_unavailable(e)
+    return await render_template("error.html", message=views.UNAVAILABLE_MESSAGE), 503
+
+
+if __name__ == "__main__":
+    app.run(debug=True, port=int(os.getenv("PORT", "5000")))
@@ -0,0 +1,108 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implied
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Metrics:
+    """In-process counters, gauges and latency histograms, rendered in the Prometheus text format.
+
+    Counters and histograms only count what this process served. Under gunicorn each worker
+    has its own and a scrape of /metrics reaches whichever worker accepts it, so their series
+    carry a `pid` label: the scraper sees a new series, rather than a counter reset, when it
+    reaches another worker, and the workers' series can be summed once each has been scraped.
+    Gauges whose value lives elsewhere (e.g. in the shared cache) are registered as callbacks and
+    read only when the metrics are scraped.
+    """
+
+    def __init__(self):
+        self._help = {}
+        self._types = {}
+        self._counters = {}
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, help_text):
+        self._types[name] = kind
+        self._help[name] = help_text
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 3)
+            histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def gauge(self, name, read, **labels):
+        """Report `read()` as the value of a gauge each time metrics are rendered"""
+        self._gauges[(name, tuple(sorted(labels.items())))] = read
+
+    def value(self, name, **labels):
+        """Current value of a counter, mostly for tests and benchmarks"""
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def render(self):
+        # Read on each render: with gunicorn --preload the workers are forked after this module is imported
+        pid = (("pid", os.getpid()),)
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(values) for key, values in self._histograms.items()}
+        samples = {}
+        for (name, labels), value in counters.items():
+            samples.setdefault(name, []).append(f"{name}{_label_text(labels + pid)} {value}")
+        for (name, labels), values in histograms.items():
+            labels += pid
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), values):
+                cumulative += count
+                lines.append(f"{name}_bucket{_label_text(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(labels)} {values[-2]:.6f}")
+            lines.append(f"{name}_count{_label_text(labels)} {values[-1]}")
+        for (name, labels), read in self._gauges.items():
+            samples.setdefault(name, []).append(f"{name}{_label_text(labels)} {read()}")
+
+        output = []
+        for name in sorted(samples):
+            if name in self._help:
+                output.append(f"# HELP {name} {self._help[name]}")
+                output.append(f"# TYPE {name} {self._types[name]}")
+            output.extend(samples[name])
+        return "\n".join(output) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("weather_upstream_request_seconds", "histogram", "Time spent on OpenWeather calls")
+metrics.describe("weather_upstream_requests_total", "counter", "OpenWeather calls by endpoint and outcome")
+metrics.describe("weather_render_seconds", "histogram", "Time spent rendering templates")
+metrics.describe("weather_cache_requests_total", "counter", "Cache lookups by cache and result (hit, miss, stale)")
+metrics.describe("weather_upstream_calls", "gauge", "OpenWeather calls made in the current window by all workers")
+metrics.describe("weather_upstream_quota", "gauge", "Configured OpenWeather call quota per window")
+metrics.describe("weather_circuit_open", "gauge", "1 while the endpoint's circuit breaker is not closed")
@@ -0,0 +1,98 @@
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple
+
+from werkzeug.http import parse_accept_header, parse_etags
+
+from metrics import metrics
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; pages are still served gzipped or plain without it
+    brotli = None
+
+PAGE_CACHE_ENTRIES = int(os.getenv("PAGE_CACHE_ENTRIES", "2000"))
+
+
+class RenderedPage(NamedTuple):
+    """One rendered page, stored once per content encoding along with its strong ETag"""
+    etags: Dict[str, str]
+    bodies: Dict[str, bytes]
+
+    @classmethod
+    def build(cls, html):
+        body = html.encode("utf-8")
+        digest = hashlib.sha1(body).hexdigest()
+        etags, bodies = {"identity": f'"{digest}"'}, {"identity": body}
+        compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(body)
+        for encoding, data in compressed.items():
+            if len(data) < len(body):
+                # Each representation is a different byte sequence, so it gets its own strong ETag
+                etags[encoding] = f'"{digest}-{encoding}"'
+                bodies[encoding] = data
+        return cls(etags, bodies)
+
+    def negotiate(self, accept_encoding):
+        """Pick the smallest stored encoding the client accepts"""
+        accepted = parse_accept_header(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and accepted[encoding] > 0:
+                return encoding
+        return "identity"
+
+    def respond(self, accept_encoding, if_none_match):
+        """Return (status, body, headers) for a request with these header values"""
+        encoding = self.negotiate(accept_encoding)
+        etag = self.etags[encoding]
+        headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+        if parse_etags(if_none_match).contains(etag.strip('"')):
+            return 304, b"", headers
+        headers["Content-Type"] = "text/html; charset=utf-8"
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return 200, self.bodies[encoding], headers
+
+
+class PageCache:
+    """Thread-safe LRU of rendered pages.
+
+    Callers key pages on everything that shows up in them (city, units, calendar date and the
+    forecast itself), so an entry never has to be invalidated: a new forecast is a new key and the
+    old page ages out of the LRU.
+    """
+
+    def __init__(self, name="page", max_entries=PAGE_CACHE_ENTRIES):
+        self.name = name
+        self.max_entries = max_entries
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, key):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+        metrics.inc("weather_cache_requests_total", cache=self.name, result="miss" if page is None else "hit")
+        return page
+
+    def put(self, key, html):
+        """Compress and store a freshly rendered page; returns the RenderedPage"""
+        page = RenderedPage.build(html)
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+        return page
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
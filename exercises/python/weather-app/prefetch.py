@@ -0,0 +1,96 @@
+import heapq
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchScheduler:
+    """Keeps the forecasts of the most requested cities warm.
+
+    Every request for a city bumps its popularity score (scores halve every `decay_seconds`, so the
+    ranking follows current traffic). A background thread wakes every `interval_seconds`, looks at
+    the top `top_n` cities and refreshes any whose cached forecast expires within `lead_seconds`.
+
+    The call budget and a short per-city lease are kept in the cache backend, so with the shared
+    SQLite cache all worker processes together spend at most `calls_per_minute` upstream calls and
+    never refresh the same city twice.
+    """
+
+    def __init__(self, cache, refresh, top_n=20, calls_per_minute=30, lead_seconds=60, interval_seconds=5,
+                 decay_seconds=3600):
+        self.cache = cache
+        self.refresh = refresh
+        self.top_n = top_n
+        self.calls_per_minute = calls_per_minute
+        self.lead_seconds = lead_seconds
+        self.interval_seconds = interval_seconds
+        self.decay_seconds = decay_seconds
+        self._popularity = {}  # cache key -> [score, lat, lon]
+        self._last_decay = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, key, lat, lon):
+        """Count one request for the forecast stored under `key`"""
+        with self._lock:
+            entry = self._popularity.get(key)
+            if entry is None:
+                self._popularity[key] = [1.0, lat, lon]
+            else:
+                entry[0] += 1
+
+    def top(self):
+        """The `top_n` most popular (key, lat, lon), most popular first"""
+        with self._lock:
+            ranked = heapq.nlargest(self.top_n, self._popularity.items(), key=lambda item: item[1][0])
+        return [(key, lat, lon) for key, (_, lat, lon) in ranked]
+
+    def _decay(self, now):
+        if now - self._last_decay < self.decay_seconds:
+            return
+        with self._lock:
+            for key in list(self._popularity):
+                entry = self._popularity[key]
+                entry[0] /= 2
+                if entry[0] < 0.5:
+                    del self._popularity[key]
+        self._last_decay = now
+
+    def run_once(self):
+        """Refresh popular forecasts that are about to expire; returns how many were refreshed"""
+        self._decay(time.monotonic())
+        refreshed = 0
+        for key, lat, lon in self.top():
+            entry = self.cache.get_entry(key)
+            if entry is not None and entry.expires_at - time.time() > self.lead_seconds:
+                continue
+            if not self.cache.claim("prefetch:" + key, self.interval_seconds * 2):
+                continue
+            if not self.cache.spend("prefetch", self.calls_per_minute):
+                logger.info("Prefetch budget of %d calls/minute spent, deferring the rest", self.calls_per_minute)
+                break
+            try:
+                self.refresh(lat, lon)
+                refreshed += 1
+            except Exception as e:
+                logger.warning("Prefetch of %s failed: %s", key, e)
+        return refreshed
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            self.run_once()
+
+    def start(self):
+        """Start the background thread (once per process)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="forecast-prefetch", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,70 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when OpenWeather can't answer in time: it failed, timed out or its circuit is open"""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    """Raised instead of calling an endpoint whose circuit breaker is open"""
+
+
+class Deadline:
+    """Latency budget for one request, shared by every upstream call made while serving it"""
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+class CircuitBreaker:
+    """Stops calling an upstream endpoint after repeated failures.
+
+    After `failure_threshold` consecutive failures the circuit opens and allow() fails fast for
+    `reset_seconds`. Then a single trial call is let through (half-open): success closes the
+    circuit again, failure re-opens it for another `reset_seconds`. A trial whose outcome is never
+    recorded expires after `reset_seconds`, and the next caller gets to make a new one.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=5, reset_seconds=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may go ahead now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state != self.CLOSED and time.monotonic() - self._opened_at >= self.reset_seconds:
+                # Time to try again, or the last trial call never reported back
+                self.state = self.HALF_OPEN
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Circuit for %s opened after %d failures", self.name, self._failures)
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
@@ -0,0 +1,29 @@
+// "Use my location": send the browser's coordinates to /here instead of a typed city name
+(function () {
+    const link = document.getElementById("locate");
+    if (!link) {
+        return;
+    }
+    if (!("geolocation" in navigator)) {
+        link.parentElement.hidden = true;
+        return;
+    }
+
+    link.addEventListener("click", (event) => {
+        event.preventDefault();
+        link.textContent = " LOCATING... ";
+        navigator.geolocation.getCurrentPosition(
+            (position) => {
+                const params = new URLSearchParams({
+                    lat: position.coords.latitude.toFixed(4),
+                    lon: position.coords.longitude.toFixed(4),
+                });
+                window.location.href = link.getAttribute("href") + "?" + params.toString();
+            },
+            () => {
+                link.textContent = " LOCATION UNAVAILABLE ";
+            },
+            {maximumAge: 600000, timeout: 10000}
+        );
+    });
+})();
@@ -0,0 +1,56 @@
+// Typeahead for the home page search box: asks /suggest for known cities once the user pauses typing
+(function () {
+    const DEBOUNCE_MS = 150;
+    const input = document.getElementById("search");
+    const list = document.getElementById("city-suggestions");
+    if (!input || !list) {
+        return;
+    }
+
+    let timer = null;
+    let controller = null;
+    const cache = new Map();
+
+    function render(suggestions) {
+        list.replaceChildren(...suggestions.map((city) => {
+            const option = document.createElement("option");
+            option.value = city.label;
+            return option;
+        }));
+    }
+
+    async function fetchSuggestions(query) {
+        if (cache.has(query)) {
+            render(cache.get(query));
+            return;
+        }
+        // Drop the in-flight request for the previous keystroke
+        if (controller) {
+            controller.abort();
+        }
+        controller = new AbortController();
+        try {
+            const response = await fetch("/suggest?q=" + encodeURIComponent(query), {signal: controller.signal});
+            if (!response.ok) {
+                return;
+            }
+            const suggestions = await response.json();
+            cache.set(query, suggestions);
+            render(suggestions);
+        } catch (err) {
+            if (err.name !== "AbortError") {
+                render([]);
+            }
+        }
+    }
+
+    input.addEventListener("input", () => {
+        clearTimeout(timer);
+        const query = input.value.trim();
+        if (query.length === 0) {
+            render([]);
+            return;
+        }
+        timer = setTimeout(() => fetchSuggestions(query), DEBOUNCE_MS);
+    });
+})();
@@ -2,36 +2,77 @@
 Pytest configuration and fixtures for Weather App E2E tests
 """
 import pytest
+import socket
 import subprocess
+import sys
 import time
 import os
 import signal
 from playwright.sync_api import Page, expect
 
+from tests.stub_server import LatencyModel, StubServer
+
+
+# "stub" (default) runs the suite against tests/stub_server.py; "live" calls the real OpenWeather API
+UPSTREAM = os.getenv("WEATHER_TEST_UPSTREAM", "stub")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# OpenWeather stand-in, one per test session (and so per pytest-xdist worker)
+@pytest.fixture(scope="session")
+def upstream_stub():
+    """Start the fixture-replaying stub server unless the suite runs against the live API"""
+    if UPSTREAM == "live":
+        yield None
+        return
+
+    latency = LatencyModel(os.getenv("STUB_LATENCY", "fixed"), float(os.getenv("STUB_LATENCY_MS", "0")))
+    server = StubServer(latency=latency, error_rate=float(os.getenv("STUB_ERROR_RATE", "0"))).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope="session")
+def app_port():
+    """Port for the app under test; a free one so parallel sessions don't collide"""
+    return int(os.getenv("WEATHER_TEST_PORT") or free_port())
+
 
 # Flask app process fixture
 @pytest.fixture(scope="session")
-def flask_app():
+def flask_app(upstream_stub, app_port, tmp_path_factory):
     """Start Flask app before tests and stop after all tests complete"""
     # Get the project root directory
     project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-    # Start Flask app in background
+    # Each session gets its own port and cache file so parallel runs stay independent
+    session_dir = tmp_path_factory.mktemp("weather-app")
+    env = dict(os.environ, PORT=str(app_port), WEATHER_CACHE_PATH=str(session_dir / "cache.sqlite3"))
+    if upstream_stub is not None:
+        env.update(upstream_stub.app_env(), OWM_API_KEY="stub")
+
+    # Start Flask app in background, logging to a file so a full pipe can never block it
+    log_file = open(session_dir / "app.log", "wb")
     process = subprocess.Popen(
-        ["python", "-u", "main.py"],
+        [sys.executable, "-u", "main.py"],
         cwd=project_dir,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
+        env=env,
+        stdout=log_file,
+        stderr=subprocess.STDOUT,
         preexec_fn=os.setsid  # Create new process group
     )
 
-    # Wait for Flask to start (check if port 5000 is ready)
+    # Wait for Flask to start (check if its port is ready)
     max_retries = 30
     for i in range(max_retries):
         try:
-            import socket
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            result = sock.connect_ex(('127.0.0.1', 5000))
+            result = sock.connect_ex(('127.0.0.1', app_port))
             sock.close()
             if result == 0:
                 print("Flask app started successfully")
@@ -41,19 +82,20 @@ def flask_app():
         time.sleep(0.5)
     else:
         process.kill()
-        raise Exception("Flask app failed to start within 15 seconds")
+        raise Exception(f"Flask app failed to start within 15 seconds, see {session_dir / 'app.log'}")
 
     yield process
 
     # Cleanup: Stop Flask app
     os.killpg(os.getpgid(process.pid), signal.SIGTERM)
     process.wait()
+    log_file.close()
 
 
 @pytest.fixture(scope="session")
-def base_url():
+def base_url(app_port):
     """Base URL for the Flask app"""
-    return "http://127.0.0.1:5000"
+    return f"http://127.0.0.1:{app_port}"
 
 
 @pytest.fixture(scope="function")
@@ -0,0 +1,253 @@
+"""
+Local stand-in for the two OpenWeather endpoints the app calls, replaying recorded fixtures
+
+Geocoding answers come from fixtures/geocoding.json (keyed by the case- and whitespace-normalised
+query; unknown cities get an empty list, like the real API). One Call answers come from
+fixtures/onecall/<lat>,<lon>.json when a recording exists for those coordinates, otherwise from
+fixtures/onecall/default.json. Each response can be delayed and a share of them replaced by 503s,
+so the app's caching and failure handling can be exercised without network access.
+
+Run standalone and point the app at it:
+
+    python tests/stub_server.py --port 8081 --latency-ms 80 --latency lognormal --error-rate 0.02
+    GEOCODING_API_ENDPOINT=http://127.0.0.1:8081/geo/1.0/direct \\
+    ONECALL_API_ENDPOINT=http://127.0.0.1:8081/data/3.0/onecall python main.py
+
+Refresh or add recordings from the live API (needs network access and OWM_API_KEY):
+
+    python tests/stub_server.py --record "Seattle, Washington" "London"
+"""
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+GEOCODING_PATH = "/geo/1.0/direct"
+ONECALL_PATH = "/data/3.0/onecall"
+STATS_PATH = "/_stub/stats"
+
+
+def normalize_query(query):
+    return " ".join(query.casefold().split())
+
+
+def coordinates_name(lat, lon):
+    return f"{lat:.2f},{lon:.2f}"
+
+
+class LatencyModel:
+    """Delay added to every response: fixed, uniform (mean ± spread), exponential or lognormal"""
+
+    KINDS = ("fixed", "uniform", "exponential", "lognormal")
+
+    def __init__(self, kind="fixed", mean_ms=0.0, spread=0.5):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution {kind!r}, expected one of {self.KINDS}")
+        self.kind = kind
+        self.mean_ms = mean_ms
+        self.spread = spread
+
+    def sample(self, rng):
+        """One delay in seconds"""
+        if self.mean_ms <= 0:
+            return 0.0
+        if self.kind == "uniform":
+            delay = rng.uniform(self.mean_ms * (1 - self.spread), self.mean_ms * (1 + self.spread))
+        elif self.kind == "exponential":
+            delay = rng.expovariate(1 / self.mean_ms)
+        elif self.kind == "lognormal":
+            # `spread` is sigma; mu is chosen so the distribution's mean is mean_ms (long tail, like real networks)
+            delay = rng.lognormvariate(math.log(self.mean_ms) - self.spread ** 2 / 2, self.spread)
+        else:
+            delay = self.mean_ms
+        return max(delay, 0.0) / 1000
+
+
+class Fixtures:
+    """Recorded OpenWeather responses, loaded once"""
+
+    def __init__(self, directory=FIXTURES_DIR):
+        self.directory = directory
+        with open(os.path.join(directory, "geocoding.json"), encoding="utf-8") as f:
+            self.geocoding = {normalize_query(query): results for query, results in json.load(f).items()}
+        self.onecall = {}
+        onecall_dir = os.path.join(directory, "onecall")
+        for filename in os.listdir(onecall_dir):
+            if filename.endswith(".json"):
+                with open(os.path.join(onecall_dir, filename), "rb") as f:
+                    self.onecall[filename[:-len(".json")]] = f.read()
+
+    def geocode(self, query, limit):
+        return json.dumps(self.geocoding.get(normalize_query(query), [])[:limit]).encode()
+
+    def forecast(self, lat, lon):
+        return self.onecall.get(coordinates_name(lat, lon), self.onecall["default"])
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if url.path == STATS_PATH:
+            return self.reply(200, json.dumps(self.server.stats()).encode())
+        if url.path not in (GEOCODING_PATH, ONECALL_PATH):
+            return self.reply(404, b'{"cod":"404","message":"Internal error"}')
+
+        delay, fail = self.server.next_outcome(url.path)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            return self.reply(503, b'{"cod":503,"message":"Injected by the stub server"}')
+        if not params.get("appid"):
+            return self.reply(401, b'{"cod":401,"message":"Invalid API key."}')
+
+        try:
+            if url.path == GEOCODING_PATH:
+                body = self.server.fixtures.geocode(params.get("q", ""), int(params.get("limit", 5)))
+            else:
+                body = self.server.fixtures.forecast(float(params["lat"]), float(params["lon"]))
+        except (KeyError, ValueError):
+            return self.reply(400, b'{"cod":"400","message":"Nothing to geocode"}')
+        self.reply(200, body)
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubServer(ThreadingHTTPServer):
+    """OpenWeather stand-in serving fixtures on 127.0.0.1; port 0 picks a free port.
+
+    Injected latency and errors come from a seeded generator, so a run with the same seed and
+    request order sees the same delays and failures.
+    """
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, port=0, latency=None, error_rate=0.0, seed=0, fixtures=None, verbose=False):
+        super().__init__(("127.0.0.1", port), StubHandler)
+        self.latency = latency or LatencyModel()
+        self.error_rate = error_rate
+        self.fixtures = fixtures or Fixtures()
+        self.verbose = verbose
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counts = {GEOCODING_PATH: 0, ONECALL_PATH: 0, "errors": 0}
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @property
+    def geocoding_endpoint(self):
+        return self.base_url + GEOCODING_PATH
+
+    @property
+    def onecall_endpoint(self):
+        return self.base_url + ONECALL_PATH
+
+    def app_env(self):
+        """Environment variables pointing the weather app at this server"""
+        return {"GEOCODING_API_ENDPOINT": self.geocoding_endpoint, "ONECALL_API_ENDPOINT": self.onecall_endpoint}
+
+    def next_outcome(self, path):
+        """Count a request and draw its (delay in seconds, whether to fail it)"""
+        with self._lock:
+            self._counts[path] += 1
+            delay = self.latency.sample(self._rng)
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self._counts["errors"] += 1
+        return delay, fail
+
+    def stats(self):
+        with self._lock:
+            return {"geocoding": self._counts[GEOCODING_PATH], "onecall": self._counts[ONECALL_PATH],
+                    "errors": self._counts["errors"]}
+
+    def start(self):
+        """Serve from a background thread; returns self"""
+        self._thread = threading.Thread(target=self.serve_forever, name="openweather-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def record(queries, directory=FIXTURES_DIR):
+    """Fetch live responses for `queries` and add them to the fixtures"""
+    import requests
+
+    api_key = os.environ["OWM_API_KEY"]
+    path = os.path.join(directory, "geocoding.json")
+    with open(path, encoding="utf-8") as f:
+        geocoding = json.load(f)
+    for query in queries:
+        response = requests.get("http://api.openweathermap.org" + GEOCODING_PATH,
+                                params={"q": query, "limit": 5, "appid": api_key}, timeout=10)
+        response.raise_for_status()
+        results = response.json()
+        geocoding[normalize_query(query)] = results
+        print(f"Recorded geocoding for {query!r}: {len(results)} results")
+        if not results:
+            continue
+        lat, lon = results[0]["lat"], results[0]["lon"]
+        response = requests.get("https://api.openweathermap.org" + ONECALL_PATH, timeout=10,
+                                params={"lat": lat, "lon": lon, "appid": api_key, "units": "metric",
+                                        "exclude": "minutely,hourly,alerts"})
+        response.raise_for_status()
+        with open(os.path.join(directory, "onecall", coordinates_name(lat, lon) + ".json"), "w") as f:
+            json.dump(response.json(), f, indent=1)
+        print(f"Recorded One Call for {query!r} at {coordinates_name(lat, lon)}")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(dict(sorted(geocoding.items())), f, indent=1, ensure_ascii=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0, help="mean delay added to each response")
+    parser.add_argument("--latency", choices=LatencyModel.KINDS, default="fixed", help="delay distribution")
+    parser.add_argument("--spread", type=float, default=0.5,
+                        help="relative half-width for uniform, sigma for lognormal")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    parser.add_argument("--record", nargs="+", metavar="QUERY", help="record live responses for these cities")
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record)
+        return
+    server = StubServer(args.port, LatencyModel(args.latency, args.latency_ms, args.spread), args.error_rate,
+                        args.seed, verbose=args.verbose)
+    print(f"OpenWeather stub listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
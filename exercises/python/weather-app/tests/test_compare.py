@@ -0,0 +1,53 @@
+"""
+E2E tests for the multi-city comparison view
+Tests the side-by-side table and its JSON counterpart
+"""
+import pytest
+from playwright.sync_api import Page, expect
+
+
+@pytest.mark.e2e
+@pytest.mark.api
+class TestCompare:
+    """Test suite for comparing several cities"""
+
+    def test_compare_page_has_form(self, page: Page, flask_app, base_url):
+        """Test that the comparison page without cities shows only the form"""
+        page.goto(f"{base_url}/compare")
+
+        expect(page.locator('input[name="cities"]')).to_be_visible()
+        expect(page.locator(".compare-table")).to_have_count(0)
+
+    @pytest.mark.smoke
+    def test_compare_shows_row_per_city(self, page: Page, flask_app, base_url):
+        """Test that each requested city gets its own row"""
+        page.goto(f"{base_url}/compare?cities=Seattle, Washington;London;Tokyo")
+
+        rows = page.locator(".compare-row")
+        expect(rows).to_have_count(3)
+        expect(rows.nth(0)).to_contain_text("Seattle, Washington")
+        expect(rows.nth(1)).to_contain_text("London")
+        expect(rows.nth(2)).to_contain_text("Tokyo")
+
+    def test_compare_marks_unknown_city(self, page: Page, flask_app, base_url):
+        """Test that an unknown city is reported in its row without failing the page"""
+        page.goto(f"{base_url}/compare?cities=London;Xyzabc123")
+
+        expect(page.locator(".compare-row")).to_have_count(2)
+        expect(page.locator(".compare-error")).to_contain_text("City not found")
+
+    def test_compare_api(self, page: Page, flask_app, base_url):
+        """Test that the JSON API returns one entry per city in request order"""
+        response = page.request.get(f"{base_url}/api/compare?city=London&city=Paris")
+        assert response.ok
+
+        results = response.json()
+        assert [result["city"] for result in results] == ["London", "Paris"]
+        for result in results:
+            assert result["error"] is None
+            assert len(result["weather"]["five_day_temp_list"]) == 5
+
+    def test_compare_api_requires_cities(self, page: Page, flask_app, base_url):
+        """Test that the JSON API rejects a request without cities"""
+        response = page.request.get(f"{base_url}/api/compare")
+        assert response.status == 400
@@ -11,7 +11,7 @@ from playwright.sync_api import Page, expect
 class TestErrorHandling:
     """Test suite for error handling and edge cases"""
 
-    def test_invalid_city_name(self, page_with_app: Page):
+    def test_invalid_city_name(self, page_with_app: Page, base_url):
         """Test handling of completely invalid city names"""
         search_input = page_with_app.locator('input[name="search"]')
         submit_button = page_with_app.locator('button[type="submit"]')
@@ -25,7 +25,7 @@ class TestErrorHandling:
 
         for invalid_city in invalid_cities:
             # Navigate to home
-            page_with_app.goto("http://127.0.0.1:5000/")
+            page_with_app.goto(f"{base_url}/")
 
             search_input.fill(invalid_city)
             submit_button.click()
@@ -36,10 +36,10 @@ class TestErrorHandling:
             # Check if error page is shown or stayed on home
             current_url = page_with_app.url
             # Either shows error page or redirects back
-            assert "/error" in current_url or current_url == "http://127.0.0.1:5000/", \
+            assert "/error" in current_url or current_url == f"{base_url}/", \
                 f"Invalid city '{invalid_city}' should show error or redirect to home"
 
-    def test_special_characters_in_search(self, page_with_app: Page):
+    def test_special_characters_in_search(self, page_with_app: Page, base_url):
         """Test handling of special characters in city search"""
         search_input = page_with_app.locator('input[name="search"]')
         submit_button = page_with_app.locator('button[type="submit"]')
@@ -51,7 +51,7 @@ class TestErrorHandling:
         ]
 
         for special_input in special_inputs:
-            page_with_app.goto("http://127.0.0.1:5000/")
+            page_with_app.goto(f"{base_url}/")
 
             search_input.fill(special_input)
             submit_button.click()
@@ -61,10 +61,10 @@ class TestErrorHandling:
             # Should handle gracefully without crashing
             # Either shows error or redirects to home
             current_url = page_with_app.url
-            assert "/error" in current_url or current_url == "http://127.0.0.1:5000/", \
+            assert "/error" in current_url or current_url == f"{base_url}/", \
                 f"Special characters should be handled safely"
 
-    def test_very_long_city_name(self, page_with_app: Page):
+    def test_very_long_city_name(self, page_with_app: Page, base_url):
         """Test handling of extremely long input"""
         search_input = page_with_app.locator('input[name="search"]')
         submit_button = page_with_app.locator('button[type="submit"]')
@@ -79,13 +79,13 @@ class TestErrorHandling:
 
         # Should handle without crashing
         current_url = page_with_app.url
-        assert "/error" in current_url or current_url == "http://127.0.0.1:5000/", \
+        assert "/error" in current_url or current_url == f"{base_url}/", \
             "Very long input should be handled gracefully"
 
-    def test_error_page_exists(self, page_with_app: Page):
+    def test_error_page_exists(self, page_with_app: Page, base_url):
         """Test that error page is accessible and properly formatted"""
         # Navigate directly to error page
-        page_with_app.goto("http://127.0.0.1:5000/error")
+        page_with_app.goto(f"{base_url}/error")
 
         # Verify error page loads
         expect(page_with_app).to_have_title("Error")
@@ -94,7 +94,7 @@ class TestErrorHandling:
         body = page_with_app.locator("body")
         expect(body).to_be_visible()
 
-    def test_unicode_city_names(self, page_with_app: Page):
+    def test_unicode_city_names(self, page_with_app: Page, base_url):
         """Test handling of unicode/international city names"""
         search_input = page_with_app.locator('input[name="search"]')
         submit_button = page_with_app.locator('button[type="submit"]')
@@ -107,7 +107,7 @@ class TestErrorHandling:
         ]
 
         for city in unicode_cities:
-            page_with_app.goto("http://127.0.0.1:5000/")
+            page_with_app.goto(f"{base_url}/")
 
             search_input.fill(city)
             submit_button.click()
@@ -119,7 +119,7 @@ class TestErrorHandling:
             body = page_with_app.locator("body")
             expect(body).to_be_visible()
 
-    def test_whitespace_only_input(self, page_with_app: Page):
+    def test_whitespace_only_input(self, page_with_app: Page, base_url):
         """Test handling of whitespace-only input"""
         search_input = page_with_app.locator('input[name="search"]')
         submit_button = page_with_app.locator('button[type="submit"]')
@@ -128,7 +128,7 @@ class TestErrorHandling:
         whitespace_inputs = ["   ", "\t\t", "\n\n"]
 
         for ws_input in whitespace_inputs:
-            page_with_app.goto("http://127.0.0.1:5000/")
+            page_with_app.goto(f"{base_url}/")
 
             search_input.fill(ws_input)
             submit_button.click()
@@ -137,10 +137,10 @@ class TestErrorHandling:
 
             # Should handle gracefully
             current_url = page_with_app.url
-            assert "/error" in current_url or current_url == "http://127.0.0.1:5000/", \
+            assert "/error" in current_url or current_url == f"{base_url}/", \
                 "Whitespace-only input should be handled"
 
-    def test_case_insensitive_search(self, page_with_app: Page):
+    def test_case_insensitive_search(self, page_with_app: Page, base_url):
         """Test that city search works regardless of case"""
         search_input = page_with_app.locator('input[name="search"]')
         submit_button = page_with_app.locator('button[type="submit"]')
@@ -154,7 +154,7 @@ class TestErrorHandling:
         ]
 
         for city_variant in case_variations:
-            page_with_app.goto("http://127.0.0.1:5000/")
+            page_with_app.goto(f"{base_url}/")
 
             search_input.fill(city_variant)
             submit_button.click()
@@ -165,10 +165,10 @@ class TestErrorHandling:
             # All should navigate to weather page (or at least not error)
             current_url = page_with_app.url
             # Should navigate away from home page
-            assert current_url != "http://127.0.0.1:5000/" or "/error" in current_url, \
+            assert current_url != f"{base_url}/" or "/error" in current_url, \
                 f"City variant '{city_variant}' should be searchable"
 
-    def test_city_without_state(self, page_with_app: Page):
+    def test_city_without_state(self, page_with_app: Page, base_url):
         """Test searching for city without specifying state"""
         search_input = page_with_app.locator('input[name="search"]')
         submit_button = page_with_app.locator('button[type="submit"]')
@@ -177,7 +177,7 @@ class TestErrorHandling:
         cities_no_state = ["London", "Paris", "Tokyo"]
 
         for city in cities_no_state:
-            page_with_app.goto("http://127.0.0.1:5000/")
+            page_with_app.goto(f"{base_url}/")
 
             search_input.fill(city)
             submit_button.click()
@@ -188,7 +188,7 @@ class TestErrorHandling:
             body = page_with_app.locator("body")
             expect(body).to_be_visible()
 
-    def test_rapid_sequential_searches(self, page_with_app: Page):
+    def test_rapid_sequential_searches(self, page_with_app: Page, base_url):
         """Test performing multiple rapid searches"""
         search_input = page_with_app.locator('input[name="search"]')
         submit_button = page_with_app.locator('button[type="submit"]')
@@ -197,7 +197,7 @@ class TestErrorHandling:
 
         # Perform rapid searches
         for city in cities:
-            page_with_app.goto("http://127.0.0.1:5000/")
+            page_with_app.goto(f"{base_url}/")
 
             search_input.fill(city)
             submit_button.click()
@@ -206,10 +206,10 @@ class TestErrorHandling:
             page_with_app.wait_for_timeout(500)
 
         # Application should still be functional
-        page_with_app.goto("http://127.0.0.1:5000/")
+        page_with_app.goto(f"{base_url}/")
         expect(page_with_app.locator('input[name="search"]')).to_be_visible()
 
-    def test_navigation_back_button(self, page_with_app: Page):
+    def test_navigation_back_button(self, page_with_app: Page, base_url):
         """Test browser back button functionality"""
         search_input = page_with_app.locator('input[name="search"]')
         submit_button = page_with_app.locator('button[type="submit"]')
@@ -225,8 +225,8 @@ class TestErrorHandling:
         page_with_app.go_back()
 
         # Should be back on home page
-        page_with_app.wait_for_url("http://127.0.0.1:5000/", timeout=5000)
-        expect(page_with_app).to_have_url("http://127.0.0.1:5000/")
+        page_with_app.wait_for_url(f"{base_url}/", timeout=5000)
+        expect(page_with_app).to_have_url(f"{base_url}/")
 
         # Home page should still be functional
         expect(search_input).to_be_visible()
@@ -68,13 +68,13 @@ class TestFiveDayForecast:
 
         # Check each of the 5 days
         for i in range(5):
-            icon = forecast_items.nth(i).locator("img.weather-icon")
+            icon = forecast_items.nth(i).locator(".weather-icon")
             expect(icon).to_be_visible()
 
-            # Verify icon source is from static assets
-            icon_src = icon.get_attribute('src')
-            assert '/static/assets/' in icon_src, \
-                f"Day {i+1} icon should be from /static/assets/, got: {icon_src}"
+            # Verify icon is drawn from the icon sprite
+            icon_class = icon.get_attribute('class')
+            assert 'icon icon-' in icon_class, \
+                f"Day {i+1} icon should use the icon sprite, got classes: {icon_class}"
 
     @pytest.mark.smoke
     def test_each_forecast_day_has_dual_temperature(self, weather_page: Page):
@@ -128,18 +128,18 @@ class TestFiveDayForecast:
         # Collect all weather icons
         icons = []
         for i in range(5):
-            icon = forecast_items.nth(i).locator("img.weather-icon")
-            icon_src = icon.get_attribute('src')
-            icons.append(icon_src)
+            icon = forecast_items.nth(i).locator(".weather-icon")
+            icon_class = icon.get_attribute('class')
+            icons.append(icon_class)
 
         # All icons should be valid
         assert all(icon for icon in icons), "All forecast days should have weather icons"
 
         # Icons should be from known weather types
-        known_weather_files = ["clear.png", "clouds.png", "rain.png", "snow.png", "drizzle.png", "thunderstorm.png"]
-        for icon_src in icons:
-            assert any(weather in icon_src for weather in known_weather_files), \
-                f"Icon should be from known weather types: {icon_src}"
+        known_weather_icons = ["icon-clear", "icon-clouds", "icon-rain", "icon-snow", "icon-drizzle", "icon-thunderstorm"]
+        for icon_class in icons:
+            assert any(weather in icon_class.split() for weather in known_weather_icons), \
+                f"Icon should be from known weather types: {icon_class}"
 
     def test_forecast_days_are_sequential(self, weather_page: Page):
         """Test that forecast days are in sequential order"""
@@ -181,13 +181,13 @@ class TestFiveDayForecast:
         divider = weather_page.locator(".divider")
         expect(divider).to_be_visible()
 
-    def test_forecast_loads_for_different_cities(self, page_with_app: Page):
+    def test_forecast_loads_for_different_cities(self, page_with_app: Page, base_url):
         """Test that 5-day forecast loads correctly for different cities"""
         cities = ["Miami, Florida", "Denver, Colorado", "Portland, Oregon"]
 
         for city in cities:
             # Navigate to home
-            page_with_app.goto("http://127.0.0.1:5000/")
+            page_with_app.goto(f"{base_url}/")
 
             # Search for city
             search_input = page_with_app.locator('input[name="search"]')
@@ -50,7 +50,7 @@ class TestHomePage:
         # Note: Background might be CSS-based, so we check for the image file
         expect(page_with_app.locator("body")).to_be_visible()
 
-    def test_empty_search_validation(self, page_with_app: Page):
+    def test_empty_search_validation(self, page_with_app: Page, base_url):
         """Test that empty search is prevented by HTML5 validation"""
         search_input = page_with_app.locator('input[name="search"]')
         submit_button = page_with_app.locator('button[type="submit"]')
@@ -59,10 +59,10 @@ class TestHomePage:
         submit_button.click()
 
         # Should stay on home page due to HTML5 validation
-        expect(page_with_app).to_have_url("http://127.0.0.1:5000/")
+        expect(page_with_app).to_have_url(f"{base_url}/")
 
     @pytest.mark.smoke
-    def test_valid_city_search_navigation(self, page_with_app: Page):
+    def test_valid_city_search_navigation(self, page_with_app: Page, base_url):
         """Test that entering a valid city navigates to weather page"""
         search_input = page_with_app.locator('input[name="search"]')
         submit_button = page_with_app.locator('button[type="submit"]')
@@ -74,7 +74,7 @@ class TestHomePage:
         # Should navigate to weather page for the city
         # URL should contain the city name (may be URL encoded)
         page_with_app.wait_for_url("**/Dallas**", timeout=10000)
-        expect(page_with_app).not_to_have_url("http://127.0.0.1:5000/")
+        expect(page_with_app).not_to_have_url(f"{base_url}/")
 
     def test_page_responsiveness_mobile(self, page: Page, flask_app, base_url):
         """Test home page on mobile viewport"""
@@ -0,0 +1,39 @@
+"""
+E2E tests for "Use my location"
+Tests resolving browser coordinates to the nearest known city without a geocoding lookup
+"""
+import pytest
+from playwright.sync_api import Page, BrowserContext, expect
+
+
+@pytest.mark.e2e
+class TestLocation:
+    """Test suite for the coordinate-based weather lookup"""
+
+    @pytest.mark.api
+    def test_coordinates_resolve_to_nearest_city(self, page: Page, flask_app, base_url):
+        """Test that coordinates near a known city render that city's forecast"""
+        page.goto(f"{base_url}/here?lat=47.61&lon=-122.33")
+
+        expect(page.locator(".city-header h1")).to_contain_text("Seattle")
+        expect(page.locator(".forecast-item")).to_have_count(5)
+
+    @pytest.mark.parametrize("query", ["lat=91&lon=0", "lat=0&lon=181", "lat=abc&lon=0", "lon=10"])
+    def test_invalid_coordinates_redirect_to_error(self, page: Page, flask_app, base_url, query):
+        """Test that missing or out-of-range coordinates show the error page"""
+        page.goto(f"{base_url}/here?{query}")
+
+        expect(page).to_have_url(f"{base_url}/error")
+
+    @pytest.mark.api
+    def test_use_my_location_button(self, context: BrowserContext, flask_app, base_url):
+        """Test that the home page button sends the browser's position to /here"""
+        context.grant_permissions(["geolocation"])
+        context.set_geolocation({"latitude": 51.5, "longitude": -0.12})
+        page = context.new_page()
+        page.goto(base_url)
+
+        page.locator("#locate").click()
+
+        page.wait_for_url("**/here?**", timeout=10000)
+        expect(page.locator(".city-header h1")).to_contain_text("London")
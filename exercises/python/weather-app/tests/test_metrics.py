@@ -0,0 +1,30 @@
+"""
+E2E tests for the metrics endpoint
+Tests the Prometheus text output after serving a city page
+"""
+import pytest
+from playwright.sync_api import Page
+
+
+@pytest.mark.e2e
+@pytest.mark.api
+class TestMetrics:
+    """Test suite for the /metrics endpoint"""
+
+    @pytest.mark.smoke
+    def test_metrics_is_prometheus_text(self, page: Page, flask_app, base_url):
+        """Test that /metrics answers in the Prometheus text format"""
+        response = page.request.get(f"{base_url}/metrics")
+        assert response.ok
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+
+    def test_metrics_count_city_page(self, page: Page, flask_app, base_url):
+        """Test that serving a city page shows up in cache, render and quota metrics"""
+        page.request.get(f"{base_url}/London")
+        page.request.get(f"{base_url}/London")
+
+        body = page.request.get(f"{base_url}/metrics").text()
+        assert 'weather_cache_requests_total{cache="page",result="hit",pid="' in body
+        assert 'weather_cache_requests_total{cache="forecast"' in body
+        assert 'weather_upstream_quota{window="minute"}' in body
+        assert 'weather_upstream_calls{window="day"}' in body
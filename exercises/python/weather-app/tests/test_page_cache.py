@@ -0,0 +1,47 @@
+"""
+E2E tests for cached city pages
+Tests ETag revalidation and compressed responses
+"""
+import pytest
+from playwright.sync_api import Page
+
+
+@pytest.mark.e2e
+@pytest.mark.api
+class TestPageCache:
+    """Test suite for conditional and compressed city page responses"""
+
+    @pytest.mark.smoke
+    def test_city_page_has_etag(self, page: Page, flask_app, base_url):
+        """Test that a city page carries a strong ETag and asks browsers to revalidate"""
+        response = page.request.get(f"{base_url}/London")
+        assert response.ok
+
+        assert response.headers["etag"].startswith('"')
+        assert response.headers["cache-control"] == "no-cache"
+
+    def test_matching_etag_returns_not_modified(self, page: Page, flask_app, base_url):
+        """Test that sending back the page's ETag yields 304 without a body"""
+        first = page.request.get(f"{base_url}/London", headers={"Accept-Encoding": "identity"})
+        etag = first.headers["etag"]
+
+        second = page.request.get(f"{base_url}/London",
+                                  headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+        assert second.status == 304
+        assert second.headers["etag"] == etag
+
+    def test_stale_etag_returns_page(self, page: Page, flask_app, base_url):
+        """Test that an ETag that doesn't match gets the full page"""
+        response = page.request.get(f"{base_url}/London", headers={"If-None-Match": '"outdated"'})
+        assert response.status == 200
+        assert "London" in response.text()
+
+    def test_gzip_variant(self, page: Page, flask_app, base_url):
+        """Test that clients accepting gzip get the compressed variant with its own ETag"""
+        plain = page.request.get(f"{base_url}/London", headers={"Accept-Encoding": "identity"})
+        compressed = page.request.get(f"{base_url}/London", headers={"Accept-Encoding": "gzip"})
+
+        assert compressed.headers.get("content-encoding") == "gzip"
+        assert compressed.headers["vary"] == "Accept-Encoding"
+        assert compressed.headers["etag"] != plain.headers["etag"]
+        assert compressed.text() == plain.text()
@@ -0,0 +1,47 @@
+"""
+E2E tests for the city typeahead
+Tests the /suggest JSON endpoint and its wiring into the home page search box
+"""
+import pytest
+from playwright.sync_api import Page, expect
+
+
+@pytest.mark.e2e
+class TestSuggest:
+    """Test suite for city suggestions"""
+
+    @pytest.mark.smoke
+    def test_suggest_returns_matching_cities(self, page_with_app: Page, base_url):
+        """Test that suggestions start with the typed prefix"""
+        response = page_with_app.request.get(f"{base_url}/suggest?q=sea")
+        assert response.ok
+
+        suggestions = response.json()
+        assert len(suggestions) > 0
+        assert all(city["name"].lower().startswith("sea") for city in suggestions)
+        assert "Seattle, Washington" in [city["label"] for city in suggestions]
+
+    def test_suggest_ranks_larger_cities_first(self, page_with_app: Page, base_url):
+        """Test that a shared name lists the more populous city first"""
+        suggestions = page_with_app.request.get(f"{base_url}/suggest?q=portland").json()
+        labels = [city["label"] for city in suggestions]
+        assert labels.index("Portland, Oregon") < labels.index("Portland, Maine")
+
+    def test_suggest_filters_by_region(self, page_with_app: Page, base_url):
+        """Test that text after a comma narrows results by state or country"""
+        suggestions = page_with_app.request.get(f"{base_url}/suggest?q=portland, ma").json()
+        assert [city["label"] for city in suggestions] == ["Portland, Maine"]
+
+    def test_suggest_empty_query(self, page_with_app: Page, base_url):
+        """Test that an empty query returns no suggestions"""
+        response = page_with_app.request.get(f"{base_url}/suggest?q=")
+        assert response.ok
+        assert response.json() == []
+
+    def test_search_box_shows_suggestions(self, page_with_app: Page):
+        """Test that typing in the search box fills the suggestion list"""
+        search_input = page_with_app.locator('input[name="search"]')
+        search_input.type("Sea")
+
+        options = page_with_app.locator("#city-suggestions option")
+        expect(options.first).to_have_attribute("value", "Seattle, Washington")
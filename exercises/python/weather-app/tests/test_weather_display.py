@@ -88,7 +88,7 @@ class TestWeatherDisplay:
     def test_min_max_temperature_displays(self, weather_page: Page):
         """Test that min/max temperature range displays with dual format"""
         # Find thermometer section
-        thermometer_section = weather_page.locator('.daily-section:has(img[src*="thermometer.png"])')
+        thermometer_section = weather_page.locator('.daily-section:has(.icon-thermometer)')
         expect(thermometer_section).to_be_visible()
 
         # Get temperature range text
@@ -119,17 +119,17 @@ class TestWeatherDisplay:
 
     def test_weather_icon_displays(self, weather_page: Page):
         """Test that weather icon is displayed for current conditions"""
-        weather_icon = weather_page.locator('.daily-section img.weather-icon').first
+        weather_icon = weather_page.locator('.daily-section .weather-icon').first
         expect(weather_icon).to_be_visible()
 
-        # Verify icon has a valid source
-        icon_src = weather_icon.get_attribute('src')
-        assert icon_src and '/static/assets/' in icon_src, \
-            f"Weather icon should have valid src from /static/assets/, got: {icon_src}"
+        # Verify icon is drawn from the icon sprite
+        icon_class = weather_icon.get_attribute('class')
+        assert icon_class and 'icon icon-' in icon_class, \
+            f"Weather icon should use the icon sprite, got classes: {icon_class}"
 
     def test_wind_speed_displays(self, weather_page: Page):
         """Test that wind speed is displayed"""
-        wind_section = weather_page.locator('.daily-section:has(img[src*="wind.png"])')
+        wind_section = weather_page.locator('.daily-section:has(.icon-wind)')
         expect(wind_section).to_be_visible()
 
         wind_text = wind_section.locator('.forecast-text')
@@ -146,22 +146,22 @@ class TestWeatherDisplay:
         expect(change_button).to_be_visible()
         expect(change_button).to_contain_text("CHANGE CITY")
 
-    def test_change_city_button_navigation(self, weather_page: Page):
+    def test_change_city_button_navigation(self, weather_page: Page, base_url):
         """Test that 'Change City' button navigates back to home"""
         change_button = weather_page.locator('.change-button a')
         change_button.click()
 
         # Should navigate back to home page
-        weather_page.wait_for_url("http://127.0.0.1:5000/", timeout=5000)
-        expect(weather_page).to_have_url("http://127.0.0.1:5000/")
+        weather_page.wait_for_url(f"{base_url}/", timeout=5000)
+        expect(weather_page).to_have_url(f"{base_url}/")
 
-    def test_multiple_cities_sequential(self, page_with_app: Page):
+    def test_multiple_cities_sequential(self, page_with_app: Page, base_url):
         """Test searching multiple cities in sequence"""
         cities = ["New York, New York", "Los Angeles, California", "Chicago, Illinois"]
 
         for city in cities:
             # Navigate to home if not already there
-            page_with_app.goto("http://127.0.0.1:5000/")
+            page_with_app.goto(f"{base_url}/")
 
             # Search for city
             search_input = page_with_app.locator('input[name="search"]')
@@ -0,0 +1,96 @@
+"""
+Generate responsive variants of the full-page background photos.
+
+The backgrounds in static/assets are large JPEGs (up to 1.7 MB). For each one this writes AVIF and
+WebP copies resized to every breakpoint up to the photo's own width, with content-hashed names so
+they can be cached forever:
+
+    static/assets/backgrounds/<name>-<width>-<hash>.avif|webp
+    static/assets/backgrounds.json   manifest read by assets.py: the original JPEG (kept as the
+                                     fallback for browsers without AVIF/WebP), its size and a
+                                     srcset per image type
+
+Run from the weather-app directory after changing a background:
+
+    python tools/build_backgrounds.py
+"""
+import glob
+import hashlib
+import io
+import json
+import os
+
+from PIL import Image, features
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASSETS_DIR = os.path.join(APP_DIR, "static", "assets")
+OUTPUT_DIR = os.path.join(ASSETS_DIR, "backgrounds")
+MANIFEST = os.path.join(ASSETS_DIR, "backgrounds.json")
+
+BACKGROUNDS = ["weather-home-background.jpg", "404_error_background.jpg", "phone_error_background.jpg"]
+# Widths in CSS pixels x device pixel ratio that phones, tablets, laptops and large screens ask for
+BREAKPOINTS = [480, 800, 1200, 1600, 2400]
+# Best format first; browsers take the first <source> type they support
+FORMATS = [
+    ("image/avif", "avif", {"quality": 50, "speed": 6}),
+    ("image/webp", "webp", {"quality": 75, "method": 6}),
+]
+
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def encode(image, extension, options):
+    buffer = io.BytesIO()
+    image.save(buffer, format=extension.upper(), **options)
+    return buffer.getvalue()
+
+
+def build_variants(filename, formats):
+    """Write every resized variant of one background; returns its manifest entry"""
+    original = Image.open(os.path.join(ASSETS_DIR, filename)).convert("RGB")
+    stem = os.path.splitext(filename)[0]
+    widths = [width for width in BREAKPOINTS if width < original.width] + [original.width]
+    entry = {"src": f"assets/{filename}", "width": original.width, "height": original.height, "sources": {}}
+    written = []
+    for mimetype, extension, options in formats:
+        srcset = []
+        for width in widths:
+            height = round(original.height * width / original.width)
+            image = original if width == original.width else original.resize((width, height), Image.LANCZOS)
+            data = encode(image, extension, options)
+            name = f"{stem}-{width}-{fingerprint(data)}.{extension}"
+            with open(os.path.join(OUTPUT_DIR, name), "wb") as f:
+                f.write(data)
+            srcset.append([f"assets/backgrounds/{name}", width])
+            written.append((name, len(data)))
+        entry["sources"][mimetype] = srcset
+    return entry, written
+
+
+def main():
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    formats = [fmt for fmt in FORMATS if features.check(fmt[1])]
+    skipped = [fmt[1] for fmt in FORMATS if fmt not in formats]
+    if skipped:
+        print(f"Pillow was built without {', '.join(skipped)} support; skipping those variants")
+
+    manifest, keep = {}, set()
+    for filename in BACKGROUNDS:
+        manifest[filename], written = build_variants(filename, formats)
+        keep.update(name for name, _ in written)
+        smallest = min(size for _, size in written)
+        print(f"{filename}: {os.path.getsize(os.path.join(ASSETS_DIR, filename))} bytes -> "
+              f"{len(written)} variants, smallest {smallest} bytes")
+
+    for path in glob.glob(os.path.join(OUTPUT_DIR, "*")):
+        if os.path.basename(path) not in keep:
+            os.remove(path)
+    with open(MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
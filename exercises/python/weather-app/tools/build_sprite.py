@@ -0,0 +1,118 @@
+"""
+Pack the page icons into a single sprite image.
+
+Reads the icon PNGs from static/assets and writes, with content-hashed names so they can be cached
+forever:
+
+    static/assets/icons-<hash>.png   every icon stacked in one image
+    static/css/icons-<hash>.css      an .icon-<name> class per icon
+    static/assets/icons.json         manifest read by icons.py: file names, icons and the lookup
+                                     from OpenWeather condition names to icons
+
+Each class sizes and positions the sprite in percentages of the element, so an icon fills whatever
+width and height the page's CSS gives it. Run from the weather-app directory after changing an icon:
+
+    python tools/build_sprite.py
+"""
+import glob
+import hashlib
+import io
+import json
+import os
+
+from PIL import Image
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASSETS_DIR = os.path.join(APP_DIR, "static", "assets")
+CSS_DIR = os.path.join(APP_DIR, "static", "css")
+MANIFEST = os.path.join(ASSETS_DIR, "icons.json")
+
+# Icons shown on the city, compare and error pages
+ICONS = ["clear", "clouds", "drizzle", "fog", "haze", "mist", "rain", "smoke", "snow", "thunderstorm", "tornado",
+         "thermometer", "wind", "chevron-left"]
+# OpenWeather 'main' conditions without an icon of their own
+CONDITION_ALIASES = {"dust": "haze", "sand": "haze", "ash": "smoke", "squall": "wind"}
+# Transparent rows between icons so scaling never bleeds a neighbour into view
+GAP = 2
+
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def build_sprite(images):
+    """Stack the images vertically; returns the sprite and each icon's (y, width, height)"""
+    width = max(image.width for image in images.values())
+    height = sum(image.height for image in images.values()) + GAP * (len(images) - 1)
+    sprite = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    layout, y = {}, 0
+    for name, image in images.items():
+        sprite.paste(image, (0, y))
+        layout[name] = (y, image.width, image.height)
+        y += image.height + GAP
+    return sprite, layout
+
+
+def icon_rules(sprite_size, layout, sprite_url):
+    sprite_width, sprite_height = sprite_size
+    rules = [
+        "/* Generated by tools/build_sprite.py, do not edit */",
+        ".icon {",
+        "\tdisplay: inline-block;",
+        f"\tbackground-image: url('{sprite_url}');",
+        "\tbackground-repeat: no-repeat;",
+        "\tbackground-origin: content-box;",
+        "\tbackground-clip: content-box;",
+        "}",
+    ]
+    for name, (y, width, height) in layout.items():
+        # Scale the sprite so this icon spans the element, then slide its rows into view
+        size_x = sprite_width / width * 100
+        size_y = sprite_height / height * 100
+        position_y = y / (sprite_height - height) * 100
+        rules += ["", f".icon-{name} {{",
+                  f"\tbackground-size: {size_x:.4f}% {size_y:.4f}%;",
+                  f"\tbackground-position: 0 {position_y:.4f}%;",
+                  "}"]
+    return "\n".join(rules) + "\n"
+
+
+def replace_generated(directory, pattern, keep):
+    for path in glob.glob(os.path.join(directory, pattern)):
+        if os.path.basename(path) != keep:
+            os.remove(path)
+
+
+def main():
+    images = {name: Image.open(os.path.join(ASSETS_DIR, name + ".png")).convert("RGBA") for name in ICONS}
+    sprite, layout = build_sprite(images)
+
+    buffer = io.BytesIO()
+    sprite.save(buffer, format="PNG", optimize=True)
+    sprite_data = buffer.getvalue()
+    sprite_name = f"icons-{fingerprint(sprite_data)}.png"
+    with open(os.path.join(ASSETS_DIR, sprite_name), "wb") as f:
+        f.write(sprite_data)
+
+    css_data = icon_rules(sprite.size, layout, f"../assets/{sprite_name}").encode()
+    css_name = f"icons-{fingerprint(css_data)}.css"
+    with open(os.path.join(CSS_DIR, css_name), "wb") as f:
+        f.write(css_data)
+
+    replace_generated(ASSETS_DIR, "icons-*.png", sprite_name)
+    replace_generated(CSS_DIR, "icons-*.css", css_name)
+
+    conditions = {name: name for name in ICONS}
+    conditions.update(CONDITION_ALIASES)
+    with open(MANIFEST, "w") as f:
+        json.dump({"sprite": f"assets/{sprite_name}", "stylesheet": f"css/{css_name}", "icons": ICONS,
+                   "conditions": conditions}, f, indent=2)
+        f.write("\n")
+
+    separate = sum(os.path.getsize(os.path.join(ASSETS_DIR, name + ".png")) for name in ICONS)
+    print(f"Packed {len(ICONS)} icons ({separate} bytes in {len(ICONS)} files) into {sprite_name} "
+          f"({len(sprite_data)} bytes) and {css_name}")
+
+
+if __name__ == "__main__":
+    main()
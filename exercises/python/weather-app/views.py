@@ -0,0 +1,116 @@
+"""
+Request handling shared by main.py (Flask) and main_asgi.py (Quart).
+
+The two apps only differ in how they wait: for OpenWeather, for templates to render and for a
+posted form. Everything else they do with a request lives here, as functions of the request's
+values, so both serve the same pages, headers and errors.
+"""
+import logging
+import string
+
+from assets import static_cache_control
+from cities import get_city_index, get_spatial_index
+from logging_setup import request_id
+from page_cache import PageCache
+from weather import forecast_context, page_key, parse_compare_cities, MAX_COMPARE_CITIES
+
+logger = logging.getLogger(__name__)
+
+# Suggestions only change as popularity shifts, so the browser may reuse them briefly while the user edits
+SUGGEST_CACHE_CONTROL = "public, max-age=60"
+METRICS_MIMETYPE = "text/plain; version=0.0.4"
+COMPARE_USAGE = {"error": "Pass cities=A;B;C or repeated city= parameters"}
+UNAVAILABLE_MESSAGE = "The weather service is unavailable right now. Please try again in a few minutes."
+
+page_cache = PageCache()
+
+
+# Hand the request's correlation id back to the caller. Fingerprinted static files (icon sprite,
+# background variants) never change, so browsers can skip revalidating them.
+def finish_response(response, endpoint, path):
+    response.headers["X-Request-ID"] = request_id.get()
+    if endpoint == "static" and response.status_code == 200:
+        cache_control = static_cache_control(path)
+        if cache_control:
+            response.headers["Cache-Control"] = cache_control
+    return response
+
+
+# The city name entered into the home page search form
+def searched_city(form):
+    city = form.get("search")
+    logger.info("User searched for city: %s", city)
+    return city
+
+
+# Known cities matching ?q= for the home page search box, as JSON-ready dicts
+def suggestions(args):
+    limit = min(args.get("limit", 8, type=int), 20)
+    return [{"label": city.label, "name": city.name, "region": city.region, "country": city.country}
+            for city in get_city_index().suggest(args.get("q", ""), limit=limit)]
+
+
+# Format the city name from the URL to display on the page
+def city_name_from(city):
+    city_name = string.capwords(city)
+    logger.info("Fetching weather data for city: %s", city_name)
+    return city_name
+
+
+# The known city nearest to the browser's reported ?lat=&lon=, or None if they are missing or out of range
+def nearest_city(args):
+    lat = args.get("lat", type=float)
+    lon = args.get("lon", type=float)
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        logger.info("Invalid coordinates for location lookup: lat=%s, lon=%s", args.get("lat"), args.get("lon"))
+        return None
+
+    nearest = get_spatial_index().nearest(lat, lon)
+    if nearest is None:
+        return None
+    city, distance_km = nearest
+    logger.info("Nearest known city to (%s, %s): %s (%.1f km)", lat, lon, city.label, distance_km)
+    # Callers use the city's own coordinates, not the visitor's, so everyone near it shares its cached forecast and page
+    return city
+
+
+def log_unusable_forecast(city_name, error):
+    logger.error("Unusable forecast for %s: %s", city_name, error)
+
+
+# Reuse the page rendered for the same city, day and forecast. Returns (page, key, context): the
+# cached page, or None with the cache key and the variables to render city.html from.
+def cached_page(city_name, forecast, stale_since):
+    key = page_key(city_name, forecast, stale_since)
+    page = page_cache.get(key)
+    if page is not None:
+        return page, key, None
+    return None, key, forecast_context(city_name, forecast, stale_since=stale_since)
+
+
+# (status, body, headers) for a city page; the browser revalidates it with its ETag
+def page_response(city_name, page, request_headers):
+    get_city_index().record_query(city_name)
+    return page.respond(request_headers.get("Accept-Encoding"), request_headers.get("If-None-Match"))
+
+
+# Read the cities to compare from ?cities=A;B;C and/or repeated ?city= parameters
+def requested_cities(args):
+    return parse_compare_cities(args.getlist("city"), args.get("cities", ""))
+
+
+# Variables for compare.html from weather_for_cities' (city, context, error) results
+def compare_context(city_names, results):
+    logger.info("Compared cities: %s", city_names)
+    dates = next((context["five_day_dates_list"] for _, context, _ in results if context), [])
+    return {"results": results, "city_names": city_names, "dates": dates, "max_cities": MAX_COMPARE_CITIES}
+
+
+# JSON version of the comparison for API clients
+def compare_json(results):
+    return [{"city": city_name, "weather": context, "error": error} for city_name, context, error in results]
+
+
+# OpenWeather is down or too slow and nothing usable is cached
+def log_unavailable(error):
+    logger.warning("Weather service unavailable: %s", error)
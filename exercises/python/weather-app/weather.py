@@ -0,0 +1,474 @@
+import asyncio
+import contextvars
+import datetime
+import json
+import logging
+import os
+import string
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Tuple
+
+import httpx
+import requests
+from dotenv import load_dotenv
+from cache import CACHE_BACKEND, make_cache
+from metrics import metrics
+from prefetch import PrefetchScheduler
+from resilience import CircuitBreaker, CircuitOpenError, Deadline, UpstreamUnavailable
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+GEOCODING_API_ENDPOINT = os.getenv("GEOCODING_API_ENDPOINT", "http://api.openweathermap.org/geo/1.0/direct")
+ONECALL_API_ENDPOINT = os.getenv("ONECALL_API_ENDPOINT", "https://api.openweathermap.org/data/3.0/onecall")
+api_key = os.getenv("OWM_API_KEY")
+# Units the forecast is fetched in; Fahrenheit is derived locally
+UNITS = "metric"
+
+# City coordinates don't move, so geocoding results can live much longer than forecasts
+GEOCODE_TTL_SECONDS = int(os.getenv("GEOCODE_TTL_SECONDS", str(7 * 24 * 3600)))
+FORECAST_TTL_SECONDS = int(os.getenv("FORECAST_TTL_SECONDS", "600"))
+# How long past expiry a cached result may still be served, marked stale, while OpenWeather is down
+GEOCODE_STALE_SECONDS = int(os.getenv("GEOCODE_STALE_SECONDS", str(30 * 24 * 3600)))
+FORECAST_STALE_SECONDS = int(os.getenv("FORECAST_STALE_SECONDS", str(6 * 3600)))
+
+# Total time one page may spend waiting on OpenWeather, and when to stop calling a failing endpoint
+REQUEST_LATENCY_BUDGET_SECONDS = float(os.getenv("REQUEST_LATENCY_BUDGET_SECONDS", "4"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+# The OpenWeather plan's call allowance, reported next to actual usage on /metrics
+OWM_QUOTA_PER_MINUTE = int(os.getenv("OWM_QUOTA_PER_MINUTE", "60"))
+OWM_QUOTA_PER_DAY = int(os.getenv("OWM_QUOTA_PER_DAY", "1000"))
+
+# Background refresh of the most requested cities' forecasts shortly before they expire
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+PREFETCH_TOP_N = int(os.getenv("PREFETCH_TOP_N", "20"))
+PREFETCH_CALLS_PER_MINUTE = int(os.getenv("PREFETCH_CALLS_PER_MINUTE", "30"))
+PREFETCH_LEAD_SECONDS = int(os.getenv("PREFETCH_LEAD_SECONDS", "60"))
+PREFETCH_INTERVAL_SECONDS = float(os.getenv("PREFETCH_INTERVAL_SECONDS", "5"))
+
+# Most cities a single comparison may ask for
+MAX_COMPARE_CITIES = 8
+# Upper bound on cities fetched at once for a comparison; each one costs two upstream calls
+COMPARE_MAX_WORKERS = int(os.getenv("COMPARE_MAX_WORKERS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=COMPARE_MAX_WORKERS, thread_name_prefix="weather-fetch")
+
+geocode_cache = make_cache("geocode", max_entries=int(os.getenv("GEOCODE_CACHE_ENTRIES", "20000")),
+                           stale_seconds=GEOCODE_STALE_SECONDS)
+forecast_cache = make_cache("forecast", max_entries=int(os.getenv("FORECAST_CACHE_ENTRIES", "5000")),
+                            stale_seconds=FORECAST_STALE_SECONDS)
+
+geocoding_breaker = CircuitBreaker("geocoding", BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+onecall_breaker = CircuitBreaker("onecall", BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+
+# Upstream calls are counted in the cache backend's budgets so usage covers every worker on the host
+UPSTREAM_WINDOWS = {"minute": (60, OWM_QUOTA_PER_MINUTE), "day": (24 * 3600, OWM_QUOTA_PER_DAY)}
+for _window, (_seconds, _quota) in UPSTREAM_WINDOWS.items():
+    metrics.gauge("weather_upstream_calls",
+                  lambda window=_window, seconds=_seconds: forecast_cache.spent("upstream-" + window, seconds),
+                  window=_window)
+    metrics.gauge("weather_upstream_quota", lambda quota=_quota: quota, window=_window)
+for _breaker in (geocoding_breaker, onecall_breaker):
+    metrics.gauge("weather_circuit_open", lambda breaker=_breaker: int(breaker.state != breaker.CLOSED),
+                  endpoint=_breaker.name)
+
+
+class WeatherDataError(Exception):
+    """Raised when OpenWeather returns a response we can't build a forecast from"""
+
+
+class Forecast(NamedTuple):
+    """The part of a One Call response the app actually shows, in °C and m/s"""
+    current_temp: int
+    current_weather: str
+    wind_speed: float
+    min_temp: int
+    max_temp: int
+    daily_temps: Tuple[int, ...]
+    daily_weather: Tuple[str, ...]
+
+    @classmethod
+    def from_onecall(cls, onecall_data):
+        """Reduce a parsed One Call document to a Forecast, dropping everything else"""
+        # Verify required fields exist in API 3.0 response
+        if 'current' not in onecall_data:
+            raise WeatherDataError("'current' field missing from One Call API 3.0 response")
+
+        if 'daily' not in onecall_data or len(onecall_data['daily']) < 5:
+            raise WeatherDataError(f"Insufficient forecast data from One Call API 3.0 "
+                                   f"(need 5 days, got {len(onecall_data.get('daily', []))})")
+
+        try:
+            current = onecall_data['current']
+            five_days = onecall_data['daily'][0:5]
+            return cls(current_temp=round(current['temp']),
+                       current_weather=current['weather'][0]['main'],
+                       wind_speed=current['wind_speed'],
+                       min_temp=round(five_days[0]['temp']['min']),
+                       max_temp=round(five_days[0]['temp']['max']),
+                       daily_temps=tuple(round(day['temp']['day']) for day in five_days),
+                       daily_weather=tuple(day['weather'][0]['main'] for day in five_days))
+        except (KeyError, IndexError, TypeError) as e:
+            raise WeatherDataError(f"Malformed One Call API 3.0 response: {e!r}") from e
+
+    @classmethod
+    def from_cache(cls, value):
+        """Rebuild a Forecast from the plain list the shared cache stores it as"""
+        if isinstance(value, cls):
+            return value
+        *scalars, daily_temps, daily_weather = value
+        return cls(*scalars, tuple(daily_temps), tuple(daily_weather))
+
+
+# Helper function to convert Celsius to Fahrenheit
+def celsius_to_fahrenheit(celsius):
+    """Convert Celsius temperature to Fahrenheit"""
+    return round((celsius * 9/5) + 32)
+
+
+# Query strings for the two upstream endpoints, shared by the sync and async clients
+def geocoding_params(city_name):
+    return {
+        "q": city_name,
+        "appid": api_key,
+        "limit": 3,
+    }
+
+
+def onecall_params(lat, lon):
+    return {
+        "lat": lat,
+        "lon": lon,
+        "appid": api_key,
+        "units": UNITS,
+        # Only 'current' and 'daily' are shown, so don't pay for the rest on the wire or in the parser
+        "exclude": "minutely,hourly,alerts",
+    }
+
+
+# Pick the coordinates out of a geocoding response, or None if the API didn't find the city
+def coordinates_from(location_data, city_name):
+    logger.debug("Geocoding API raw response: %s", location_data)
+
+    # Prevent IndexError if user entered a city name with no coordinates
+    if not location_data or not isinstance(location_data, list) or len(location_data) == 0:
+        logger.info("No coordinates found for city: %s", city_name)
+        return None
+
+    lat = location_data[0]['lat']
+    lon = location_data[0]['lon']
+    logger.debug("Geocoded %s to %d results, using lat=%s lon=%s", city_name, len(location_data), lat, lon)
+    return lat, lon
+
+
+def geocode_key(city_name):
+    return "geocode:" + city_name.casefold()
+
+
+# Forecasts are shared by everything within ~1 km; /here looks them up by its nearest city's coordinates
+def forecast_key(lat, lon):
+    return f"onecall:{lat:.2f},{lon:.2f}"
+
+
+def new_deadline():
+    return Deadline(REQUEST_LATENCY_BUDGET_SECONDS)
+
+
+def _timeout_within(breaker, deadline):
+    """Seconds the next call to `breaker`'s endpoint may take, or UpstreamUnavailable if it shouldn't be made.
+
+    Once this returns, the caller must record the call's outcome on the breaker, whatever happens.
+    """
+    # The budget first: allow() may hand out the half-open trial call, which must then actually be made
+    timeout = deadline.remaining()
+    if timeout <= 0:
+        raise UpstreamUnavailable(f"latency budget spent before calling {breaker.name}")
+    if not breaker.allow():
+        raise CircuitOpenError(f"{breaker.name} circuit is open")
+    return timeout
+
+
+# Server errors and rate limiting mean OpenWeather is in trouble; other 4xx are our own fault
+def _upstream_failed(status_code):
+    return status_code >= 500 or status_code == 429
+
+
+def _record_upstream_call(endpoint, started, outcome):
+    metrics.observe("weather_upstream_request_seconds", time.perf_counter() - started, endpoint=endpoint)
+    metrics.inc("weather_upstream_requests_total", endpoint=endpoint, outcome=outcome)
+    for window, (seconds, _) in UPSTREAM_WINDOWS.items():
+        forecast_cache.spend("upstream-" + window, sys.maxsize, window_seconds=seconds)
+
+
+# GET an upstream endpoint through its circuit breaker, giving up once the request's latency budget is spent
+def upstream_get(breaker, url, params, deadline):
+    timeout = _timeout_within(breaker, deadline)
+    started = time.perf_counter()
+    try:
+        response = requests.get(url, params=params, timeout=timeout)
+    except requests.RequestException as e:
+        _record_upstream_call(breaker.name, started, "error")
+        breaker.record_failure()
+        raise UpstreamUnavailable(f"{breaker.name} request failed: {e}") from e
+    except BaseException:
+        breaker.record_failure()
+        raise
+    return _checked(breaker, response, started)
+
+
+async def async_upstream_get(client, breaker, url, params, deadline):
+    timeout = _timeout_within(breaker, deadline)
+    started = time.perf_counter()
+    try:
+        response = await client.get(url, params=params, timeout=timeout)
+    except httpx.HTTPError as e:
+        breaker.record_failure()
+        await off_loop(_record_upstream_call, breaker.name, started, "error")
+        raise UpstreamUnavailable(f"{breaker.name} request failed: {e!r}") from e
+    except BaseException:
+        # e.g. the task was cancelled: count it, so a half-open circuit doesn't wait for an outcome forever
+        breaker.record_failure()
+        raise
+    return await off_loop(_checked, breaker, response, started)
+
+
+def _checked(breaker, response, started):
+    failed = _upstream_failed(response.status_code)
+    # The breaker first, so it hears the outcome even if recording the metrics fails
+    if failed:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    _record_upstream_call(breaker.name, started, str(response.status_code))
+    if failed:
+        raise UpstreamUnavailable(f"{breaker.name} returned HTTP {response.status_code}")
+    return response
+
+
+# The shared SQLite cache blocks (up to its 5 s lock timeout under write contention), so the async app calls it
+# from a worker thread instead of stalling its event loop; the in-memory cache is fast enough to call directly
+async def off_loop(function, *args):
+    if CACHE_BACKEND == "memory":
+        return function(*args)
+    return await asyncio.to_thread(function, *args)
+
+
+# Look `key` up in `cache` and count the hit or miss; returns the entry, which may be stale
+def cache_lookup(cache, key):
+    entry = cache.get_entry(key)
+    fresh = entry is not None and entry.is_fresh()
+    metrics.inc("weather_cache_requests_total", cache=cache.name, result="hit" if fresh else "miss")
+    return entry, fresh
+
+
+# Get latitude and longitude for a city name, or None if the geocoding API doesn't know it.
+# While the API is unavailable, coordinates cached earlier are used even past their TTL.
+def geocode(city_name, deadline=None):
+    key = geocode_key(city_name)
+    entry, fresh = cache_lookup(geocode_cache, key)
+    if fresh:
+        return tuple(entry.value)
+
+    try:
+        location_response = upstream_get(geocoding_breaker, GEOCODING_API_ENDPOINT, geocoding_params(city_name),
+                                         deadline or new_deadline())
+    except UpstreamUnavailable as e:
+        if entry is None:
+            raise
+        logger.warning("Using expired coordinates for %s: %s", city_name, e)
+        metrics.inc("weather_cache_requests_total", cache=geocode_cache.name, result="stale")
+        return tuple(entry.value)
+    logger.debug("Geocoding API status code: %s", location_response.status_code)
+    return store_coordinates(key, location_response.json(), city_name)
+
+
+def store_coordinates(key, location_data, city_name):
+    coordinates = coordinates_from(location_data, city_name)
+    if coordinates is not None:
+        geocode_cache.set(key, coordinates, GEOCODE_TTL_SECONDS)
+    return coordinates
+
+
+# Parse a One Call response body straight from bytes and keep only the Forecast
+def parse_onecall(content):
+    return Forecast.from_onecall(json.loads(content))
+
+
+# Get the forecast for coordinates from One Call API 3.0, served from cache while fresh.
+# Returns (forecast, stale_since): stale_since is None for a current forecast, or the time the
+# forecast was fetched when OpenWeather is unavailable and the last known one is served instead.
+def fetch_onecall(lat, lon, deadline=None):
+    key = forecast_key(lat, lon)
+    prefetcher.record(key, lat, lon)
+    entry, fresh = cache_lookup(forecast_cache, key)
+    if fresh:
+        return Forecast.from_cache(entry.value), None
+
+    try:
+        return refresh_onecall(lat, lon, deadline), None
+    except UpstreamUnavailable as e:
+        return stale_forecast(key, entry, e)
+
+
+def stale_forecast(key, entry, error):
+    if entry is None:
+        raise error
+    logger.warning("Serving stale forecast for %s: %s", key, error)
+    metrics.inc("weather_cache_requests_total", cache=forecast_cache.name, result="stale")
+    return Forecast.from_cache(entry.value), entry.stored_at
+
+
+# Always call the One Call API and store the result; used on cache misses and by the prefetcher
+def refresh_onecall(lat, lon, deadline=None):
+    onecall_response = upstream_get(onecall_breaker, ONECALL_API_ENDPOINT, onecall_params(lat, lon),
+                                    deadline or new_deadline())
+    onecall_response.raise_for_status()
+    forecast = parse_onecall(onecall_response.content)
+    forecast_cache.set(forecast_key(lat, lon), forecast, FORECAST_TTL_SECONDS)
+    return forecast
+
+
+prefetcher = PrefetchScheduler(forecast_cache, refresh_onecall, top_n=PREFETCH_TOP_N,
+                               calls_per_minute=PREFETCH_CALLS_PER_MINUTE, lead_seconds=PREFETCH_LEAD_SECONDS,
+                               interval_seconds=PREFETCH_INTERVAL_SECONDS)
+
+
+# Start the prefetcher in the serving process; called on the first request so it survives gunicorn's fork
+def start_prefetcher():
+    if PREFETCH_ENABLED:
+        prefetcher.start()
+
+
+# Non-blocking versions of the two upstream calls for the ASGI app; `client` is a shared httpx.AsyncClient
+async def async_geocode(client, city_name, deadline=None):
+    key = geocode_key(city_name)
+    entry, fresh = await off_loop(cache_lookup, geocode_cache, key)
+    if fresh:
+        return tuple(entry.value)
+
+    try:
+        location_response = await async_upstream_get(client, geocoding_breaker, GEOCODING_API_ENDPOINT,
+                                                     geocoding_params(city_name), deadline or new_deadline())
+    except UpstreamUnavailable as e:
+        if entry is None:
+            raise
+        logger.warning("Using expired coordinates for %s: %s", city_name, e)
+        metrics.inc("weather_cache_requests_total", cache=geocode_cache.name, result="stale")
+        return tuple(entry.value)
+    logger.debug("Geocoding API status code: %s", location_response.status_code)
+    return await off_loop(store_coordinates, key, location_response.json(), city_name)
+
+
+async def async_fetch_onecall(client, lat, lon, deadline=None):
+    key = forecast_key(lat, lon)
+    prefetcher.record(key, lat, lon)
+    entry, fresh = await off_loop(cache_lookup, forecast_cache, key)
+    if fresh:
+        return Forecast.from_cache(entry.value), None
+
+    try:
+        onecall_response = await async_upstream_get(client, onecall_breaker, ONECALL_API_ENDPOINT,
+                                                    onecall_params(lat, lon), deadline or new_deadline())
+    except UpstreamUnavailable as e:
+        return stale_forecast(key, entry, e)
+    onecall_response.raise_for_status()
+    forecast = parse_onecall(onecall_response.content)
+    await off_loop(forecast_cache.set, key, forecast, FORECAST_TTL_SECONDS)
+    return forecast, None
+
+
+# Turn a Forecast into the variables city.html renders
+def forecast_context(city_name, forecast, today=None, stale_since=None):
+    today = today or datetime.datetime.now()
+    current_date = today.strftime("%A, %B %d")
+
+    current_temp_f = celsius_to_fahrenheit(forecast.current_temp)
+    min_temp_f = celsius_to_fahrenheit(forecast.min_temp)
+    max_temp_f = celsius_to_fahrenheit(forecast.max_temp)
+    logger.debug("Forecast for %s on %s: %s", city_name, current_date, forecast)
+
+    # Get next four weekdays to show user alongside weather data
+    five_day_unformatted = [today, today + datetime.timedelta(days=1), today + datetime.timedelta(days=2),
+                            today + datetime.timedelta(days=3), today + datetime.timedelta(days=4)]
+    five_day_dates_list = [date.strftime("%a") for date in five_day_unformatted]
+
+    return dict(city_name=city_name, current_date=current_date, current_temp=forecast.current_temp,
+                current_temp_f=current_temp_f, current_weather=forecast.current_weather,
+                min_temp=forecast.min_temp, min_temp_f=min_temp_f, max_temp=forecast.max_temp,
+                max_temp_f=max_temp_f, wind_speed=forecast.wind_speed,
+                five_day_temp_list=list(forecast.daily_temps),
+                five_day_temp_list_f=[celsius_to_fahrenheit(temp) for temp in forecast.daily_temps],
+                five_day_weather_list=list(forecast.daily_weather), five_day_dates_list=five_day_dates_list,
+                stale=stale_since is not None,
+                updated_at=None if stale_since is None
+                else datetime.datetime.fromtimestamp(stale_since).strftime("%a %H:%M"))
+
+
+# Everything a rendered city page depends on, so a cached page is reused only while it would render identically
+def page_key(city_name, forecast, stale_since=None, today=None):
+    today = today or datetime.datetime.now()
+    return city_name, UNITS, today.date(), forecast, stale_since
+
+
+# Normalise the cities to compare from repeated ?city= values and a ;-separated ?cities= value
+def parse_compare_cities(city_args, cities_arg):
+    city_names = []
+    for name in list(city_args) + cities_arg.split(";"):
+        city_name = string.capwords(name.strip())
+        if city_name and city_name not in city_names:
+            city_names.append(city_name)
+    return city_names[:MAX_COMPARE_CITIES]
+
+
+# Geocode one city and fetch its forecast; returns (context, error message)
+def weather_for_city(city_name, today=None, deadline=None):
+    try:
+        coordinates = geocode(city_name, deadline)
+        if coordinates is None:
+            return None, "City not found"
+        forecast, stale_since = fetch_onecall(*coordinates, deadline)
+        return forecast_context(city_name, forecast, today, stale_since), None
+    except UpstreamUnavailable as e:
+        logger.warning("Weather service unavailable for %s: %s", city_name, e)
+        return None, "Weather service unavailable"
+    except (requests.RequestException, WeatherDataError, KeyError, ValueError) as e:
+        logger.error("Error fetching weather for %s: %s", city_name, e)
+        return None, "Weather data unavailable"
+
+
+# Fetch several cities at once so the total wait is roughly that of the slowest city, not the sum.
+# All cities share one latency budget since they are fetched side by side.
+def weather_for_cities(city_names):
+    today = datetime.datetime.now()
+    deadline = new_deadline()
+    # Run each fetch in a copy of this context so its log lines keep the request's correlation id
+    futures = [_executor.submit(contextvars.copy_context().run, weather_for_city, city_name, today, deadline)
+               for city_name in city_names]
+    return [(city_name, *future.result()) for city_name, future in zip(city_names, futures)]
+
+
+async def async_weather_for_city(client, city_name, today=None, deadline=None):
+    try:
+        coordinates = await async_geocode(client, city_name, deadline)
+        if coordinates is None:
+            return None, "City not found"
+        forecast, stale_since = await async_fetch_onecall(client, *coordinates, deadline)
+        return forecast_context(city_name, forecast, today, stale_since), None
+    except UpstreamUnavailable as e:
+        logger.warning("Weather service unavailable for %s: %s", city_name, e)
+        return None, "Weather service unavailable"
+    except (httpx.HTTPError, WeatherDataError, KeyError, ValueError) as e:
+        logger.error("Error fetching weather for %s: %s", city_name, e)
+        return None, "Weather data unavailable"
+
+
+async def async_weather_for_cities(client, city_names):
+    today = datetime.datetime.now()
+    deadline = new_deadline()
+    results = await asyncio.gather(*(async_weather_for_city(client, city_name, today, deadline)
+                                     for city_name in city_names))
+    return [(city_name, *result) for city_name, result in zip(city_names, results)]